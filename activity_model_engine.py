@@ -1,58 +1,74 @@
 import json
 import os
-from datetime import datetime
-from geopy.distance import geodesic
+from datetime import datetime, timedelta
 import numpy as np
+import heapq
 import random
+from collections import namedtuple
+
+from data_store import DataStore, to_epoch
+from geo_distance import distance_km, many_to_many, one_to_many
+from interval_index import ScheduleIntervalIndex
+import metrics
+
+# Bộ đếm gắn nhãn sẵn cho các hàm gọi nhiều lần trên đường xử lý yêu cầu
+_OVERLAP_CALLS = {kind: metrics.OVERLAP_CALLS.labels(kind) for kind in ("vector", "scalar")}
+_OVERLAP_PAIRS = {kind: metrics.OVERLAP_PAIRS.labels(kind) for kind in ("vector", "scalar")}
+
+# Trọng số của điểm tổng hợp
+W_TIME = 0.25
+W_LOC = 0.2
+W_BIAS = 0.55
+
+# Lịch trình của mọi match của một người dùng, gom thành mảng phẳng theo từng match:
+# lịch trình của match_ids[m] nằm trong [offsets[m], offsets[m + 1]).
+# intervals: ScheduleIntervalIndex trên các mảng đó, mỗi match là một nhóm.
+MatchContext = namedtuple("MatchContext", ["matches", "match_ids", "match_scores", "offsets", "starts", "ends", "lats", "lons", "intervals"])
+
+# Kết quả chấm điểm theo lô. contributions[c, m] = match_scores[m] * overlap tốt nhất của ứng viên c với match m
+ScoredCandidates = namedtuple("ScoredCandidates", ["scores", "breakdowns", "target_matches", "contributions", "match_ids"])
+
+# Trạng thái xếp hạng của một to-do, giữ lại để xếp hạng lại nhanh khi có match rút lui
+# (xem rank_with_state / rerank_without_matches).
+RankingState = namedtuple("RankingState", ["candidates", "partial", "sim_time", "sim_loc", "contributions", "context", "target_match_id"])
 
 # --- 0. HÀM HỖ TRỢ ĐỂ TẢI DỮ LIỆU ---
-def load_data():
+def load_data(data_dir=None):
     """
+    Nếu COLUMNAR_SNAPSHOT trỏ tới một snapshot dạng cột -> mở bằng memory map (xem columnar_store).
     Nếu USE_FIREBASE=1 -> đọc Firestore.
-    Ngược lại -> fallback đọc từ JSON local.
+    Ngược lại -> fallback đọc từ JSON local trong data_dir (mặc định: biến môi trường DATA_DIR hoặc thư mục hiện tại).
+    Trả về một DataStore đã được đánh chỉ mục.
     """
+    snapshot_dir = os.getenv("COLUMNAR_SNAPSHOT")
+    if snapshot_dir:
+        print(f"🗂️ Loading data from columnar snapshot '{snapshot_dir}'...")
+        from columnar_store import load_columnar
+        return load_columnar(snapshot_dir)
+
     if os.getenv("USE_FIREBASE", "0") == "1":
         print("🔗 Loading data from Firestore...")
-        from firebase_client import init_firebase
-        db = init_firebase()
-
-        # POIs
-        pois = []
-        for doc in db.collection("pois").stream():
-            d = doc.to_dict()
-            d.setdefault("poi_id", doc.id)
-            pois.append(d)
-
-        # Users
-        users = []
-        for doc in db.collection("users").stream():
-            d = doc.to_dict()
-            d.setdefault("user_id", doc.id)
-            users.append(d)
-
-        # Schedules
-        schedules = []
-        for doc in db.collection("daily_schedules").stream():
-            d = doc.to_dict()
-            d.setdefault("schedule_id", doc.id)
-            # Chuẩn hoá timestamp Firestore
-            for k in ("start_time", "end_time"):
-                v = d.get(k)
-                if hasattr(v, "isoformat"):  # Firestore Timestamp
-                    d[k] = v.isoformat()
-            schedules.append(d)
-
-        return pois, users, schedules
+        # Tải song song, chỉ lấy các trường cần dùng, có snapshot cục bộ (xem firestore_loader)
+        from firestore_loader import load_collections
+        pois, users, schedules = load_collections()
+        return DataStore(pois, users, schedules)
 
     else:
         print("📂 Loading data from local JSON...")
-        with open("pois.json", "r", encoding="utf-8") as f:
-            pois = json.load(f)
-        with open("users.json", "r", encoding="utf-8") as f:
-            users = json.load(f)
-        with open("daily_schedules.json", "r", encoding="utf-8") as f:
-            schedules = json.load(f)
-        return pois, users, schedules
+        data_dir = data_dir or os.getenv("DATA_DIR", ".")
+        pois = _read_records(data_dir, "pois")
+        users = _read_records(data_dir, "users")
+        schedules = _read_records(data_dir, "daily_schedules")
+        return DataStore(pois, users, schedules)
+
+def _read_records(data_dir, name):
+    """Đọc <name>.json (mảng JSON); nếu không có thì đọc <name>.jsonl (JSON Lines, vd. từ generate_data --mode vectorized)."""
+    path = os.path.join(data_dir, f"{name}.json")
+    if os.path.exists(path) or not os.path.exists(path + "l"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    with open(path + "l", "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
 
 # --- 1. CÁC HÀM TÍNH TOÁN THÀNH PHẦN ---
 
@@ -61,6 +77,8 @@ def calculate_time_overlap(start_time1, end_time1, start_time2, end_time2):
     Tính điểm chồng chéo thời gian (sim_time) giữa hai khoảng thời gian.
     Trả về điểm từ 0 đến 1.
     """
+    _OVERLAP_CALLS["scalar"].inc()
+    _OVERLAP_PAIRS["scalar"].inc()
     st1, et1 = datetime.fromisoformat(start_time1), datetime.fromisoformat(end_time1)
     st2, et2 = datetime.fromisoformat(start_time2), datetime.fromisoformat(end_time2)
     overlap_start = max(st1, st2)
@@ -80,45 +98,98 @@ def calculate_location_score(loc1, loc2, radius_km=5):
     """
     coords1 = (loc1['latitude'], loc1['longitude'])
     coords2 = (loc2['latitude'], loc2['longitude'])
-    distance_km = geodesic(coords1, coords2).kilometers
-    score = np.exp(-distance_km / radius_km)
+    score = np.exp(-distance_km(coords1, coords2) / radius_km)
     return score
 
+def time_overlap(cand_start, cand_end, starts, ends):
+    """
+    Bản vector hoá của calculate_time_overlap trên epoch (giây).
+    So sánh một khoảng [cand_start, cand_end] với mọi khoảng [starts[i], ends[i]]
+    và trả về mảng điểm từ 0 đến 1 trong một lần gọi.
+    """
+    overlap = np.minimum(cand_end, ends) - np.maximum(cand_start, starts)
+    longest = np.maximum(np.subtract(cand_end, cand_start), np.subtract(ends, starts))
+    mask = (overlap > 0) & (longest > 0)
+    scores = np.zeros(mask.shape, dtype=np.float64)
+    np.divide(overlap, longest, out=scores, where=mask)
+    _OVERLAP_CALLS["vector"].inc()
+    _OVERLAP_PAIRS["vector"].inc(scores.size)
+    return scores
+
+def location_scores(loc, lats, lons, radius_km=5):
+    """Bản vector hoá của calculate_location_score: một vị trí so với mảng toạ độ."""
+    return np.exp(-one_to_many(loc['latitude'], loc['longitude'], lats, lons) / radius_km)
+
+def best_overlap_with_schedules(cand_start, cand_end, location, arrays, intervals=None):
+    """
+    Điểm overlap tốt nhất (0.5 * time + 0.5 * loc) giữa một ứng viên
+    và các lịch trình (ScheduleArrays) của một cặp đôi.
+    Với intervals (ScheduleIntervalIndex của cặp đôi, vd. store.schedule_intervals_of), chỉ các lịch
+    trình chồng thời gian được so sánh đầy đủ; phần còn lại chỉ góp 0.5 * loc tốt nhất (đã ghi nhớ).
+    """
+    if arrays.starts.size == 0:
+        return 0.0
+    if intervals is None:
+        time_o = time_overlap(cand_start, cand_end, arrays.starts, arrays.ends)
+        loc_o = location_scores(location, arrays.lats, arrays.lons)
+        return max(0.0, float(np.max(0.5 * time_o + 0.5 * loc_o)))
+    best = 0.5 * float(intervals.best_location_scores([location["latitude"]], [location["longitude"]])[0, 0])
+    hits = intervals.overlapping(cand_start, cand_end)
+    if hits.size:
+        time_o = time_overlap(cand_start, cand_end, arrays.starts[hits], arrays.ends[hits])
+        loc_o = location_scores(location, arrays.lats[hits], arrays.lons[hits])
+        best = max(best, float(np.max(0.5 * time_o + 0.5 * loc_o)))
+    return max(0.0, best)
+
 # --- 2. HÀM TẠO ỨNG VIÊN NHIỆM VỤ (PHIÊN BẢN NÂNG CẤP) ---
 
-def find_best_potential_match(original_todo, user_profile, all_schedules, all_users):
+def find_best_potential_match(original_todo, user_profile, store, context=None):
     """
     Tìm ra cặp đôi có tiềm năng gặp gỡ cao nhất cho một to-do cụ thể.
     Trả về (match_info, target_schedule) hoặc (None, None).
+    Có thể truyền sẵn MatchContext để dùng lại giữa nhiều to-do của cùng người dùng.
     """
-    user = next((u for u in all_users if u["user_id"] == user_profile["user_id"]), None)
-    if not user:
+    if context is None:
+        context = build_match_context(user_profile, store)
+    if not context.match_ids:
         return None, None
-    best_match_info = None
-    best_target_schedule = None
-    max_potential_score = 0.0
-    for match in user["match_list"]:
-        match_id = match["match_id"]
-        match_score = match["score"]
-        match_schedules_today = [s for s in all_schedules if s["user_id"] == match_id]
-        for match_schedule in match_schedules_today:
-            location_overlap = calculate_location_score(original_todo["location"], match_schedule["location"])
-            potential_score = match_score * location_overlap
-            if potential_score > max_potential_score:
-                max_potential_score = potential_score
-                best_match_info = match
-                best_target_schedule = match_schedule
-    if max_potential_score > 0.5:
-        return best_match_info, best_target_schedule
+    # Duyệt phẳng (match, lịch trình) theo đúng thứ tự; argmax lấy phần tử lớn nhất xuất hiện đầu tiên
+    counts = np.diff(context.offsets)
+    potential_scores = np.repeat(context.match_scores, counts) * location_scores(
+        original_todo["location"], context.lats, context.lons
+    )
+    best = int(np.argmax(potential_scores))
+    if potential_scores[best] > 0.5:
+        m = int(np.searchsorted(context.offsets, best, side="right")) - 1
+        target_schedule = store.schedules_of(context.match_ids[m])[best - context.offsets[m]]
+        return context.matches[m], target_schedule
     return None, None
 
-def generate_quest_candidates(original_todo, all_pois, user_profile, all_schedules, all_users, radius_km=5):
+def meeting_opportunities(user_profile, store, limit=None):
+    """
+    Cơ hội gặp gỡ tốt nhất của người dùng với từng match, đọc thẳng từ bảng tính sẵn
+    (store.match_graph) thay vì so lại mọi cặp lịch trình ở mỗi yêu cầu.
+    Xếp theo match_score × overlap giảm dần; xem MatchGraph.opportunities_of.
+    """
+    return store.match_graph.opportunities_of(user_profile["user_id"], store, limit=limit)
+
+def _cached_pois_within(store, poi_cache, point, radius_km, categories):
+    """pois_within có ghi nhớ (poi_cache là dict dùng chung trong một lô yêu cầu)."""
+    if poi_cache is None:
+        return store.pois_within(point, radius_km, categories)
+    key = (point["latitude"], point["longitude"], radius_km, tuple(categories))
+    if key not in poi_cache:
+        poi_cache[key] = store.pois_within(point, radius_km, categories)
+    return poi_cache[key]
+
+def generate_quest_candidates(original_todo, user_profile, store, radius_km=5, context=None, poi_cache=None):
     """
     Tạo danh sách các nhiệm vụ ứng viên từ một to-do gốc,
     bao gồm cả các hoạt động đệm giao thoa.
+    context (MatchContext) và poi_cache cho phép dùng lại kết quả tra cứu giữa nhiều to-do.
     """
     candidates = []
-    poi_goc = next((p for p in all_pois if p["poi_id"] == original_todo["poi_id"]), None)
+    poi_goc = store.get_poi(original_todo["poi_id"])
     if not poi_goc:
         return []
 
@@ -132,77 +203,66 @@ def generate_quest_candidates(original_todo, all_pois, user_profile, all_schedul
     # CHIẾN LƯỢC 2: THAY THẾ ĐỊA ĐIỂM CÙNG LOẠI
     category_goc = poi_goc["category"]
     user_location = user_profile["home_location"]
-    for poi in all_pois:
-        if poi["category"] == category_goc and poi["poi_id"] != poi_goc["poi_id"]:
-            coords_user = (user_location['latitude'], user_location['longitude'])
-            coords_poi = (poi['latitude'], poi['longitude'])
-            if geodesic(coords_user, coords_poi).kilometers <= radius_km:
-                candidates.append({
-                    "candidate_id": f"CANDIDATE_ALT_{poi['poi_id']}", "type": "main_activity",
-                    "origin_todo_id": original_todo["schedule_id"], "start_time": original_todo["start_time"],
-                    "end_time": original_todo["end_time"], "poi_id": poi["poi_id"],
-                    "location": {"latitude": poi["latitude"], "longitude": poi["longitude"]}
-                })
+    for poi, _ in _cached_pois_within(store, poi_cache, user_location, radius_km, [category_goc]):
+        if poi["poi_id"] != poi_goc["poi_id"]:
+            candidates.append({
+                "candidate_id": f"CANDIDATE_ALT_{poi['poi_id']}", "type": "main_activity",
+                "origin_todo_id": original_todo["schedule_id"], "start_time": original_todo["start_time"],
+                "end_time": original_todo["end_time"], "poi_id": poi["poi_id"],
+                "location": {"latitude": poi["latitude"], "longitude": poi["longitude"]}
+            })
 
     # CHIẾN LƯỢC 4: GỢI Ý HOẠT ĐỘNG ĐỆM GIAO THOA
-    target_match, target_schedule = find_best_potential_match(original_todo, user_profile, all_schedules, all_users)
-    if target_match:
-        target_poi = next((p for p in all_pois if p["poi_id"] == target_schedule["poi_id"]), None)
+    _, target_schedule = find_best_potential_match(original_todo, user_profile, store, context)
+    candidates.extend(_buffer_candidates(original_todo, category_goc, target_schedule, store, poi_cache))
+    metrics.CANDIDATES.inc(len(candidates))
+    return candidates
+
+def _buffer_candidates(original_todo, category_goc, target_schedule, store, poi_cache=None):
+    """Các hoạt động đệm (chiến lược 4) gần lịch trình của cặp đôi mục tiêu."""
+    candidates = []
+    if target_schedule:
+        target_poi = store.get_poi(target_schedule["poi_id"])
         if target_poi and target_poi["category"] != category_goc:
             LIGHTWEIGHT_CATEGORIES = ['cafe', 'convenience_store', 'tea_house', 'bookstore']
-            target_coords = (target_poi['latitude'], target_poi['longitude'])
-            for poi in all_pois:
-                if poi["category"] in LIGHTWEIGHT_CATEGORIES:
-                    poi_coords = (poi['latitude'], poi['longitude'])
-                    if geodesic(target_coords, poi_coords).kilometers <= 0.2:
-                        original_start_time = datetime.fromisoformat(original_todo["start_time"])
-                        buffer_start_time = original_start_time - timedelta(minutes=30)
-                        buffer_end_time = original_start_time - timedelta(minutes=5)
-                        candidates.append({
-                            "candidate_id": f"CANDIDATE_BUFFER_{poi['poi_id']}", "type": "buffer_activity",
-                            "origin_todo_id": original_todo["schedule_id"], "start_time": buffer_start_time.isoformat(),
-                            "end_time": buffer_end_time.isoformat(), "poi_id": poi["poi_id"],
-                            "location": {"latitude": poi["latitude"], "longitude": poi["longitude"]}
-                        })
+            for poi, _ in _cached_pois_within(store, poi_cache, target_poi, 0.2, LIGHTWEIGHT_CATEGORIES):
+                original_start_time = datetime.fromisoformat(original_todo["start_time"])
+                buffer_start_time = original_start_time - timedelta(minutes=30)
+                buffer_end_time = original_start_time - timedelta(minutes=5)
+                candidates.append({
+                    "candidate_id": f"CANDIDATE_BUFFER_{poi['poi_id']}", "type": "buffer_activity",
+                    "origin_todo_id": original_todo["schedule_id"], "start_time": buffer_start_time.isoformat(),
+                    "end_time": buffer_end_time.isoformat(), "poi_id": poi["poi_id"],
+                    "location": {"latitude": poi["latitude"], "longitude": poi["longitude"]}
+                })
     return candidates
 
 # --- 3. CÁC HÀM CHẤM ĐIỂM ---
 
-def calculate_match_bias(quest_candidate, user_profile, all_schedules, all_users):
+def calculate_match_bias(quest_candidate, user_profile, store):
     """
     Tính điểm thiên vị hẹn hò (bias_match) cho một nhiệm vụ.
     """
     total_bias_score = 0.0
-    user = next((u for u in all_users if u["user_id"] == user_profile["user_id"]), None)
+    user = store.get_user(user_profile["user_id"])
     if not user:
         return 0.0
+    # Parse thời gian của ứng viên một lần, sau đó so sánh vector hoá với lịch trình của từng match
+    cand_start, cand_end = to_epoch(quest_candidate["start_time"]), to_epoch(quest_candidate["end_time"])
     for match in user["match_list"]:
-        match_id = match["match_id"]
-        match_score = match["score"]
-        match_schedules_today = [s for s in all_schedules if s["user_id"] == match_id]
-        if match_schedules_today:
-            best_overlap_for_this_match = 0
-            for match_schedule in match_schedules_today:
-                time_overlap = calculate_time_overlap(
-                    quest_candidate["start_time"], quest_candidate["end_time"],
-                    match_schedule["start_time"], match_schedule["end_time"]
-                )
-                location_overlap = calculate_location_score(quest_candidate["location"], match_schedule["location"])
-                overlap_score = 0.5 * time_overlap + 0.5 * location_overlap
-                if overlap_score > best_overlap_for_this_match:
-                    best_overlap_for_this_match = overlap_score
-            potential_score = match_score * best_overlap_for_this_match
+        arrays = store.schedule_arrays_of(match["match_id"])
+        if arrays.starts.size:
+            best_overlap_for_this_match = best_overlap_with_schedules(
+                cand_start, cand_end, quest_candidate["location"], arrays, store.schedule_intervals_of(match["match_id"])
+            )
+            potential_score = match["score"] * best_overlap_for_this_match
             total_bias_score += potential_score
     return total_bias_score
 
-def score_quest(quest_candidate, original_todo, user_profile, all_schedules, all_users):
+def score_quest(quest_candidate, original_todo, user_profile, store):
     """
     Tính điểm tổng hợp cuối cùng cho một ứng viên nhiệm vụ.
     """
-    W_TIME = 0.25
-    W_LOC = 0.2
-    W_BIAS = 0.55
-
     # Điều chỉnh `sim_time` và `sim_loc` cho hoạt động đệm
     if quest_candidate.get("type") == "buffer_activity":
         # Hoạt động đệm không nên bị phạt vì thời gian khác.
@@ -217,20 +277,375 @@ def score_quest(quest_candidate, original_todo, user_profile, all_schedules, all
         )
         sim_loc = calculate_location_score(quest_candidate["location"], original_todo["location"])
 
-    bias_match = calculate_match_bias(quest_candidate, user_profile, all_schedules, all_users)
+    bias_match = calculate_match_bias(quest_candidate, user_profile, store)
     final_score = (W_TIME * sim_time) + (W_LOC * sim_loc) + (W_BIAS * bias_match)
     
     scores_breakdown = {"sim_time": sim_time, "sim_loc": sim_loc, "bias_match": bias_match}
     return final_score, scores_breakdown
 
+def build_match_context(user_profile, store):
+    """
+    Gom lịch trình của các match (có lịch trình) của người dùng thành MatchContext.
+    Match không có lịch trình không đóng góp vào bias nên được bỏ qua.
+    """
+    user = store.get_user(user_profile["user_id"])
+    matches, match_ids, match_scores, blocks = [], [], [], []
+    for match in (user["match_list"] if user else []):
+        arrays = store.schedule_arrays_of(match["match_id"])
+        if arrays.starts.size:
+            matches.append(match)
+            match_ids.append(match["match_id"])
+            match_scores.append(match["score"])
+            blocks.append(arrays)
+    offsets = np.zeros(len(blocks) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([b.starts.size for b in blocks])
+
+    def _concat(field, dtype):
+        return np.concatenate([getattr(b, field) for b in blocks]) if blocks else np.empty(0, dtype=dtype)
+
+    return _match_context(
+        matches, match_ids, np.array(match_scores, dtype=np.float64), offsets,
+        _concat("starts", np.int64), _concat("ends", np.int64), _concat("lats", np.float64), _concat("lons", np.float64),
+    )
+
+def _match_context(matches, match_ids, match_scores, offsets, starts, ends, lats, lons):
+    return MatchContext(
+        matches=matches,
+        match_ids=match_ids,
+        match_scores=match_scores,
+        offsets=offsets,
+        starts=starts,
+        ends=ends,
+        lats=lats,
+        lons=lons,
+        intervals=ScheduleIntervalIndex(starts, ends, lats, lons, offsets),
+    )
+
+# Giới hạn số MatchContext được giữ trong store.match_context_cache
+MATCH_CONTEXT_CACHE_SIZE = 100_000
+
+def cached_match_context(user_profile, store):
+    """
+    MatchContext của người dùng, được ghi nhớ trong store.match_context_cache.
+    DataStore tự xoá entry khi lịch trình của người dùng hoặc của các match của họ thay đổi.
+    """
+    user_id = user_profile["user_id"]
+    context = store.match_context_cache.get(user_id)
+    metrics.record_cache("match_context", context is not None)
+    if context is None:
+        context = build_match_context(user_profile, store)
+        if len(store.match_context_cache) >= MATCH_CONTEXT_CACHE_SIZE:
+            # Bỏ entry cũ nhất (dict giữ thứ tự chèn)
+            store.match_context_cache.pop(next(iter(store.match_context_cache)))
+        store.match_context_cache[user_id] = context
+    return context
+
+def _candidate_arrays(candidates):
+    """Parse thời gian và toạ độ của các ứng viên một lần thành mảng NumPy."""
+    starts = np.array([to_epoch(c["start_time"]) for c in candidates], dtype=np.int64)
+    ends = np.array([to_epoch(c["end_time"]) for c in candidates], dtype=np.int64)
+    lats = np.array([c["location"]["latitude"] for c in candidates], dtype=np.float64)
+    lons = np.array([c["location"]["longitude"] for c in candidates], dtype=np.float64)
+    is_buffer = np.array([c.get("type") == "buffer_activity" for c in candidates], dtype=bool)
+    return starts, ends, lats, lons, is_buffer
+
+def _base_similarity(starts, ends, lats, lons, is_buffer, original_todo):
+    """
+    sim_time / sim_loc so với to-do gốc (hoạt động đệm: sim_time cố định, bán kính 2km).
+    Trả về thêm khoảng cách ứng viên -> to-do gốc để tái sử dụng.
+    """
+    todo_loc = original_todo["location"]
+    sim_time = np.where(
+        is_buffer, 0.9,
+        time_overlap(starts, ends, to_epoch(original_todo["start_time"]), to_epoch(original_todo["end_time"]))
+    )
+    todo_dist = one_to_many(todo_loc["latitude"], todo_loc["longitude"], lats, lons)
+    sim_loc = np.exp(-todo_dist / np.where(is_buffer, 2.0, 5.0))
+    return sim_time, sim_loc, todo_dist
+
+# Với tối đa chừng này lịch trình trong MatchContext, _match_contributions dựng thẳng ma trận đầy đủ
+DENSE_CONTRIBUTIONS_MAX_SCHEDULES = 128
+
+def _match_contributions(starts, ends, lats, lons, context):
+    """
+    Ma trận đóng góp (n × số match) = điểm match × overlap tốt nhất với lịch trình của match đó.
+
+    Khi có nhiều lịch trình (lịch nhiều ngày): lịch trình không chồng thời gian với ứng viên chỉ
+    góp 0.5 * loc, nên overlap tốt nhất là
+    max(0.5 * loc tốt nhất của match (ghi nhớ theo vị trí trong context.intervals),
+        max(0.5 * time + 0.5 * loc) trên các lịch trình chồng thời gian).
+    Các lịch trình chồng thời gian được lấy từ chỉ mục khoảng thời gian, một lần cho mỗi khung giờ
+    khác nhau của ứng viên (ứng viên chính dùng chung khung giờ của to-do gốc).
+    """
+    n, n_matches = starts.size, len(context.match_ids)
+    if not (n and n_matches):
+        return np.zeros((n, n_matches), dtype=np.float64)
+    if context.starts.size <= DENSE_CONTRIBUTIONS_MAX_SCHEDULES:
+        # Ít lịch trình: ma trận đầy đủ (n × S) rẻ hơn chi phí tra chỉ mục, cho cùng kết quả
+        time_o = time_overlap(starts[:, None], ends[:, None], context.starts[None, :], context.ends[None, :])
+        loc_o = np.exp(-many_to_many(lats, lons, context.lats, context.lons) / 5)
+        overlap = 0.5 * time_o + 0.5 * loc_o
+        best_overlap = np.maximum(np.maximum.reduceat(overlap, context.offsets[:-1], axis=1), 0.0)
+        return best_overlap * context.match_scores[None, :]
+    intervals = context.intervals
+    best_overlap = 0.5 * intervals.best_location_scores(lats, lons)
+    windows = {}
+    for i, window in enumerate(zip(starts.tolist(), ends.tolist())):
+        windows.setdefault(window, []).append(i)
+    for (cand_start, cand_end), rows in windows.items():
+        hits = intervals.overlapping(cand_start, cand_end)
+        if hits.size == 0:
+            continue
+        time_o = time_overlap(cand_start, cand_end, context.starts[hits], context.ends[hits])
+        loc_o = np.exp(-many_to_many(lats[rows], lons[rows], context.lats[hits], context.lons[hits]) / 5)
+        overlap = 0.5 * time_o[None, :] + 0.5 * loc_o
+        # hits tăng dần nên đã gom theo match: lấy max trong từng đoạn liên tiếp cùng match
+        groups = intervals.group_of[hits]
+        seg_starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+        cell = np.ix_(rows, groups[seg_starts])
+        best_overlap[cell] = np.maximum(best_overlap[cell], np.maximum.reduceat(overlap, seg_starts, axis=1))
+    return np.maximum(best_overlap, 0.0) * context.match_scores[None, :]
+
+def _target_match(contribution_row, match_ids):
+    """Match đóng góp nhiều nhất (None nếu không match nào đóng góp)."""
+    if not match_ids:
+        return None
+    col = int(np.argmax(contribution_row))
+    return {"match_id": match_ids[col]} if contribution_row[col] > 0 else None
+
+def score_candidates(candidates, original_todo, user_profile, store, context=None):
+    """
+    Chấm điểm toàn bộ ứng viên trong một lượt: dựng ma trận (ứng viên × lịch trình của các match)
+    một lần, tính sim_time, sim_loc, bias_match bằng phép toán mảng.
+    Trả về ScoredCandidates với điểm, breakdown và match đóng góp nhiều nhất cho từng ứng viên
+    (cùng kết quả với score_quest + find_target_match_for_quest).
+    """
+    if context is None:
+        context = build_match_context(user_profile, store)
+    starts, ends, lats, lons, is_buffer = _candidate_arrays(candidates)
+    sim_time, sim_loc, _ = _base_similarity(starts, ends, lats, lons, is_buffer, original_todo)
+    contributions = _match_contributions(starts, ends, lats, lons, context)
+    bias_match = contributions.sum(axis=1)
+    scores = W_TIME * sim_time + W_LOC * sim_loc + W_BIAS * bias_match
+
+    breakdowns = [
+        {"sim_time": float(t), "sim_loc": float(l), "bias_match": float(b)}
+        for t, l, b in zip(sim_time, sim_loc, bias_match)
+    ]
+    target_matches = [_target_match(row, context.match_ids) for row in contributions]
+    return ScoredCandidates(scores, breakdowns, target_matches, contributions, context.match_ids)
+
+def rank_candidates(candidates, original_todo, user_profile, store):
+    """
+    Chấm điểm theo lô, gắn final_score / scores_breakdown / associatedMatch vào từng ứng viên
+    và trả về danh sách đã sắp xếp giảm dần theo điểm.
+    """
+    scored = score_candidates(candidates, original_todo, user_profile, store)
+    for cand, final_score, breakdown, target_match in zip(candidates, scored.scores, scored.breakdowns, scored.target_matches):
+        cand['final_score'] = float(final_score)
+        cand['scores_breakdown'] = breakdown
+        cand['associatedMatch'] = target_match
+    return sorted(candidates, key=lambda x: x['final_score'], reverse=True)
+
+def _bias_upper_bounds(starts, ends, todo_dist, original_todo, context):
+    """
+    Cận trên rẻ của bias_match cho từng ứng viên, không cần ma trận khoảng cách ứng viên × lịch trình.
+
+    Với mỗi match m: overlap tốt nhất ≤ 0.5 * max time_overlap + 0.5 * max loc_score.
+      - time: chỉ phụ thuộc khung giờ của ứng viên, nên tính một lần cho mỗi khung giờ khác nhau
+        (mọi ứng viên chính dùng chung khung giờ của to-do gốc).
+      - loc: theo bất đẳng thức tam giác, d(ứng viên, s) ≥ d(to-do, s) - d(ứng viên, to-do).
+    """
+    n, n_matches = starts.size, len(context.match_ids)
+    if not (n and n_matches):
+        return np.zeros(n, dtype=np.float64)
+    windows, window_idx = np.unique(np.stack([starts, ends], axis=1), axis=0, return_inverse=True)
+    time_o = time_overlap(windows[:, :1], windows[:, 1:], context.starts[None, :], context.ends[None, :])
+    max_time = np.maximum.reduceat(time_o, context.offsets[:-1], axis=1)[window_idx.ravel()]
+
+    todo_loc = original_todo["location"]
+    sched_dist = one_to_many(todo_loc["latitude"], todo_loc["longitude"], context.lats, context.lons)
+    min_dist = np.minimum.reduceat(sched_dist, context.offsets[:-1])
+    # Chừa một biên nhỏ cho sai số làm tròn của phép xấp xỉ khoảng cách
+    lower_dist = np.maximum(min_dist[None, :] - todo_dist[:, None], 0.0) * (1 - 1e-6)
+    max_loc = np.exp(-lower_dist / 5)
+    return ((0.5 * max_time + 0.5 * max_loc) * context.match_scores[None, :]).sum(axis=1)
+
+def top_k_quests(candidates, original_todo, user_profile, store, k=3, chunk_size=16, context=None):
+    """
+    Lấy top-k ứng viên bằng branch-and-bound thay vì chấm điểm đầy đủ rồi sắp xếp cả danh sách.
+
+    sim_time và sim_loc rẻ nên được tính chính xác cho mọi ứng viên; bias_match được thay bằng
+    cận trên rẻ (xem _bias_upper_bounds, luôn ≤ tổng điểm các match). Ứng viên được duyệt theo cận
+    trên giảm dần và chỉ tính bias đầy đủ khi cận trên còn vượt điểm thấp nhất trong heap top-k.
+    Trả về (top_k, stats) với top_k giống hệt rank_candidates(...)[:k] và
+    stats = {"total", "scored", "pruned"}.
+    """
+    n = len(candidates)
+    if context is None:
+        context = build_match_context(user_profile, store)
+    with metrics.stage("bias_scoring"):
+        starts, ends, lats, lons, is_buffer = _candidate_arrays(candidates)
+        sim_time, sim_loc, todo_dist = _base_similarity(starts, ends, lats, lons, is_buffer, original_todo)
+        partial = W_TIME * sim_time + W_LOC * sim_loc
+        upper_bounds = partial + W_BIAS * _bias_upper_bounds(starts, ends, todo_dist, original_todo, context)
+
+        # Heap nhỏ nhất theo (điểm, -chỉ số): phần tử đầu là ứng viên "tệ nhất" đang nằm trong top-k.
+        # Khi hoà điểm, ứng viên đứng trước trong danh sách được ưu tiên như khi sort ổn định.
+        heap, results, scored = [], {}, 0
+        order = np.argsort(-upper_bounds, kind="stable")
+        for chunk_start in range(0, n, chunk_size):
+            chunk = order[chunk_start:chunk_start + chunk_size]
+            if len(heap) == k:
+                chunk = chunk[upper_bounds[chunk] >= heap[0][0]]
+                if chunk.size == 0:
+                    break
+            contributions = _match_contributions(starts[chunk], ends[chunk], lats[chunk], lons[chunk], context)
+            bias_match = contributions.sum(axis=1)
+            scored += chunk.size
+            for idx, bias, row in zip(chunk, bias_match, contributions):
+                final_score = float(partial[idx] + W_BIAS * bias)
+                results[int(idx)] = (final_score, float(bias), row)
+                entry = (final_score, -int(idx))
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+    metrics.CANDIDATES_SCORED.inc(scored)
+    metrics.CANDIDATES_PRUNED.inc(n - scored)
+
+    top = []
+    with metrics.stage("target_match"):
+        for final_score, neg_idx in sorted(heap, reverse=True):
+            idx = -neg_idx
+            _, bias, row = results[idx]
+            cand = candidates[idx]
+            cand['final_score'] = final_score
+            cand['scores_breakdown'] = {"sim_time": float(sim_time[idx]), "sim_loc": float(sim_loc[idx]), "bias_match": bias}
+            cand['associatedMatch'] = _target_match(row, context.match_ids)
+            top.append(cand)
+    return top, {"total": n, "scored": scored, "pruned": n - scored}
+
+def _context_without(context, removed_match_ids):
+    """MatchContext con sau khi bỏ các match trong removed_match_ids (cắt mảng, không dựng lại)."""
+    keep = [m for m, match_id in enumerate(context.match_ids) if match_id not in removed_match_ids]
+    counts = np.diff(context.offsets)[keep]
+    offsets = np.zeros(len(keep) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    rows = np.concatenate([np.arange(context.offsets[m], context.offsets[m + 1]) for m in keep]) if keep else np.empty(0, dtype=np.int64)
+    return _match_context(
+        [context.matches[m] for m in keep],
+        [context.match_ids[m] for m in keep],
+        context.match_scores[keep],
+        offsets,
+        context.starts[rows],
+        context.ends[rows],
+        context.lats[rows],
+        context.lons[rows],
+    ), keep
+
+def _rank_from_state(state):
+    """Gắn điểm vào ứng viên từ RankingState và trả về danh sách đã sắp xếp (giống rank_candidates)."""
+    bias_match = state.contributions.sum(axis=1)
+    scores = state.partial + W_BIAS * bias_match
+    for idx, cand in enumerate(state.candidates):
+        cand['final_score'] = float(scores[idx])
+        cand['scores_breakdown'] = {
+            "sim_time": float(state.sim_time[idx]), "sim_loc": float(state.sim_loc[idx]), "bias_match": float(bias_match[idx])
+        }
+        cand['associatedMatch'] = _target_match(state.contributions[idx], state.context.match_ids)
+    return sorted(state.candidates, key=lambda x: x['final_score'], reverse=True)
+
+def _scored_state(candidates, original_todo, context, target_match_id):
+    starts, ends, lats, lons, is_buffer = _candidate_arrays(candidates)
+    sim_time, sim_loc, _ = _base_similarity(starts, ends, lats, lons, is_buffer, original_todo)
+    return RankingState(
+        candidates=candidates,
+        partial=W_TIME * sim_time + W_LOC * sim_loc,
+        sim_time=sim_time,
+        sim_loc=sim_loc,
+        contributions=_match_contributions(starts, ends, lats, lons, context),
+        context=context,
+        target_match_id=target_match_id,
+    )
+
+def rank_with_state(original_todo, user_profile, store, context=None, poi_cache=None, candidates=None):
+    """
+    Tạo ứng viên + chấm điểm + sắp xếp như generate_quest_candidates + rank_candidates,
+    đồng thời trả về RankingState (đóng góp của từng match cho từng ứng viên) để
+    rerank_without_matches có thể xếp hạng lại mà không chạy lại toàn bộ.
+    Có thể truyền sẵn candidates (kết quả generate_quest_candidates với cùng context).
+    Trả về (ranked, state).
+    """
+    if context is None:
+        context = build_match_context(user_profile, store)
+    if candidates is None:
+        candidates = generate_quest_candidates(original_todo, user_profile, store, context=context, poi_cache=poi_cache)
+    if not candidates:
+        return [], None
+    target_match, _ = find_best_potential_match(original_todo, user_profile, store, context)
+    state = _scored_state(candidates, original_todo, context, target_match["match_id"] if target_match else None)
+    return _rank_from_state(state), state
+
+def rerank_without_matches(state, removed_match_ids, original_todo, store, poi_cache=None):
+    """
+    Xếp hạng lại khi một hoặc nhiều match không còn tham gia, cho cùng kết quả với việc chạy lại
+    toàn bộ trên dữ liệu đã bỏ lịch trình của các match đó:
+      - bias_match: bỏ các cột đóng góp của match bị loại rồi cộng lại, không tính lại khoảng cách;
+      - hoạt động đệm: chỉ tạo lại khi cặp đôi mục tiêu của chiến lược 4 nằm trong số bị loại
+        (argmax trên tập con không đổi nếu phần tử lớn nhất vẫn còn).
+    Trả về (ranked, new_state).
+    """
+    removed = set(removed_match_ids)
+    if state is None:
+        return [], None
+    # Sao chép ứng viên để không ghi đè điểm của kết quả xếp hạng trước đó
+    state = state._replace(candidates=[dict(c) for c in state.candidates])
+    if not removed.intersection(state.context.match_ids):
+        return _rank_from_state(state), state
+
+    context, keep = _context_without(state.context, removed)
+    contributions = state.contributions[:, keep]
+    if state.target_match_id not in removed:
+        new_state = state._replace(contributions=contributions, context=context)
+        return _rank_from_state(new_state), new_state
+
+    # Cặp đôi mục tiêu bị loại: giữ các ứng viên chính, tạo lại hoạt động đệm cho mục tiêu mới
+    n_main = sum(1 for c in state.candidates if c.get("type") != "buffer_activity")
+    target_match, target_schedule = find_best_potential_match(original_todo, None, store, context)
+    category_goc = store.get_poi(original_todo["poi_id"])["category"]
+    buffers = _buffer_candidates(original_todo, category_goc, target_schedule, store, poi_cache)
+    main_state = state._replace(
+        candidates=state.candidates[:n_main],
+        partial=state.partial[:n_main],
+        sim_time=state.sim_time[:n_main],
+        sim_loc=state.sim_loc[:n_main],
+        contributions=contributions[:n_main],
+    )
+    target_match_id = target_match["match_id"] if target_match else None
+    if buffers:
+        buffer_state = _scored_state(buffers, original_todo, context, target_match_id)
+        new_state = RankingState(
+            candidates=main_state.candidates + buffers,
+            partial=np.concatenate([main_state.partial, buffer_state.partial]),
+            sim_time=np.concatenate([main_state.sim_time, buffer_state.sim_time]),
+            sim_loc=np.concatenate([main_state.sim_loc, buffer_state.sim_loc]),
+            contributions=np.concatenate([main_state.contributions, buffer_state.contributions]),
+            context=context,
+            target_match_id=target_match_id,
+        )
+    else:
+        new_state = main_state._replace(context=context, target_match_id=target_match_id)
+    return _rank_from_state(new_state), new_state
+
 # --- HÀM CHÍNH ĐỂ CHẠY THỬ NGHIỆM ---
 if __name__ == "__main__":
     print("Bắt đầu Giai đoạn 1 (Nâng cấp) của Kế hoạch Gió Lốc: Xây Dựng Lõi Mô Hình...")
-    all_pois, all_users, all_schedules = load_data()
+    store = load_data()
     print("-> Đã tải thành công dữ liệu từ các file JSON.")
 
-    test_user_profile = random.choice(all_users)
-    user_schedule = [s for s in all_schedules if s["user_id"] == test_user_profile["user_id"]]
+    test_user_profile = random.choice(store.users)
+    user_schedule = store.schedules_of(test_user_profile["user_id"])
     
     if not user_schedule:
         print(f"Người dùng {test_user_profile['user_id']} được chọn không có lịch trình. Vui lòng chạy lại.")
@@ -238,25 +653,18 @@ if __name__ == "__main__":
         test_todo = random.choice(user_schedule)
         print(f"\n--- Thử nghiệm với người dùng: {test_user_profile['user_id']} ---")
         print(f"To-Do Gốc: '{test_todo['description']}' lúc {datetime.fromisoformat(test_todo['start_time']).strftime('%H:%M')}")
-        poi_goc_name = next((p["name"] for p in all_pois if p["poi_id"] == test_todo["poi_id"]), "Không rõ")
+        poi_goc_name = (store.get_poi(test_todo["poi_id"]) or {}).get("name", "Không rõ")
         print(f"Tại: {poi_goc_name}")
 
         # CẬP NHẬT LỜI GỌI HÀM
-        candidates = generate_quest_candidates(test_todo, all_pois, test_user_profile, all_schedules, all_users)
+        candidates = generate_quest_candidates(test_todo, test_user_profile, store)
         print(f"\n-> Đã tạo ra {len(candidates)} ứng viên nhiệm vụ (bao gồm cả hoạt động đệm nếu có).")
 
-        scored_candidates = []
-        for cand in candidates:
-            final_score, breakdown = score_quest(cand, test_todo, test_user_profile, all_schedules, all_users)
-            cand['final_score'] = final_score
-            cand['scores_breakdown'] = breakdown
-            scored_candidates.append(cand)
-            
-        sorted_candidates = sorted(scored_candidates, key=lambda x: x['final_score'], reverse=True)
+        sorted_candidates = rank_candidates(candidates, test_todo, test_user_profile, store)
 
         print("\n--- KẾT QUẢ GỢI Ý (TOP 5) ---")
         for i, quest in enumerate(sorted_candidates[:5]):
-            poi_name = next((p["name"] for p in all_pois if p["poi_id"] == quest["poi_id"]), "Không rõ")
+            poi_name = (store.get_poi(quest["poi_id"]) or {}).get("name", "Không rõ")
             quest_type = f"({quest.get('type', 'main_activity')})"
             print(f"\n{i+1}. Gợi ý đến: {poi_name} {quest_type}")
             print(f"   - Thời gian: {datetime.fromisoformat(quest['start_time']).strftime('%H:%M')}")
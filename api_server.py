@@ -1,125 +1,447 @@
+import contextlib
+import functools
 import json
 import os
-from flask import Flask, request, jsonify
-import traceback
+import threading
+import uuid
+from collections import defaultdict
+import time
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 
 # Import các thành phần cốt lõi từ các file của chúng ta
 from activity_model_engine import (
     load_data,
-    generate_quest_candidates,
-    score_quest
+    cached_match_context,
+    meeting_opportunities
 )
+import metrics
 from content_generator import ContentGenerator
-from run_scenarios import find_optimal_scenario
+from memory_stats import process_memory
+from precompute_suggestions import DEFAULT_OUTPUT, load_precomputed
+from response_cache import ResponseCache
+from suggestion_pipeline import build_suggestions, todo_fingerprint
 
 # --- 1. KHỞI TẠO ỨNG DỤNG VÀ TẢI DỮ LIỆU ---
 
-print("Khởi động API Server cho Kế hoạch Gió Lốc...")
+log = metrics.get_logger("api_server")
+log.info("Khởi động API Server cho Kế hoạch Gió Lốc...", extra=metrics.UNSAMPLED)
 
 app = Flask(__name__)
 
 # Tải toàn bộ dữ liệu mô phỏng MỘT LẦN DUY NHẤT khi server khởi động
 # Điều này giúp API phản hồi nhanh hơn vì không phải đọc file mỗi lần có yêu cầu
-all_pois, all_users, all_schedules = load_data()
+store = load_data()
 content_gen = ContentGenerator()
 
-print("-> Dữ liệu và Content Generator đã được tải và sẵn sàng!")
+# Gợi ý đã tính sẵn bởi precompute_suggestions.py (chỉ dùng khi data_version còn khớp)
+precomputed = load_precomputed(os.getenv("PRECOMPUTED_SUGGESTIONS", DEFAULT_OUTPUT), store)
+# Khi dữ liệu thay đổi qua API, chỉ bỏ gợi ý tính sẵn của những người dùng bị ảnh hưởng
+store.add_invalidation_listener(precomputed.invalidate_users)
+
+
+
+class ReadWriteLock:
+    """
+    Khoá đọc / ghi: nhiều yêu cầu đọc chạy song song, thao tác ghi chạy một mình. Các hàm add_ / update_ /
+    remove_ / cancel_ của store sửa tại chỗ (danh sách lịch trình, MatchScenarioIndex, MatchGraph), nên
+    yêu cầu đọc không được chạy xen vào giữa một lần ghi. Ưu tiên ghi: khi có thao tác ghi đang chờ,
+    yêu cầu đọc mới phải đợi để thao tác ghi không bị bỏ đói.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+# Các thao tác ghi được thực hiện tuần tự và không xen vào các yêu cầu đang đọc store
+store_lock = ReadWriteLock()
+# Thay đổi dữ liệu chỉ áp dụng cho store của tiến trình hiện tại: khi chạy nhiều worker (gunicorn.conf.py
+# đặt API_READ_ONLY=1 nếu WEB_CONCURRENCY > 1) các endpoint ghi bị tắt để mọi worker trả lời giống nhau
+READ_ONLY = os.getenv("API_READ_ONLY", "0") == "1"
+if READ_ONLY:
+    log.info("Chế độ chỉ đọc: các endpoint thay đổi dữ liệu trả về 501", extra=metrics.UNSAMPLED)
+
+# Cache response của /suggest, khoá theo (user_id, hash to-do, store.revision)
+suggest_cache = ResponseCache(
+    max_bytes=int(float(os.getenv("SUGGEST_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    ttl_s=float(os.getenv("SUGGEST_CACHE_TTL_S", "300")),
+)
+metrics.REGISTRY.register_cache("suggest_response", suggest_cache.stats)
+
+log.info("-> Dữ liệu và Content Generator đã được tải và sẵn sàng!", extra=metrics.UNSAMPLED)
+
+
+# --- 1b. ĐO ĐẠC THEO YÊU CẦU ---
+# Mỗi yêu cầu: thời gian + mã trạng thái vào /metrics, thời gian từng giai đoạn vào header
+# Server-Timing. Khi PROFILE_DIR được đặt, yêu cầu có header "X-Profile: 1" được chạy dưới cProfile.
+
+@app.before_request
+def _start_instrumentation():
+    g.started = time.perf_counter()
+    metrics.begin_request()
+    g.profiler = metrics.start_profile() if request.headers.get("X-Profile") == "1" else None
+
+
+@app.after_request
+def _finish_instrumentation(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    elapsed = time.perf_counter() - g.started
+    metrics.REQUEST_SECONDS.labels(endpoint).observe(elapsed)
+    metrics.REQUESTS.labels(endpoint, str(response.status_code)).inc()
+    timings = metrics.end_request()
+    timings["total"] = elapsed
+    response.headers["Server-Timing"] = metrics.server_timing(timings)
+    if g.profiler is not None:
+        response.headers["X-Profile-File"] = metrics.dump_profile(g.profiler, endpoint)
+    return response
 
 
 # --- 2. ĐỊNH NGHĨA API ENDPOINT ---
 
+def _cached_response(entry):
+    """Trả về 304 nếu client đã có đúng phiên bản (If-None-Match), ngược lại trả body kèm ETag."""
+    if request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, mimetype="application/json")
+    response.set_etag(entry.etag)
+    return response
+
+
+def _reading(view):
+    """Chạy view trong khoá đọc của store (xem ReadWriteLock)."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with store_lock.read():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def _check_keys(user_id, todo):
+    """user_id và todo['schedule_id'] được dùng làm khoá tra cứu: TypeError / KeyError nếu không phải chuỗi."""
+    if not isinstance(user_id, str):
+        raise TypeError(f"user_id phải là chuỗi, nhận được {type(user_id).__name__}")
+    if not isinstance(todo, dict):
+        raise TypeError(f"todo phải là object, nhận được {type(todo).__name__}")
+    if not isinstance(todo['schedule_id'], str):
+        raise TypeError(f"todo['schedule_id'] phải là chuỗi, nhận được {type(todo['schedule_id']).__name__}")
+
+
 @app.route('/suggest', methods=['POST'])
+@_reading
 def suggest_activity():
     """
     Đây là endpoint chính để nhận yêu cầu và trả về gợi ý.
     """
-    print("\nNhận được yêu cầu mới tại /suggest...")
-
     # --- 2a. Nhận và kiểm tra dữ liệu đầu vào ---
     try:
         input_data = request.get_json()
         user_id = input_data['user_id']
         original_todo = input_data['todo'] # Mong muốn có cấu trúc giống như trong daily_schedules.json
-        print(f"Yêu cầu cho người dùng: {user_id}")
-        print(f"Với to-do: {original_todo['description']}")
+        _check_keys(user_id, original_todo)
+        log.debug("/suggest cho người dùng %s, to-do '%s'", user_id, original_todo['description'])
     except (TypeError, KeyError) as e:
-        print(f"Lỗi: Dữ liệu đầu vào không hợp lệ - {e}")
+        log.info("/suggest: dữ liệu đầu vào không hợp lệ - %s", e)
         # Trả về lỗi 400 Bad Request
         return jsonify({"error": "Dữ liệu đầu vào không hợp lệ. Cần có 'user_id' và 'todo'."}), 400
 
     # --- 2b. Tìm hồ sơ người dùng ---
-    user_profile = next((u for u in all_users if u["user_id"] == user_id), None)
+    user_profile = store.get_user(user_id)
     if not user_profile:
-        print(f"Lỗi: Không tìm thấy người dùng với ID: {user_id}")
+        log.info("/suggest: không tìm thấy người dùng với ID %s", user_id)
         return jsonify({"error": f"Không tìm thấy người dùng với ID: {user_id}"}), 404
 
-    # --- 2c. Chạy lõi mô hình ---
-    try:
-        # Tạo ứng viên
-        candidates = generate_quest_candidates(original_todo, all_pois, user_profile, all_schedules, all_users)
-        
-        # Chấm điểm
-        scored_candidates = []
-        for cand in candidates:
-            final_score, breakdown = score_quest(cand, original_todo, user_profile, all_schedules, all_users)
-            cand['final_score'] = final_score
-            cand['scores_breakdown'] = breakdown
-            scored_candidates.append(cand)
-            
-        # Sắp xếp
-        sorted_candidates = sorted(scored_candidates, key=lambda x: x['final_score'], reverse=True)
-        
-        # Lấy top 3 gợi ý
-        top_3_suggestions = sorted_candidates[:3]
+    # --- 2c. Trả từ cache nếu cùng người dùng, cùng to-do và dữ liệu chưa thay đổi ---
+    cache_key = (user_id, todo_fingerprint(original_todo), store.revision)
+    entry = suggest_cache.get(cache_key)
+    if entry is not None:
+        metrics.SUGGESTION_SOURCE.labels("cache").inc()
+        log.debug("/suggest %s: trả về từ cache", user_id)
+        return _cached_response(entry)
 
+    # --- 2d. Dùng kết quả tính sẵn nếu to-do khớp, ngược lại chạy lõi mô hình ---
+    try:
+        response_data = precomputed.lookup(user_id, original_todo)
+        metrics.record_cache("precomputed", response_data is not None)
+        if response_data is not None:
+            metrics.SUGGESTION_SOURCE.labels("precomputed").inc()
+            log.debug("/suggest %s: trả về %d gợi ý đã tính sẵn", user_id, len(response_data))
+        else:
+            response_data, rank_stats = build_suggestions(user_profile, original_todo, store, content_gen)
+            metrics.SUGGESTION_SOURCE.labels("model").inc()
+            log.info("/suggest %s: %d gợi ý, %d ứng viên, chấm đầy đủ %d, loại sớm %d",
+                     user_id, len(response_data), rank_stats['total'], rank_stats['scored'], rank_stats['pruned'])
     except Exception as e:
-        print(f"Lỗi trong quá trình xử lý của mô hình: {e}")
-        traceback.print_exc() 
+        log.exception("/suggest %s: lỗi trong quá trình xử lý của mô hình: %s", user_id, e)
         return jsonify({"error": str(e)}), 500
 
-    # --- 2d. Tạo nội dung và định dạng output ---
-    response_data = []
-    for quest_struct in top_3_suggestions:
-        # Tìm lại cặp đôi mục tiêu cho mỗi gợi ý để tạo hint tốt nhất
-        # (Logic này có thể được tối ưu hóa trong tương lai)
-        from run_scenarios import find_target_match_for_quest # Tạm thời import từ đây
-        target_match = find_target_match_for_quest(quest_struct, user_profile, all_schedules, all_users)
-        quest_struct['associatedMatch'] = target_match
-        
-        # Tạo nội dung
-        content = content_gen.generate_quest_content(quest_struct, all_pois, all_schedules, all_users)
-        
-        # Đóng gói kết quả
-        response_data.append({
-            "quest_details": quest_struct, # Giữ lại dữ liệu gốc để debug hoặc dùng ở client
-            "display_content": content     # Dữ liệu sạch để hiển thị
-        })
-
-    print(f"-> Đã xử lý xong. Trả về {len(response_data)} gợi ý.")
-    return jsonify(response_data)
+    entry = suggest_cache.put(cache_key, jsonify(response_data).get_data())
+    return _cached_response(entry)
+
+
+@app.route('/suggest/batch', methods=['POST'])
+def suggest_batch():
+    """
+    Nhận nhiều cặp {user_id, todo} trong một yêu cầu: {"items": [{"user_id": ..., "todo": ...}, ...]}.
+    Các item được gom theo người dùng (dùng chung MatchContext) và theo ô lưới của vị trí to-do
+    (dùng chung kết quả tra cứu POI), rồi trả về dạng NDJSON: mỗi dòng là kết quả của một item,
+    kèm "index" trỏ về vị trí trong yêu cầu. Kết quả được stream ngay khi từng item xử lý xong.
+    """
+    input_data = request.get_json(silent=True)
+    items = input_data.get("items") if isinstance(input_data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": "Dữ liệu đầu vào không hợp lệ. Cần có 'items' là danh sách các {user_id, todo}."}), 400
+    log.info("/suggest/batch với %d item", len(items))
+
+    invalid = []
+    by_user = defaultdict(list)
+    for index, item in enumerate(items):
+        try:
+            user_id, todo = item['user_id'], item['todo']
+            _check_keys(user_id, todo)
+            location = todo['location']
+            cell = store.poi_index.cell_of(location['latitude'], location['longitude'])
+        except (TypeError, KeyError):
+            invalid.append(index)
+            continue
+        by_user[user_id].append((cell, index, todo))
+
+    def _line(payload):
+        return json.dumps(payload, ensure_ascii=False) + "\n"
+
+    def results():
+        for index in invalid:
+            yield _line({"index": index, "status": 400, "error": "Item không hợp lệ. Cần có 'user_id' và 'todo'."})
+
+        poi_cache = {}
+        for user_id, entries in by_user.items():
+            # Mỗi nhóm người dùng được xử lý trong khoá đọc; các dòng kết quả được gửi sau khi nhả khoá
+            # để một client đọc chậm không giữ khoá (và chặn các thao tác ghi)
+            with store_lock.read():
+                lines = list(user_results(user_id, entries, poi_cache))
+            yield from lines
+
+    def user_results(user_id, entries, poi_cache):
+        user_profile = store.get_user(user_id)
+        if not user_profile:
+            for _, index, _ in entries:
+                yield _line({"index": index, "status": 404, "error": f"Không tìm thấy người dùng với ID: {user_id}"})
+            return
+
+        context = None
+        for _, index, todo in sorted(entries, key=lambda e: (e[0], e[1])):
+            try:
+                suggestions = precomputed.lookup(user_id, todo)
+                metrics.record_cache("precomputed", suggestions is not None)
+                if suggestions is None:
+                    if context is None:
+                        context = cached_match_context(user_profile, store)
+                    suggestions, _ = build_suggestions(
+                        user_profile, todo, store, content_gen, context=context, poi_cache=poi_cache
+                    )
+                yield _line({"index": index, "status": 200, "user_id": user_id, "suggestions": suggestions})
+            except Exception as e:
+                log.exception("/suggest/batch %s: lỗi trong quá trình xử lý của mô hình: %s", user_id, e)
+                yield _line({"index": index, "status": 500, "error": str(e)})
+
+    started = g.started
+
+    def generate():
+        # Phần thân được stream sau after_request (bộ đếm giai đoạn của yêu cầu đã đóng), nên mở lại
+        # bộ đếm cho phần này; thời gian theo giai đoạn được ghi vào log thay cho header Server-Timing
+        metrics.begin_request()
+        try:
+            yield from results()
+        finally:
+            timings = metrics.end_request()
+            timings["total"] = time.perf_counter() - started
+            metrics.STAGE_SECONDS.labels("batch_stream").observe(timings["total"])
+            log.info("/suggest/batch xong %d item: %s", len(items), metrics.server_timing(timings))
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 
 @app.route('/match', methods=['GET'])
+@_reading
 def find_match():
-    """Trả về một cặp đôi phù hợp nhất (nếu có)."""
+    """
+    Trả về top-N cặp đôi phù hợp, xếp hạng theo match_score × proximity, có phân trang.
+    Query params: min_match_score (0.85), max_distance_km (1.5), page (1), page_size (10, tối đa 100).
+    Có user_id: trả về cơ hội gặp gỡ tính sẵn của người dùng đó với từng match của họ
+    (xếp theo match_score × overlap), lọc theo min_match_score / max_distance_km như trên.
+    """
     try:
-        user_A, todo_A, match_B, schedule_B = find_optimal_scenario(all_users, all_schedules, all_pois)
-
-        if not user_A:
-            return jsonify({"message": "Không tìm thấy cặp đôi phù hợp"}), 200
-
-        return jsonify({
-            "user_A": user_A,
-            "todo_A": todo_A,
-            "match_B": match_B,
-            "schedule_B": schedule_B
-        }), 200
+        min_match_score = float(request.args.get("min_match_score", 0.85))
+        max_distance_km = float(request.args.get("max_distance_km", 1.5))
+        page = int(request.args.get("page", 1))
+        page_size = min(int(request.args.get("page_size", 10)), 100)
+        user_id = request.args.get("user_id")
+        if user_id is not None:
+            user_profile = store.get_user(user_id)
+            if not user_profile:
+                return jsonify({"error": f"Không tìm thấy người dùng với ID: {user_id}"}), 404
+            if page < 1 or page_size < 1:
+                raise ValueError("page và page_size phải >= 1")
+            opportunities = [
+                o for o in meeting_opportunities(user_profile, store)
+                if o["match"]["score"] >= min_match_score and o["distance_km"] <= max_distance_km
+            ]
+            total = len(opportunities)
+            scenarios = opportunities[(page - 1) * page_size: page * page_size]
+        else:
+            scenarios, total = store.match_index.query(
+                min_match_score=min_match_score, max_distance_km=max_distance_km, page=page, page_size=page_size
+            )
+    except ValueError as e:
+        return jsonify({"error": f"Tham số không hợp lệ: {e}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    response = {"results": scenarios, "page": page, "page_size": page_size, "total": total}
+    if total == 0:
+        response["message"] = "Không tìm thấy cặp đôi phù hợp"
+    return jsonify(response), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_report():
+    """Số liệu của worker hiện tại ở định dạng Prometheus (thời gian theo giai đoạn, bộ đếm, cache)."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route('/debug/cache', methods=['GET'])
+def cache_report():
+    """Số entry, dung lượng và hit / miss của cache /suggest trong worker hiện tại."""
+    return jsonify(suggest_cache.stats()), 200
+
+
+@app.route('/debug/memory', methods=['GET'])
+def memory_report():
+    """RSS / PSS và tỉ lệ bộ nhớ dùng chung của worker đang xử lý yêu cầu (xem gunicorn.conf.py)."""
+    stats = process_memory()
+    if stats is None:
+        return jsonify({"error": "Không đọc được thống kê bộ nhớ trên hệ điều hành này"}), 501
+    return jsonify(stats), 200
+
+
+# --- 3. THAY ĐỔI DỮ LIỆU (người dùng / lịch trình) ---
+# Mỗi thao tác chỉ cập nhật chỉ mục và bỏ cache của những người dùng bị ảnh hưởng,
+# rồi trả về {"revision": ..., "affected_users": [...]}. Ở chế độ chỉ đọc (READ_ONLY) trả về 501.
+
+def _writable(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if READ_ONLY:
+            return jsonify({"error": "Server đang chạy nhiều worker ở chế độ chỉ đọc; hãy cập nhật dữ liệu gốc "
+                                     "(JSON / Firestore / snapshot) rồi khởi động lại."}), 501
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _apply_mutation(mutate, *args, status=200, extra=None):
+    try:
+        with store_lock.write():
+            affected = mutate(*args)
+            revision = store.revision
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    log.info("Dữ liệu đã thay đổi (revision %d), %d người dùng bị ảnh hưởng", revision, len(affected))
+    return jsonify({**(extra or {}), "revision": revision, "affected_users": sorted(affected)}), status
+
+
+def _json_body():
+    body = request.get_json(silent=True)
+    return body if isinstance(body, dict) else None
+
+
+@app.route('/users', methods=['POST'])
+@_writable
+def create_user():
+    user = _json_body()
+    if user is None:
+        return jsonify({"error": "Dữ liệu đầu vào không hợp lệ. Cần một object người dùng."}), 400
+    user.setdefault("match_list", [])
+    if store.get_user(user.get("user_id")) is not None:
+        return jsonify({"error": f"Người dùng {user['user_id']} đã tồn tại"}), 409
+    return _apply_mutation(store.add_user, user, status=201)
+
+
+@app.route('/users/<user_id>', methods=['PUT'])
+@_writable
+def update_user(user_id):
+    fields = _json_body()
+    if fields is None:
+        return jsonify({"error": "Dữ liệu đầu vào không hợp lệ. Cần một object chứa các trường cần cập nhật."}), 400
+    return _apply_mutation(store.update_user, user_id, fields)
+
+
+@app.route('/users/<user_id>', methods=['DELETE'])
+@_writable
+def delete_user(user_id):
+    return _apply_mutation(store.remove_user, user_id)
+
+
+@app.route('/schedules', methods=['POST'])
+@_writable
+def create_schedule():
+    schedule = _json_body()
+    if schedule is None:
+        return jsonify({"error": "Dữ liệu đầu vào không hợp lệ. Cần một object lịch trình."}), 400
+    schedule.setdefault("schedule_id", str(uuid.uuid4()))
+    if store.get_schedule(schedule["schedule_id"]) is not None:
+        return jsonify({"error": f"Lịch trình {schedule['schedule_id']} đã tồn tại"}), 409
+    return _apply_mutation(store.add_schedule, schedule, status=201, extra={"schedule_id": schedule["schedule_id"]})
+
+
+@app.route('/schedules/<schedule_id>', methods=['PUT'])
+@_writable
+def update_schedule(schedule_id):
+    fields = _json_body()
+    if fields is None:
+        return jsonify({"error": "Dữ liệu đầu vào không hợp lệ. Cần một object chứa các trường cần cập nhật."}), 400
+    return _apply_mutation(store.update_schedule, schedule_id, fields)
+
+
+@app.route('/schedules/<schedule_id>', methods=['DELETE'])
+@_writable
+def cancel_schedule(schedule_id):
+    return _apply_mutation(store.cancel_schedule, schedule_id)
 
 
-# --- 3. CHẠY SERVER ---
+# --- 4. CHẠY SERVER ---
 
 if __name__ == '__main__':
     # Chạy server ở chế độ debug để dễ dàng theo dõi lỗi
@@ -0,0 +1,235 @@
+"""
+Bộ benchmark cho từng giai đoạn của pipeline, trên các bộ dữ liệu sinh theo schema của generate_data.
+
+Mỗi kích thước dữ liệu chạy trong một tiến trình con riêng (bộ nhớ không cộng dồn giữa các lần).
+Các giai đoạn được đo:
+    load_data, generate_quest_candidates, score_quest, find_target_match_for_quest,
+    generate_quest_content, find_optimal_scenario (lần đầu gồm dựng chỉ mục / các lần sau),
+    /suggest end-to-end qua Flask test client (không dùng kết quả tính sẵn và cache response).
+
+Kết quả ghi ra JSON. Với --baseline, mỗi giai đoạn được so với baseline theo p50 và chương trình
+thoát với mã 1 nếu có giai đoạn chậm hơn quá --threshold.
+
+Cách dùng:
+    python benchmark.py --sizes 300,10000 --output bench_results.json
+    python benchmark.py --sizes 300,10000 --baseline bench_baseline.json --threshold 0.25
+    python benchmark.py --compare bench_results.json --baseline bench_baseline.json
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_SIZES = "300,10000,100000,1000000"
+DEFAULT_DATA_ROOT = "bench_data"
+# Chênh lệch tuyệt đối nhỏ hơn mức này (ms) được coi là nhiễu khi so với baseline
+MIN_REGRESSION_MS = 0.05
+
+
+# --- 1. SINH DỮ LIỆU ---
+
+def ensure_dataset(num_users, data_root=DEFAULT_DATA_ROOT, seed=42):
+    """Sinh (một lần) bộ dữ liệu num_users người dùng bằng các hàm của generate_data. Trả về thư mục."""
+    import generate_data
+
+    data_dir = os.path.join(data_root, f"users_{num_users}")
+    marker = os.path.join(data_dir, ".complete")
+    if os.path.exists(marker):
+        return data_dir
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"-> Sinh bộ dữ liệu {num_users} người dùng vào '{data_dir}'...")
+    random.seed(seed)
+    pois = generate_data.create_pois_real_data()
+    users = generate_data.create_users(num_users)
+    schedules = generate_data.create_schedules(users, pois)
+    for name, records in (("pois.json", pois), ("users.json", users), ("daily_schedules.json", schedules)):
+        with open(os.path.join(data_dir, name), "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+    open(marker, "w").close()
+    return data_dir
+
+
+# --- 2. ĐO TỪNG GIAI ĐOẠN (chạy trong tiến trình con) ---
+
+def _summary(durations):
+    ms = np.array(durations, dtype=np.float64) * 1000
+    return {
+        "n": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "total_s": float(ms.sum() / 1000),
+    }
+
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def run_stages(data_dir, samples=200, seed=0):
+    """Đo mọi giai đoạn trên bộ dữ liệu trong data_dir. Trả về {giai đoạn: thống kê}."""
+    os.environ["DATA_DIR"] = data_dir
+    # /suggest phải chạy lõi mô hình thật: không có file tính sẵn, cache response không lưu gì
+    os.environ["PRECOMPUTED_SUGGESTIONS"] = os.path.join(data_dir, "no_precomputed.jsonl")
+    os.environ["SUGGEST_CACHE_MAX_MB"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from activity_model_engine import load_data, generate_quest_candidates, score_quest
+    results = {}
+
+    store, elapsed = _timed(load_data)
+    results["load_data"] = _summary([elapsed])
+    del store
+    gc.collect()
+
+    # api_server tự tải dữ liệu khi import; các giai đoạn còn lại dùng chung store đó
+    import api_server
+    from run_scenarios import find_optimal_scenario, find_target_match_for_quest
+    store, content_gen = api_server.store, api_server.content_gen
+    client = api_server.app.test_client()
+
+    rng = random.Random(seed)
+    todos = rng.sample(store.schedules, min(samples, len(store.schedules)))
+    timings = {name: [] for name in (
+        "generate_quest_candidates", "score_quest", "find_target_match_for_quest", "generate_quest_content", "suggest"
+    )}
+    for todo in todos:
+        user = store.get_user(todo["user_id"])
+        if user is None:
+            continue
+        candidates, elapsed = _timed(generate_quest_candidates, todo, user, store)
+        timings["generate_quest_candidates"].append(elapsed)
+        for cand in candidates:
+            _, elapsed = _timed(score_quest, cand, todo, user, store)
+            timings["score_quest"].append(elapsed)
+            target, elapsed = _timed(find_target_match_for_quest, cand, user, store)
+            timings["find_target_match_for_quest"].append(elapsed)
+            cand["associatedMatch"] = target
+            _, elapsed = _timed(content_gen.generate_quest_content, cand, store)
+            timings["generate_quest_content"].append(elapsed)
+        response, elapsed = _timed(client.post, "/suggest", json={"user_id": user["user_id"], "todo": todo})
+        if response.status_code != 200:
+            raise RuntimeError(f"/suggest trả về {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        timings["suggest"].append(elapsed)
+    for name, durations in timings.items():
+        if durations:
+            results[name] = _summary(durations)
+
+    _, elapsed = _timed(find_optimal_scenario, store)
+    results["find_optimal_scenario_cold"] = _summary([elapsed])
+    results["find_optimal_scenario"] = _summary([_timed(find_optimal_scenario, store)[1] for _ in range(20)])
+    return results
+
+
+# --- 3. SO SÁNH VỚI BASELINE ---
+
+def compare(current, baseline, threshold):
+    """In bảng so sánh p50 theo từng (kích thước, giai đoạn). Trả về danh sách các giai đoạn bị chậm đi."""
+    regressions = []
+    print(f"\n{'kích thước':>10} {'giai đoạn':<30} {'baseline ms':>12} {'hiện tại ms':>12} {'thay đổi':>9}")
+    for size, stages in current["results"].items():
+        base_stages = baseline.get("results", {}).get(size, {})
+        for stage, stats in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                continue
+            old, new = base["p50_ms"], stats["p50_ms"]
+            change = (new - old) / old if old > 0 else 0.0
+            regressed = change > threshold and new - old > MIN_REGRESSION_MS
+            flag = "  ❌" if regressed else ""
+            print(f"{size:>10} {stage:<30} {old:>12.3f} {new:>12.3f} {change:>+8.0%}{flag}")
+            if regressed:
+                regressions.append((size, stage, change))
+    return regressions
+
+
+# --- 4. CHƯƠNG TRÌNH CHÍNH ---
+
+def _environment():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        revision = ""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_revision": revision,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run(sizes, samples, data_root, seed):
+    results = {}
+    for size in sizes:
+        data_dir = ensure_dataset(size, data_root)
+        print(f"-> Benchmark {size} người dùng...")
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            worker_output = tmp.name
+        try:
+            subprocess.run(
+                [sys.executable, __file__, "--worker", data_dir, "--worker-output", worker_output,
+                 "--samples", str(samples), "--seed", str(seed)],
+                check=True,
+            )
+            with open(worker_output, "r", encoding="utf-8") as f:
+                results[str(size)] = json.load(f)
+        finally:
+            os.remove(worker_output)
+        for stage, stats in results[str(size)].items():
+            print(f"   {stage:<30} p50 {stats['p50_ms']:9.3f} ms | p95 {stats['p95_ms']:9.3f} ms | n={stats['n']}")
+    return {"environment": _environment(), "samples": samples, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark từng giai đoạn của pipeline gợi ý.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Các kích thước dữ liệu (số người dùng), cách nhau bởi dấu phẩy")
+    parser.add_argument("--samples", type=int, default=200, help="Số to-do được lấy mẫu cho mỗi kích thước (mặc định: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed chọn to-do mẫu (mặc định: %(default)s)")
+    parser.add_argument("--data-root", default=DEFAULT_DATA_ROOT, help="Thư mục chứa dữ liệu sinh ra (mặc định: %(default)s)")
+    parser.add_argument("--output", default="bench_results.json", help="File JSON kết quả (mặc định: %(default)s)")
+    parser.add_argument("--baseline", help="File JSON kết quả trước đó để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Tỉ lệ chậm đi tối đa cho phép so với baseline (mặc định: %(default)s)")
+    parser.add_argument("--compare", help="Chỉ so sánh file kết quả này với --baseline, không chạy benchmark")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Tiến trình con: log của server / engine không được lẫn vào output của benchmark
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            stage_results = run_stages(args.worker, samples=args.samples, seed=args.seed)
+        with open(args.worker_output, "w", encoding="utf-8") as f:
+            json.dump(stage_results, f)
+        sys.exit(0)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+        current = run(sizes, args.samples, args.data_root, args.seed)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"-> Đã ghi kết quả vào '{args.output}'.")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} giai đoạn chậm hơn baseline quá {args.threshold:.0%}.")
+            sys.exit(1)
+        print("\n✅ Không có giai đoạn nào chậm hơn baseline quá ngưỡng.")
@@ -0,0 +1,382 @@
+"""
+Snapshot dạng cột (NumPy .npy, mở bằng memory map) cho pois / users / schedules.
+
+Thay vì json.load toàn bộ dữ liệu thành dict lồng nhau, snapshot lưu mỗi trường thành một mảng:
+  - id (user / schedule / POI) và chuỗi lặp lại (gender, description, category...) được intern
+    thành mã số nguyên int32 trỏ vào bảng chuỗi;
+  - toạ độ float64, thời gian epoch int64 (kèm độ lệch múi giờ để khôi phục đúng chuỗi ISO);
+  - match_list dạng CSR: match_offsets / match_indices / match_scores;
+  - lịch trình được xếp theo người dùng (giữ thứ tự gốc trong từng người dùng), nên
+    ScheduleArrays của một người dùng chỉ là lát cắt (view) của các mảng memory map.
+
+ColumnarDataStore mở snapshot gần như không tốn chi phí parse: dict của người dùng / lịch trình chỉ
+được dựng khi được truy cập. Các trang của file được hệ điều hành chia sẻ giữa các worker gunicorn.
+Khi có thao tác ghi (add_/update_/remove_/cancel_), store chuyển sang dict thường như DataStore.
+
+Cách dùng:
+    python columnar_store.py --out data_columnar      # xuất từ dữ liệu load_data() hiện tại
+    COLUMNAR_SNAPSHOT=data_columnar python api_server.py
+"""
+import argparse
+import json
+import os
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from data_store import DataStore, ScheduleArrays, to_epoch
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+# Độ lệch múi giờ (phút) đánh dấu chuỗi ISO không có múi giờ
+NAIVE_OFFSET = np.iinfo(np.int16).min
+
+
+# --- 1. XUẤT SNAPSHOT ---
+
+def _intern(values):
+    """Intern danh sách chuỗi (None = thiếu). Trả về (mã int32, bảng chuỗi); thiếu -> -1."""
+    table, codes = {}, np.empty(len(values), dtype=np.int32)
+    for i, v in enumerate(values):
+        codes[i] = -1 if v is None else table.setdefault(v, len(table))
+    return codes, np.array(list(table), dtype=str)
+
+
+def _utc_offset_minutes(iso_string):
+    tzinfo = datetime.fromisoformat(iso_string).tzinfo
+    if tzinfo is None:
+        return NAIVE_OFFSET
+    return int(tzinfo.utcoffset(None).total_seconds() // 60)
+
+
+def _format_time(epoch, offset_minutes):
+    if offset_minutes == NAIVE_OFFSET:
+        return datetime.fromtimestamp(int(epoch), tz=timezone.utc).replace(tzinfo=None).isoformat()
+    return datetime.fromtimestamp(int(epoch), tz=timezone(timedelta(minutes=int(offset_minutes)))).isoformat()
+
+
+def poi_columns(pois, extra_poi_ids=()):
+    """
+    Các cột của POI. poi_ids gồm id của pois rồi tới các id chỉ xuất hiện trong extra_poi_ids
+    (vd. poi_id của lịch trình không có trong danh sách POI). Trả về (poi_id -> mã, {tên cột: mảng}).
+    """
+    poi_codes = {p["poi_id"]: i for i, p in enumerate(pois)}
+    for poi_id in extra_poi_ids:
+        poi_codes.setdefault(poi_id, len(poi_codes))
+    arrays = {
+        "poi_ids": np.array(list(poi_codes), dtype=str),
+        "poi_lat": np.array([p["latitude"] for p in pois], dtype=np.float64),
+        "poi_lon": np.array([p["longitude"] for p in pois], dtype=np.float64),
+    }
+    for field in ("name", "category", "type", "district"):
+        arrays[f"poi_{field}"], arrays[f"poi_{field}_table"] = _intern([p.get(field) for p in pois])
+    return poi_codes, arrays
+
+
+def export_columnar(store, out_dir):
+    """
+    Ghi snapshot dạng cột của store vào out_dir. meta.json được ghi sau cùng, nên một thư mục
+    không có meta.json (bị ngắt giữa chừng) sẽ không bao giờ được mở.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    arrays = {}
+
+    poi_codes, poi_arrays = poi_columns(store.pois, (s["poi_id"] for s in store.schedules))
+    arrays.update(poi_arrays)
+
+    # Người dùng: id của người dùng trước, sau đó là id chỉ xuất hiện trong match_list
+    user_codes = {u["user_id"]: i for i, u in enumerate(store.users)}
+    for u in store.users:
+        for m in u["match_list"]:
+            user_codes.setdefault(m["match_id"], len(user_codes))
+    for s in store.schedules:
+        user_codes.setdefault(s["user_id"], len(user_codes))
+    user_ids = np.array(list(user_codes), dtype=str)
+    arrays["user_ids"] = user_ids
+    arrays["user_ids_sorted"] = np.argsort(user_ids, kind="stable").astype(np.int32)
+    arrays["home_lat"] = np.array([u["home_location"]["latitude"] for u in store.users], dtype=np.float64)
+    arrays["home_lon"] = np.array([u["home_location"]["longitude"] for u in store.users], dtype=np.float64)
+    arrays["gender"], arrays["gender_table"] = _intern([u.get("gender") for u in store.users])
+    match_counts = [len(u["match_list"]) for u in store.users]
+    arrays["match_offsets"] = np.concatenate([[0], np.cumsum(match_counts, dtype=np.int64)]).astype(np.int64)
+    arrays["match_indices"] = np.array(
+        [user_codes[m["match_id"]] for u in store.users for m in u["match_list"]], dtype=np.int32
+    )
+    arrays["match_scores"] = np.array([m["score"] for u in store.users for m in u["match_list"]], dtype=np.float64)
+
+    # Lịch trình: xếp theo mã người dùng, giữ thứ tự gốc trong từng người dùng
+    owner = np.array([user_codes[s["user_id"]] for s in store.schedules], dtype=np.int32)
+    order = np.argsort(owner, kind="stable")
+    schedules = [store.schedules[i] for i in order]
+    arrays["sched_orig_to_grouped"] = np.argsort(order, kind="stable").astype(np.int64)
+    arrays["sched_user_offsets"] = np.searchsorted(owner[order], np.arange(len(user_codes) + 1)).astype(np.int64)
+    schedule_ids = np.array([s["schedule_id"] for s in schedules], dtype=str)
+    arrays["schedule_ids"] = schedule_ids
+    arrays["schedule_ids_sorted"] = np.argsort(schedule_ids, kind="stable").astype(np.int64)
+    arrays["sched_poi"] = np.array([poi_codes[s["poi_id"]] for s in schedules], dtype=np.int32)
+    arrays["sched_description"], arrays["sched_description_table"] = _intern([s.get("description") for s in schedules])
+    arrays["sched_lat"] = np.array([s["location"]["latitude"] for s in schedules], dtype=np.float64)
+    arrays["sched_lon"] = np.array([s["location"]["longitude"] for s in schedules], dtype=np.float64)
+    for field in ("start", "end"):
+        values = [s[f"{field}_time"] for s in schedules]
+        arrays[f"sched_{field}"] = np.array([to_epoch(v) for v in values], dtype=np.int64)
+        arrays[f"sched_{field}_tz"] = np.array([_utc_offset_minutes(v) for v in values], dtype=np.int16)
+        for v, epoch, tz in zip(values, arrays[f"sched_{field}"], arrays[f"sched_{field}_tz"]):
+            if _format_time(epoch, tz) != v:
+                raise ValueError(f"Không lưu được {field}_time '{v}' ở độ chính xác giây trong snapshot dạng cột")
+
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), array, allow_pickle=False)
+    return write_meta(out_dir, store.data_version, len(store.pois), len(store.users), len(store.schedules))
+
+
+def open_column(out_dir, name, dtype, length):
+    """
+    Tạo file cột name.npy với kích thước cố định và trả về memmap để ghi dần theo chunk
+    (dùng bởi generate_data khi dữ liệu quá lớn để dựng cả mảng trong bộ nhớ).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    return np.lib.format.open_memmap(os.path.join(out_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=(length,))
+
+
+def write_meta(out_dir, data_version, n_pois, n_users, n_schedules):
+    """Ghi meta.json - bước cuối cùng, đánh dấu snapshot đã hoàn chỉnh."""
+    meta = {
+        "format": FORMAT_VERSION,
+        "data_version": data_version,
+        "n_pois": n_pois,
+        "n_users": n_users,
+        "n_schedules": n_schedules,
+    }
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+# --- 2. CẤU TRÚC TRUY CẬP LƯỜI ---
+
+class _LazyRecords(Sequence):
+    """Danh sách chỉ đọc, dựng dict của phần tử thứ i khi được truy cập lần đầu rồi ghi nhớ."""
+
+    def __init__(self, n, build, positions=None):
+        self._n = n
+        self._build = build
+        self._positions = positions  # map chỉ số của danh sách -> khoá trong cache dùng chung
+        self._cache = {}
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        key = int(self._positions[i]) if self._positions is not None else i
+        record = self._cache.get(key)
+        if record is None:
+            record = self._cache[key] = self._build(key)
+        return record
+
+    def shared(self, positions, n):
+        """Một danh sách khác trên cùng cache (vd. lịch trình theo thứ tự gốc)."""
+        view = _LazyRecords(n, self._build, positions)
+        view._cache = self._cache
+        return view
+
+
+class _SortedIdMap(Mapping):
+    """Mapping id -> giá trị, tra cứu bằng searchsorted trên bảng id đã sắp xếp (không dựng dict)."""
+
+    def __init__(self, ids, sorter, limit, value_of):
+        self._ids = ids
+        self._sorter = sorter
+        self._limit = limit  # chỉ các mã < limit là khoá hợp lệ
+        self._value_of = value_of
+
+    def code_of(self, key):
+        if not isinstance(key, str):
+            return None
+        pos = int(np.searchsorted(self._ids, key, sorter=self._sorter))
+        if pos < self._sorter.size:
+            code = int(self._sorter[pos])
+            if self._ids[code] == key and code < self._limit:
+                return code
+        return None
+
+    def __getitem__(self, key):
+        code = self.code_of(key)
+        if code is None:
+            raise KeyError(key)
+        value = self._value_of(code)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for code in range(self._limit):
+            if self._value_of(code) is not None:
+                yield str(self._ids[code])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+# --- 3. DATASTORE DẠNG CỘT ---
+
+class ColumnarDataStore(DataStore):
+    """
+    DataStore mở từ snapshot dạng cột. Các chỉ mục users_by_id / schedules_by_id / schedules_by_user /
+    schedule_arrays_by_user tra cứu trực tiếp trên mảng memory map; dict chỉ được dựng khi cần.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Snapshot '{path}' có định dạng không hỗ trợ: {self.meta.get('format')}")
+        self.path = path
+        self.cols = {
+            name[:-4]: np.load(os.path.join(path, name), mmap_mode="r", allow_pickle=False)
+            for name in os.listdir(path) if name.endswith(".npy")
+        }
+        self._materialized = False
+
+        c, n_users, n_schedules = self.cols, self.meta["n_users"], self.meta["n_schedules"]
+        pois = [self._poi(i) for i in range(self.meta["n_pois"])]
+        users = _LazyRecords(n_users, self._user)
+        grouped = _LazyRecords(n_schedules, self._schedule)
+        self._grouped_schedules = grouped
+        schedules = grouped.shared(c["sched_orig_to_grouped"], n_schedules)
+        super().__init__(pois, users, schedules)
+        self._data_version = self.meta["data_version"]
+
+    # Dựng dict theo đúng thứ tự trường của dữ liệu gốc
+    def _text(self, field, i):
+        code = int(self.cols[field][i])
+        return None if code < 0 else str(self.cols[f"{field}_table"][code])
+
+    def _poi(self, i):
+        poi = {"name": self._text("poi_name", i), "category": self._text("poi_category", i)}
+        for field in ("type", "district"):
+            value = self._text(f"poi_{field}", i)
+            if value is not None:
+                poi[field] = value
+        poi.update(latitude=float(self.cols["poi_lat"][i]), longitude=float(self.cols["poi_lon"][i]),
+                   poi_id=str(self.cols["poi_ids"][i]))
+        return poi
+
+    def _user(self, code):
+        c = self.cols
+        user = {"user_id": str(c["user_ids"][code])}
+        gender = self._text("gender", code)
+        if gender is not None:
+            user["gender"] = gender
+        lo, hi = int(c["match_offsets"][code]), int(c["match_offsets"][code + 1])
+        user["home_location"] = {"latitude": float(c["home_lat"][code]), "longitude": float(c["home_lon"][code])}
+        user["match_list"] = [
+            {"match_id": str(c["user_ids"][m]), "score": float(score)}
+            for m, score in zip(c["match_indices"][lo:hi], c["match_scores"][lo:hi])
+        ]
+        return user
+
+    def _schedule(self, i):
+        c = self.cols
+        owner = int(np.searchsorted(c["sched_user_offsets"], i, side="right")) - 1
+        return {
+            "schedule_id": str(c["schedule_ids"][i]),
+            "user_id": str(c["user_ids"][owner]),
+            "description": self._text("sched_description", i),
+            "start_time": _format_time(c["sched_start"][i], c["sched_start_tz"][i]),
+            "end_time": _format_time(c["sched_end"][i], c["sched_end_tz"][i]),
+            "poi_id": str(c["poi_ids"][c["sched_poi"][i]]),
+            "location": {"latitude": float(c["sched_lat"][i]), "longitude": float(c["sched_lon"][i])},
+        }
+
+    def _schedule_range(self, code):
+        offsets = self.cols["sched_user_offsets"]
+        return int(offsets[code]), int(offsets[code + 1])
+
+    def _build_user_indexes(self):
+        c = self.cols
+        self.users_by_id = _SortedIdMap(c["user_ids"], c["user_ids_sorted"], self.meta["n_users"], self.users.__getitem__)
+
+    def _build_schedule_indexes(self):
+        c = self.cols
+        n_ids = c["user_ids"].size
+        self.schedules_by_id = _SortedIdMap(
+            c["schedule_ids"], c["schedule_ids_sorted"], self.meta["n_schedules"], self._grouped_schedules.__getitem__
+        )
+
+        def schedules_of_code(code):
+            lo, hi = self._schedule_range(code)
+            return self._grouped_schedules[lo:hi] if hi > lo else None
+
+        def arrays_of_code(code):
+            lo, hi = self._schedule_range(code)
+            if hi == lo:
+                return None
+            # View trên mảng memory map, không sao chép
+            return ScheduleArrays(c["sched_start"][lo:hi], c["sched_end"][lo:hi], c["sched_lat"][lo:hi], c["sched_lon"][lo:hi])
+
+        self.schedules_by_user = _SortedIdMap(c["user_ids"], c["user_ids_sorted"], n_ids, schedules_of_code)
+        self.schedule_arrays_by_user = _SortedIdMap(c["user_ids"], c["user_ids_sorted"], n_ids, arrays_of_code)
+
+    def match_csr(self):
+        if self._materialized:
+            return DataStore.match_csr(self)
+        # Các cột match_* đã là CSR; chỉ cần nới offsets cho các id chỉ xuất hiện trong match_list
+        c = self.cols
+        offsets = np.empty(c["user_ids"].size + 1, dtype=np.int64)
+        offsets[:c["match_offsets"].size] = c["match_offsets"]
+        offsets[c["match_offsets"].size:] = c["match_offsets"][-1]
+        return c["user_ids"], offsets, c["match_indices"], c["match_scores"].astype(np.float32), c["user_ids_sorted"]
+
+    def flat_schedule_arrays(self, user_ids):
+        c = self.cols
+        if self._materialized or user_ids is not c["user_ids"]:
+            return DataStore.flat_schedule_arrays(self, user_ids)
+        # Lịch trình đã được xếp theo mã người dùng: dùng thẳng các cột memory map
+        return c["sched_user_offsets"], ScheduleArrays(c["sched_start"], c["sched_end"], c["sched_lat"], c["sched_lon"])
+
+    @property
+    def matched_by(self):
+        # Chỉ cần cho các thao tác ghi, lúc đó store đã chuyển sang dict thường
+        self._before_mutation()
+        return self.__dict__["matched_by"]
+
+    @matched_by.setter
+    def matched_by(self, value):
+        self.__dict__["matched_by"] = value
+
+    def _before_mutation(self):
+        """Chuyển toàn bộ sang list/dict thường (giữ nguyên các dict đã trả ra) trước thao tác ghi đầu tiên."""
+        if self._materialized:
+            return
+        self._materialized = True
+        self.users = list(self.users)
+        self.schedules = list(self.schedules)
+        DataStore._build_user_indexes(self)
+        DataStore._build_schedule_indexes(self)
+
+
+def load_columnar(path):
+    return ColumnarDataStore(path)
+
+
+if __name__ == "__main__":
+    from activity_model_engine import load_data
+
+    parser = argparse.ArgumentParser(description="Xuất dữ liệu hiện tại thành snapshot dạng cột (memory map).")
+    parser.add_argument("--out", default="data_columnar", help="Thư mục snapshot (mặc định: %(default)s)")
+    args = parser.parse_args()
+
+    store = load_data()
+    meta = export_columnar(store, args.out)
+    print(f"-> Đã xuất {meta['n_users']} người dùng, {meta['n_schedules']} lịch trình, {meta['n_pois']} POI vào '{args.out}'.")
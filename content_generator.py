@@ -1,74 +1,145 @@
 import json
 import random
+import re
+from string import Formatter
+
+# Số mô tả hoạt động được ghi nhớ hint. Khoá là mô tả của lịch trình đã lưu của cặp đôi mục tiêu (không phải
+# mô tả to-do gửi lên /suggest); lịch trình có thể được thêm / sửa qua API nên cache vẫn phải có giới hạn
+HINT_CACHE_SIZE = 4096
+
+
+def _compile_template(template):
+    """
+    Tách sẵn chuỗi mẫu thành [(đoạn chữ, tên trường)] để ghép trực tiếp thay vì str.format.
+    Mẫu có định dạng / chuyển đổi đặc biệt ({x!r}, {x:>10}) được giữ nguyên để dùng str.format.
+    """
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(template):
+        if spec or conversion:
+            return template
+        parts.append((literal, field))
+    return tuple(parts)
+
+
+def _render(compiled, **values):
+    if isinstance(compiled, str):
+        return compiled.format(**values)
+    return "".join(literal + (values[field] if field is not None else "") for literal, field in compiled)
+
 
 class ContentGenerator:
     def __init__(self, templates_path="templates.json"):
         """Khởi tạo và tải thư viện mẫu câu."""
         with open(templates_path, "r", encoding="utf-8") as f:
             self.templates = json.load(f)
+        self._compile()
+
+    def _compile(self):
+        """
+        Dựng dạng đã biên dịch của templates: danh sách lựa chọn dạng tuple, mẫu mô tả đã tách sẵn
+        và một regex duy nhất cho mọi từ khoá hint (thay vì lower() + tìm chuỗi con theo từng khoá).
+        """
+        titles = self.templates["titles"]
+        self._titles_initial = {cat: tuple(opts) for cat, opts in titles["initial"].items()}
+        self._titles_updated = tuple(titles["updated"]["default"])
+
+        descriptions = self.templates["descriptions"]
+        self._descriptions_initial = {
+            quest_type: tuple(_compile_template(t) for t in opts)
+            for quest_type, opts in descriptions["initial"].items()
+        }
+        self._descriptions_updated = tuple(_compile_template(t) for t in descriptions["updated"]["default"])
 
-    def _get_activity_category(self, quest, all_pois):
-        """Lấy danh mục của hoạt động từ POI."""
-        poi = next((p for p in all_pois if p["poi_id"] == quest["poi_id"]), None)
-        return poi["category"] if poi else "default"
-        
-    def _generate_title(self, quest, all_pois, is_update=False):
+        # Từ khoá -> thứ tự trong templates; khoá đứng trước được ưu tiên như khi duyệt dict.
+        # Lookahead cho phép các khớp chồng lên nhau, nên mọi từ khoá xuất hiện đều được tìm thấy.
+        self._hint_keywords = {}
+        for key, hint in self.templates["hints"]["by_schedule_activity"].items():
+            self._hint_keywords.setdefault(key.lower(), (len(self._hint_keywords), hint))
+        if self._hint_keywords:
+            alternatives = "|".join(re.escape(key) for key in self._hint_keywords)
+            self._hint_pattern = re.compile(f"(?=({alternatives}))")
+        else:
+            self._hint_pattern = None
+        self._hint_by_description = {}
+        self._hints_generic = tuple(self.templates["hints"]["generic"])
+
+    def _hint_for_description(self, activity_desc):
+        """Hint của từ khoá đầu tiên (theo thứ tự trong templates) có trong mô tả hoạt động, hoặc None."""
+        if activity_desc in self._hint_by_description:
+            return self._hint_by_description[activity_desc]
+        best = None
+        if self._hint_pattern is not None:
+            for match in self._hint_pattern.finditer(activity_desc.lower()):
+                candidate = self._hint_keywords[match.group(1)]
+                if best is None or candidate[0] < best[0]:
+                    best = candidate
+        hint = best[1] if best else None
+        if len(self._hint_by_description) >= HINT_CACHE_SIZE:
+            self._hint_by_description.clear()
+        self._hint_by_description[activity_desc] = hint
+        return hint
+
+    def _generate_title(self, quest, store, is_update=False, rng=random, poi=None):
         """Tạo tiêu đề dựa trên trạng thái và loại hoạt động."""
         if is_update:
-            return random.choice(self.templates["titles"]["updated"]["default"])
-        
+            return rng.choice(self._titles_updated)
+
         quest_type = quest.get("type", "main_activity")
         if quest_type == "buffer_activity":
             category = "buffer"
         else:
-            category = self._get_activity_category(quest, all_pois)
-            
-        title_options = self.templates["titles"]["initial"].get(category, self.templates["titles"]["initial"]["default"])
-        return random.choice(title_options)
+            poi = poi if poi is not None else store.get_poi(quest["poi_id"])
+            category = poi["category"] if poi else "default"
+
+        title_options = self._titles_initial.get(category, self._titles_initial["default"])
+        return rng.choice(title_options)
 
-    def _generate_description(self, quest, all_pois, is_update=False):
+    def _generate_description(self, quest, store, is_update=False, rng=random, poi=None):
         """Tạo mô tả."""
-        poi_name = next((p["name"] for p in all_pois if p["poi_id"] == quest["poi_id"]), "một địa điểm thú vị")
-        
+        poi = poi if poi is not None else store.get_poi(quest["poi_id"])
+        poi_name = (poi or {}).get("name", "một địa điểm thú vị")
+
         if is_update:
-            template = random.choice(self.templates["descriptions"]["updated"]["default"])
+            template = rng.choice(self._descriptions_updated)
         else:
             quest_type = quest.get("type", "main_activity")
-            template = random.choice(self.templates["descriptions"]["initial"][quest_type])
-            
-        return template.format(location_name=poi_name)
+            template = rng.choice(self._descriptions_initial[quest_type])
 
-    def _generate_hint(self, quest, all_schedules, all_users):
+        return _render(template, location_name=poi_name)
+
+    def _generate_hint(self, quest, store, rng=random):
         """Tạo gợi ý (hint) một cách thông minh."""
         # Ưu tiên 1: Dựa trên lịch trình của cặp đôi được nhắm đến
         if quest.get("associatedMatch"):
             match_id = quest["associatedMatch"]["match_id"]
-            match_schedule = next((s for s in all_schedules if s["user_id"] == match_id), None)
+            match_schedule = next(iter(store.schedules_of(match_id)), None)
             if match_schedule:
-                activity_desc = match_schedule["description"]
                 # Tìm hint khớp với mô tả hoạt động
-                for key, hint in self.templates["hints"]["by_schedule_activity"].items():
-                    if key.lower() in activity_desc.lower():
-                        return hint
-        
+                hint = self._hint_for_description(match_schedule["description"])
+                if hint is not None:
+                    return hint
+
         # (Chưa có dữ liệu sở thích, sẽ dùng generic hint)
         # Ưu tiên 2: Dựa trên sở thích của cặp đôi (sẽ thêm ở tương lai)
 
         # Ưu tiên 3: Dùng một gợi ý chung chung
-        return random.choice(self.templates["hints"]["generic"])
+        return rng.choice(self._hints_generic)
 
-    def generate_quest_content(self, quest, all_pois, all_schedules, all_users, is_update=False):
+    def generate_quest_content(self, quest, store, is_update=False, rng=random):
         """
         Hàm chính, nhận vào một Quest struct và trả về một bộ nội dung.
+        rng (random.Random) cho phép chọn mẫu câu một cách tất định, mặc định dùng module random.
         """
         # Để tạo hint tốt nhất, chúng ta cần biết cặp đôi được nhắm đến là ai.
         # Ta có thể tìm lại cặp đôi này bằng cách phân tích điểm bias_match, 
         # nhưng để đơn giản, ta sẽ giả định quest struct đã có thông tin này.
         # Trong lần chạy thử, ta sẽ tạo hint dựa trên lịch trình.
 
-        title = self._generate_title(quest, all_pois, is_update)
-        description = self._generate_description(quest, all_pois, is_update)
-        hint = self._generate_hint(quest, all_schedules, all_users) # Cần cải thiện để biết match nào là mục tiêu
+        # POI được tra một lần cho cả tiêu đề và mô tả
+        poi = store.get_poi(quest["poi_id"])
+        title = self._generate_title(quest, store, is_update, rng, poi)
+        description = self._generate_description(quest, store, is_update, rng, poi)
+        hint = self._generate_hint(quest, store, rng) # Cần cải thiện để biết match nào là mục tiêu
 
         return {
             "title": title,
@@ -76,24 +147,33 @@ class ContentGenerator:
             "hint": hint
         }
 
+    def generate_batch(self, quests, store, is_update=False, seed=None, rng=None):
+        """
+        Tạo nội dung cho nhiều quest một lượt, dùng chung một RNG: truyền seed (hoặc rng) để
+        kết quả tái lập được. Cho cùng kết quả với gọi generate_quest_content lần lượt với rng đó.
+        """
+        if rng is None:
+            rng = random.Random(seed) if seed is not None else random
+        return [self.generate_quest_content(quest, store, is_update, rng) for quest in quests]
+
 # --- CÁCH SỬ DỤNG ---
 if __name__ == "__main__":
     # Đây là một ví dụ sử dụng độc lập
     # 1. Giả lập dữ liệu đầu vào
     from activity_model_engine import load_data
-    all_pois, all_users, all_schedules = load_data()
+    store = load_data()
     
     # Giả sử đây là quest tốt nhất được thuật toán chọn
     sample_quest = {
         "candidate_id": "CANDIDATE_ALT_some_poi_id",
         "type": "main_activity",
-        "poi_id": all_pois[0]["poi_id"], # Lấy POI đầu tiên làm ví dụ
+        "poi_id": store.pois[0]["poi_id"], # Lấy POI đầu tiên làm ví dụ
         "associatedMatch": {"match_id": "USER_192"} # Giả định ta biết mục tiêu là USER_192
     }
 
     # 2. Khởi tạo và gọi generator
     generator = ContentGenerator()
-    content = generator.generate_quest_content(sample_quest, all_pois, all_schedules, all_users)
+    content = generator.generate_quest_content(sample_quest, store)
 
     # 3. In kết quả
     print("--- VÍ DỤ TẠO NỘI DUNG ---")
@@ -0,0 +1,363 @@
+import hashlib
+import json
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+from interval_index import ScheduleIntervalIndex
+from match_graph import MatchGraph
+from match_index import MatchScenarioIndex
+from spatial_index import PoiGridIndex
+
+# Mảng song song với danh sách lịch trình của một người dùng (cùng thứ tự với schedules_of)
+ScheduleArrays = namedtuple("ScheduleArrays", ["starts", "ends", "lats", "lons"])
+
+
+def to_epoch(iso_string):
+    """
+    Chuyển chuỗi ISO 8601 thành epoch (giây, số nguyên).
+    Chuỗi không có múi giờ được coi là UTC để mọi mốc thời gian so sánh được với nhau.
+    """
+    dt = datetime.fromisoformat(iso_string)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _validate_user(user):
+    try:
+        user["user_id"], user["home_location"]["latitude"], user["home_location"]["longitude"]
+        for m in user["match_list"]:
+            m["match_id"], float(m["score"])
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"Người dùng không hợp lệ: thiếu hoặc sai trường {e}") from e
+
+
+def _validate_schedule(schedule):
+    try:
+        schedule["schedule_id"], schedule["user_id"], schedule["poi_id"]
+        schedule["location"]["latitude"], schedule["location"]["longitude"]
+        if to_epoch(schedule["end_time"]) < to_epoch(schedule["start_time"]):
+            raise ValueError("end_time phải sau start_time")
+    except (TypeError, KeyError) as e:
+        raise ValueError(f"Lịch trình không hợp lệ: thiếu hoặc sai trường {e}") from e
+
+
+def build_schedule_arrays(schedules):
+    """Chuẩn hoá start_time/end_time thành epoch và toạ độ thành mảng NumPy."""
+    return ScheduleArrays(
+        starts=np.array([to_epoch(s["start_time"]) for s in schedules], dtype=np.int64),
+        ends=np.array([to_epoch(s["end_time"]) for s in schedules], dtype=np.int64),
+        lats=np.array([s["location"]["latitude"] for s in schedules], dtype=np.float64),
+        lons=np.array([s["location"]["longitude"] for s in schedules], dtype=np.float64),
+    )
+
+
+class DataStore:
+    """
+    Kho dữ liệu trong bộ nhớ, giữ nguyên các danh sách gốc (pois, users, schedules)
+    và xây dựng sẵn các chỉ mục dạng dict để tra cứu O(1) thay vì duyệt tuyến tính.
+    """
+
+    def __init__(self, pois, users, schedules):
+        self.pois = pois
+        self.users = users
+        self.schedules = schedules
+        self._data_version = None
+        self._match_index = None
+        self._match_graph = None
+        # Số lần dữ liệu bị thay đổi qua các hàm add_/update_/remove_/cancel_ bên dưới
+        self.revision = 0
+        # Dữ liệu dẫn xuất theo người dùng (vd. MatchContext của engine), bị xoá khi người dùng bị ảnh hưởng
+        self.match_context_cache = {}
+        # user_id -> ScheduleIntervalIndex, dựng lười ở lần truy vấn thời gian đầu tiên
+        self.schedule_intervals_by_user = {}
+        self._invalidation_listeners = []
+        self._build_indexes()
+
+    def _build_indexes(self):
+        """Xây dựng các chỉ mục: user_id->user, user_id->schedules, schedule_id->schedule, poi_id->poi, category->POIs."""
+        self._build_poi_indexes()
+        self._build_user_indexes()
+        self._build_schedule_indexes()
+
+    def _build_user_indexes(self):
+        self.users_by_id = {u["user_id"]: u for u in self.users}
+        # Chỉ mục ngược: user_id -> tập những người có user_id trong match_list của họ
+        self.matched_by = defaultdict(set)
+        for u in self.users:
+            for m in u["match_list"]:
+                self.matched_by[m["match_id"]].add(u["user_id"])
+
+    def _build_poi_indexes(self):
+        self.pois_by_id = {p["poi_id"]: p for p in self.pois}
+
+        pois_by_category = defaultdict(list)
+        for p in self.pois:
+            pois_by_category[p["category"]].append(p)
+        self.pois_by_category = dict(pois_by_category)
+        # Chỉ mục không gian cho các truy vấn bán kính (chiến lược 2 và 4)
+        self.poi_index = PoiGridIndex(self.pois)
+
+    def _build_schedule_indexes(self):
+        self.schedules_by_id = {s["schedule_id"]: s for s in self.schedules}
+        # Giữ đúng thứ tự xuất hiện trong danh sách gốc cho từng người dùng
+        schedules_by_user = defaultdict(list)
+        for s in self.schedules:
+            schedules_by_user[s["user_id"]].append(s)
+        self.schedules_by_user = dict(schedules_by_user)
+        # Thời gian được parse MỘT LẦN tại đây; chuỗi ISO chỉ còn dùng cho output của API
+        self.schedule_arrays_by_user = {
+            uid: build_schedule_arrays(ss) for uid, ss in self.schedules_by_user.items()
+        }
+
+    @property
+    def data_version(self):
+        """
+        Dấu vân tay nội dung (sha1) của pois, users và schedules, tính lười một lần.
+        Dùng để biết kết quả đã tính sẵn (precomputed) còn khớp với dữ liệu đang phục vụ hay không.
+        """
+        if self._data_version is None:
+            hasher = hashlib.sha1()
+            for collection in (self.pois, self.users, self.schedules):
+                for record in collection:
+                    hasher.update(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+                hasher.update(b"\x00")
+            self._data_version = hasher.hexdigest()
+        return self._data_version
+
+    @property
+    def match_index(self):
+        """Chỉ mục cặp gặp gỡ cho /match, xây dựng lười ở lần truy cập đầu tiên."""
+        if self._match_index is None:
+            self._match_index = MatchScenarioIndex(self)
+        return self._match_index
+
+    @property
+    def match_graph(self):
+        """Đồ thị match CSR kèm cơ hội gặp gỡ tính sẵn (MatchGraph), xây dựng lười ở lần truy cập đầu tiên."""
+        if self._match_graph is None:
+            self._match_graph = MatchGraph.from_store(self)
+        return self._match_graph
+
+    def match_csr(self):
+        """
+        match_list của mọi người dùng dạng CSR: (node_ids, offsets, indices, scores).
+        Nút là người dùng theo thứ tự self.users, sau đó là các id chỉ xuất hiện trong match_list.
+        """
+        codes = {u["user_id"]: i for i, u in enumerate(self.users)}
+        indices, scores, counts = [], [], []
+        for u in self.users:
+            for m in u["match_list"]:
+                indices.append(codes.setdefault(m["match_id"], len(codes)))
+                scores.append(m["score"])
+            counts.append(len(u["match_list"]))
+        counts.extend([0] * (len(codes) - len(counts)))
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        return list(codes), offsets, np.array(indices, dtype=np.int32), np.array(scores, dtype=np.float32)
+
+    def flat_schedule_arrays(self, user_ids):
+        """
+        Lịch trình của user_ids nối thành một ScheduleArrays: trả về (offsets, arrays),
+        lịch trình của user_ids[i] nằm ở [offsets[i], offsets[i + 1]).
+        """
+        blocks = [self.schedule_arrays_of(user_id) for user_id in user_ids]
+        offsets = np.zeros(len(blocks) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([b.starts.size for b in blocks])
+        if not blocks:
+            return offsets, build_schedule_arrays([])
+        return offsets, ScheduleArrays(*(np.concatenate(field) for field in zip(*blocks)))
+
+    # --- Truy vấn ---
+
+    def get_user(self, user_id):
+        return self.users_by_id.get(user_id)
+
+    def get_poi(self, poi_id):
+        return self.pois_by_id.get(poi_id)
+
+    def get_schedule(self, schedule_id):
+        return self.schedules_by_id.get(schedule_id)
+
+    def schedules_of(self, user_id):
+        return self.schedules_by_user.get(user_id, [])
+
+    def schedule_arrays_of(self, user_id):
+        """Trả về ScheduleArrays (starts, ends, lats, lons) của người dùng, cùng thứ tự với schedules_of."""
+        arrays = self.schedule_arrays_by_user.get(user_id)
+        return arrays if arrays is not None else build_schedule_arrays([])
+
+    def schedule_intervals_of(self, user_id):
+        """ScheduleIntervalIndex trên lịch trình của người dùng (None nếu không có lịch trình)."""
+        index = self.schedule_intervals_by_user.get(user_id)
+        if index is None:
+            arrays = self.schedule_arrays_of(user_id)
+            if arrays.starts.size == 0:
+                return None
+            index = self.schedule_intervals_by_user[user_id] = ScheduleIntervalIndex.from_arrays(arrays)
+        return index
+
+    def schedules_overlapping(self, user_id, start, end):
+        """
+        Các lịch trình của người dùng chồng thời gian (dương) với [start, end], theo thứ tự của schedules_of.
+        start / end là epoch (giây) hoặc chuỗi ISO 8601.
+        """
+        index = self.schedule_intervals_of(user_id)
+        if index is None:
+            return []
+        start = to_epoch(start) if isinstance(start, str) else start
+        end = to_epoch(end) if isinstance(end, str) else end
+        schedules = self.schedules_of(user_id)
+        return [schedules[int(i)] for i in index.overlapping(start, end)]
+
+    def pois_in_category(self, category):
+        return self.pois_by_category.get(category, [])
+
+    def pois_within(self, point, radius_km, categories=None):
+        """Trả về [(poi, distance_km)] trong bán kính radius_km quanh point."""
+        return self.poi_index.within(point, radius_km, categories)
+
+    # --- Thay đổi dữ liệu tăng dần ---
+    # Mỗi hàm chỉ cập nhật các chỉ mục liên quan và trả về tập người dùng bị ảnh hưởng:
+    # người bị thay đổi và (nếu lịch trình của họ thay đổi) những người có họ trong match_list.
+
+    def _before_mutation(self):
+        """Điểm mở rộng cho lớp con (vd. ColumnarDataStore chuyển sang dict thường trước khi ghi)."""
+
+    def add_invalidation_listener(self, listener):
+        """Đăng ký hàm listener(affected_user_ids) được gọi sau mỗi lần dữ liệu thay đổi."""
+        self._invalidation_listeners.append(listener)
+
+    def add_user(self, user):
+        self._before_mutation()
+        _validate_user(user)
+        user_id = user["user_id"]
+        if user_id in self.users_by_id:
+            raise ValueError(f"Người dùng {user_id} đã tồn tại")
+        self.users.append(user)
+        self.users_by_id[user_id] = user
+        self._link_matches(user)
+        return self._invalidate({user_id})
+
+    def update_user(self, user_id, fields):
+        self._before_mutation()
+        user = self._require_user(user_id)
+        updated = {**user, **fields, "user_id": user_id}
+        _validate_user(updated)
+        self._unlink_matches(user)
+        user.update(updated)
+        self._link_matches(user)
+        return self._invalidate({user_id})
+
+    def remove_user(self, user_id):
+        """Xoá người dùng cùng toàn bộ lịch trình của họ."""
+        self._before_mutation()
+        user = self._require_user(user_id)
+        affected = {user_id} | self.matched_by.get(user_id, set())
+        self._unlink_matches(user)
+        self.users.remove(user)
+        del self.users_by_id[user_id]
+        removed = self.schedules_by_user.pop(user_id, [])
+        if removed:
+            removed_ids = {s["schedule_id"] for s in removed}
+            self.schedules[:] = [s for s in self.schedules if s["schedule_id"] not in removed_ids]
+            for schedule_id in removed_ids:
+                del self.schedules_by_id[schedule_id]
+        self.schedule_arrays_by_user.pop(user_id, None)
+        self.schedule_intervals_by_user.pop(user_id, None)
+        return self._invalidate(affected)
+
+    def add_schedule(self, schedule):
+        self._before_mutation()
+        _validate_schedule(schedule)
+        if schedule["schedule_id"] in self.schedules_by_id:
+            raise ValueError(f"Lịch trình {schedule['schedule_id']} đã tồn tại")
+        self._require_user(schedule["user_id"])
+        self.schedules.append(schedule)
+        self.schedules_by_id[schedule["schedule_id"]] = schedule
+        self.schedules_by_user.setdefault(schedule["user_id"], []).append(schedule)
+        self._reindex_user_schedules(schedule["user_id"])
+        return self._invalidate(self._affected_by_schedules_of(schedule["user_id"]))
+
+    def update_schedule(self, schedule_id, fields):
+        self._before_mutation()
+        schedule = self._require_schedule(schedule_id)
+        updated = {**schedule, **fields, "schedule_id": schedule_id}
+        _validate_schedule(updated)
+        self._require_user(updated["user_id"])
+        old_user_id = schedule["user_id"]
+        if updated["user_id"] != old_user_id:
+            self.schedules_by_user[old_user_id].remove(schedule)
+            self.schedules_by_user.setdefault(updated["user_id"], []).append(schedule)
+        schedule.update(updated)
+        affected = self._affected_by_schedules_of(old_user_id) | self._affected_by_schedules_of(updated["user_id"])
+        self._reindex_user_schedules(old_user_id)
+        self._reindex_user_schedules(updated["user_id"])
+        return self._invalidate(affected)
+
+    def cancel_schedule(self, schedule_id):
+        self._before_mutation()
+        schedule = self._require_schedule(schedule_id)
+        user_id = schedule["user_id"]
+        self.schedules.remove(schedule)
+        del self.schedules_by_id[schedule_id]
+        self.schedules_by_user[user_id].remove(schedule)
+        self._reindex_user_schedules(user_id)
+        return self._invalidate(self._affected_by_schedules_of(user_id))
+
+    def _require_user(self, user_id):
+        user = self.users_by_id.get(user_id)
+        if user is None:
+            raise LookupError(f"Không tìm thấy người dùng với ID: {user_id}")
+        return user
+
+    def _require_schedule(self, schedule_id):
+        schedule = self.schedules_by_id.get(schedule_id)
+        if schedule is None:
+            raise LookupError(f"Không tìm thấy lịch trình với ID: {schedule_id}")
+        return schedule
+
+    def _link_matches(self, user):
+        for m in user["match_list"]:
+            self.matched_by[m["match_id"]].add(user["user_id"])
+
+    def _unlink_matches(self, user):
+        for m in user["match_list"]:
+            self.matched_by[m["match_id"]].discard(user["user_id"])
+
+    def _affected_by_schedules_of(self, user_id):
+        return {user_id} | self.matched_by.get(user_id, set())
+
+    def _reindex_user_schedules(self, user_id):
+        self.schedule_intervals_by_user.pop(user_id, None)
+        schedules = self.schedules_by_user.get(user_id)
+        if schedules:
+            self.schedule_arrays_by_user[user_id] = build_schedule_arrays(schedules)
+        else:
+            self.schedules_by_user.pop(user_id, None)
+            self.schedule_arrays_by_user.pop(user_id, None)
+
+    def _invalidate(self, affected):
+        """Bỏ các dữ liệu dẫn xuất của những người dùng bị ảnh hưởng (không tải lại toàn bộ)."""
+        self.revision += 1
+        self._data_version = None
+        for user_id in affected:
+            self.match_context_cache.pop(user_id, None)
+        if self._match_index is not None:
+            self._match_index.refresh_users(affected)
+        if self._match_graph is not None:
+            self._match_graph.refresh_users(self, affected)
+        for listener in self._invalidation_listeners:
+            listener(affected)
+        return affected
+
+    def without_users(self, user_ids):
+        """
+        Trả về một DataStore mới trong đó lịch trình của các user_ids bị loại bỏ
+        (dùng để giả lập tình huống một cặp đôi không thể tham gia).
+        """
+        excluded = set(user_ids)
+        schedules = [s for s in self.schedules if s["user_id"] not in excluded]
+        return DataStore(self.pois, self.users, schedules)
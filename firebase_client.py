@@ -3,6 +3,13 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 
 def init_firebase():
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        # Firestore emulator (test local) → không cần service account
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import firestore as gcloud_firestore
+        project = os.environ.get("GCLOUD_PROJECT", "demo-gio-loc")
+        return gcloud_firestore.Client(project=project, credentials=AnonymousCredentials())
+
     if not firebase_admin._apps:  # tránh init nhiều lần
         if os.environ.get("FIREBASE_SERVICE_ACCOUNT"):
             # Deploy trên Render → đọc từ ENV
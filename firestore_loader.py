@@ -0,0 +1,150 @@
+"""
+Tải pois / users / daily_schedules từ Firestore cho load_data() khi USE_FIREBASE=1.
+
+  - Ba collection được tải song song (mỗi collection một thread), mỗi collection đọc theo trang
+    (order_by document id + start_after). select chỉ giữ các trường của schema (bỏ trường lạ do công cụ
+    khác ghi thêm); schema gồm mọi trường của file JSON nên không giảm dung lượng tải về.
+  - Firestore trả document theo thứ tự id, còn file JSON thì không; data_version băm bản ghi theo thứ tự
+    danh sách và thứ tự schedules_of ảnh hưởng tới cách phá hoà / gợi ý. Vì vậy migrate_json_to_firestore.py
+    ghi kèm vị trí của bản ghi trong file (SOURCE_ORDER_FIELD) và sau khi tải các document được sắp lại
+    theo trường này: cùng dữ liệu cho cùng thứ tự và cùng data_version như khi tải từ JSON. Document không
+    có trường này (nạp bằng công cụ khác) đứng sau cùng theo thứ tự id, khi đó data_version sẽ khác JSON.
+  - Sau mỗi lần tải thành công, dữ liệu được ghi ra một snapshot cục bộ có đánh phiên bản.
+    Lần khởi động sau đọc snapshot nếu nó còn đủ mới, rồi làm mới snapshot ở background. Lần làm mới
+    này CHỈ ghi lại file snapshot: store đang phục vụ vẫn giữ dữ liệu đã tải lúc khởi động, dữ liệu
+    mới chỉ được dùng từ lần khởi động (hoặc reload worker) tiếp theo.
+
+Biến môi trường:
+    FIRESTORE_SNAPSHOT          đường dẫn snapshot (mặc định: firestore_snapshot.json, rỗng = tắt)
+    FIRESTORE_SNAPSHOT_MAX_AGE  tuổi tối đa của snapshot, tính bằng giây (mặc định: 21600)
+    FIRESTORE_PAGE_SIZE         số document mỗi trang (mặc định: 1000)
+    FIRESTORE_EMULATOR_HOST     dùng Firestore emulator (xem firebase_client.init_firebase)
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SNAPSHOT = "firestore_snapshot.json"
+# 3: bản ghi được sắp theo SOURCE_ORDER_FIELD (snapshot cũ theo thứ tự id bị bỏ qua)
+SNAPSHOT_FORMAT = 3
+# Vị trí của bản ghi trong file JSON nguồn, do migrate_json_to_firestore.py ghi kèm mỗi document
+SOURCE_ORDER_FIELD = "_source_index"
+
+# collection -> (trường id, các trường của schema; giữ đủ cả trường mô hình không dùng như type / district / gender
+# để data_version và snapshot dạng cột giống hệt khi tải từ JSON)
+COLLECTIONS = {
+    "pois": ("poi_id", ["poi_id", "name", "category", "type", "district", "latitude", "longitude"]),
+    "users": ("user_id", ["user_id", "gender", "home_location", "match_list"]),
+    "daily_schedules": ("schedule_id", ["schedule_id", "user_id", "description", "start_time", "end_time", "poi_id", "location"]),
+}
+TIMESTAMP_FIELDS = ("start_time", "end_time")
+
+
+def _fetch_collection(db, name, page_size):
+    from google.cloud.firestore_v1.field_path import FieldPath
+
+    id_field, fields = COLLECTIONS[name]
+    query = db.collection(name).select(fields + [SOURCE_ORDER_FIELD]).order_by(FieldPath.document_id()).limit(page_size)
+    normalize_times = name == "daily_schedules"
+    docs, last = [], None
+    while True:
+        page = list((query.start_after(last) if last is not None else query).stream())
+        for doc in page:
+            d = doc.to_dict()
+            d.setdefault(id_field, doc.id)
+            if normalize_times:
+                # Chuẩn hoá timestamp Firestore
+                for k in TIMESTAMP_FIELDS:
+                    v = d.get(k)
+                    if hasattr(v, "isoformat"):
+                        d[k] = v.isoformat()
+            docs.append(d)
+        if len(page) < page_size:
+            return _source_order(name, docs)
+        last = page[-1]
+
+
+def _source_order(name, docs):
+    """Sắp document về thứ tự của file JSON nguồn (xem SOURCE_ORDER_FIELD) rồi bỏ trường thứ tự."""
+    missing = sum(SOURCE_ORDER_FIELD not in d for d in docs)
+    if missing:
+        print(f"⚠️ {missing} document của '{name}' không có '{SOURCE_ORDER_FIELD}', giữ thứ tự id "
+              f"(data_version sẽ khác với khi tải từ JSON).")
+    # sort ổn định: document thiếu trường thứ tự đứng sau, theo thứ tự id như khi tải
+    docs.sort(key=lambda d: (SOURCE_ORDER_FIELD not in d, d.get(SOURCE_ORDER_FIELD, 0)))
+    for d in docs:
+        d.pop(SOURCE_ORDER_FIELD, None)
+    return docs
+
+
+def fetch_all(db, page_size=None):
+    """Tải song song ba collection. Trả về (pois, users, schedules)."""
+    page_size = page_size or int(os.getenv("FIRESTORE_PAGE_SIZE", "1000"))
+    with ThreadPoolExecutor(max_workers=len(COLLECTIONS)) as pool:
+        futures = {name: pool.submit(_fetch_collection, db, name, page_size) for name in COLLECTIONS}
+        return tuple(futures[name].result() for name in COLLECTIONS)
+
+
+def read_snapshot(path, max_age_s):
+    """Đọc snapshot nếu tồn tại, đúng định dạng và chưa quá max_age_s giây. Ngược lại trả về None."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        return None
+    age = time.time() - snapshot.get("created_at", 0)
+    if age > max_age_s:
+        print(f"⚠️ Snapshot '{path}' đã cũ ({age:.0f}s), tải lại từ Firestore.")
+        return None
+    return snapshot
+
+
+def write_snapshot(path, pois, users, schedules):
+    """Ghi snapshot vào file tạm rồi đổi tên, để tiến trình khác không bao giờ đọc phải file ghi dở."""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"format": SNAPSHOT_FORMAT, "created_at": time.time(), "pois": pois, "users": users, "daily_schedules": schedules},
+            f, ensure_ascii=False, separators=(",", ":"),
+        )
+    os.replace(tmp_path, path)
+
+
+def _refresh_snapshot(path):
+    """Tải lại từ Firestore và chỉ ghi đè file snapshot; không cập nhật store đang phục vụ."""
+    try:
+        from firebase_client import init_firebase
+        started = time.perf_counter()
+        pois, users, schedules = fetch_all(init_firebase())
+        write_snapshot(path, pois, users, schedules)
+        print(f"-> Đã làm mới snapshot '{path}' ở background ({time.perf_counter() - started:.1f}s).")
+    except Exception as e:
+        print(f"⚠️ Không làm mới được snapshot '{path}': {e}")
+
+
+def load_collections():
+    """
+    Trả về (pois, users, schedules): từ snapshot cục bộ nếu còn đủ mới (và làm mới file snapshot ở
+    background cho lần khởi động sau), ngược lại tải trực tiếp từ Firestore rồi ghi snapshot.
+    """
+    path = os.getenv("FIRESTORE_SNAPSHOT", DEFAULT_SNAPSHOT)
+    max_age_s = float(os.getenv("FIRESTORE_SNAPSHOT_MAX_AGE", str(6 * 3600)))
+
+    snapshot = read_snapshot(path, max_age_s) if path else None
+    if snapshot is not None:
+        print(f"-> Dùng snapshot '{path}', làm mới ở background.")
+        threading.Thread(target=_refresh_snapshot, args=(path,), daemon=True).start()
+        return snapshot["pois"], snapshot["users"], snapshot["daily_schedules"]
+
+    from firebase_client import init_firebase
+    started = time.perf_counter()
+    pois, users, schedules = fetch_all(init_firebase())
+    print(f"-> Đã tải {len(pois)} POI, {len(users)} người dùng, {len(schedules)} lịch trình "
+          f"từ Firestore trong {time.perf_counter() - started:.1f}s.")
+    if path:
+        write_snapshot(path, pois, users, schedules)
+    return pois, users, schedules
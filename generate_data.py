@@ -1,7 +1,12 @@
+import argparse
+import hashlib
 import json
+import os
 import random
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
 
 # --- 1. ĐỊNH NGHĨA KHÔNG GIAN ĐỊA LÝ (Giữ nguyên) ---
 DISTRICT_BOUNDS = {
@@ -113,14 +118,19 @@ def create_users(num_users=300):
             })
     return users
 
+ACTIVITIES_BY_CATEGORY = {
+    "gym": ["Tập gym", "Tập yoga", "Cardio"],
+    "cafe": ["Uống cà phê", "Gặp gỡ bạn bè", "Làm việc tại quán cafe"],
+    "park": ["Chạy bộ", "Đi dạo", "Ngồi thư giãn"],
+    "cinema": ["Xem phim"]
+}
+START_HOURS = [8, 9, 10, 14, 15, 18, 19, 20]
+START_MINUTES = [0, 30]
+DURATIONS_H = [1, 1.5, 2]
+
 def create_schedules(users, pois):
     schedules = []
-    activities_by_category = {
-        "gym": ["Tập gym", "Tập yoga", "Cardio"],
-        "cafe": ["Uống cà phê", "Gặp gỡ bạn bè", "Làm việc tại quán cafe"],
-        "park": ["Chạy bộ", "Đi dạo", "Ngồi thư giãn"],
-        "cinema": ["Xem phim"]
-    }
+    activities_by_category = ACTIVITIES_BY_CATEGORY
     
     today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
@@ -135,9 +145,9 @@ def create_schedules(users, pois):
             chosen_poi = random.choice(possible_pois)
             description = random.choice(activities_by_category[category])
             
-            start_hour = random.choice([8, 9, 10, 14, 15, 18, 19, 20])
-            start_time = today + timedelta(hours=start_hour, minutes=random.choice([0, 30]))
-            end_time = start_time + timedelta(hours=random.choice([1, 1.5, 2]))
+            start_hour = random.choice(START_HOURS)
+            start_time = today + timedelta(hours=start_hour, minutes=random.choice(START_MINUTES))
+            end_time = start_time + timedelta(hours=random.choice(DURATIONS_H))
 
             schedules.append({
                 "schedule_id": str(uuid.uuid4()),
@@ -153,8 +163,414 @@ def create_schedules(users, pois):
             })
     return schedules
 
+# --- 4. CHẾ ĐỘ SINH DỮ LIỆU VECTOR HOÁ (NumPy, ghi dần ra đĩa) ---
+# Dùng cho hàng triệu người dùng: mọi lựa chọn ngẫu nhiên được sinh theo mảng, dữ liệu được ghi theo
+# chunk ra JSON Lines (pois.jsonl, users.jsonl, daily_schedules.jsonl - load_data đọc được trực tiếp)
+# và / hoặc snapshot dạng cột của columnar_store. Cùng seed và cùng tham số -> cùng dữ liệu.
+FORMATS = ("jsonl", "columnar")
+DEFAULT_SYNTHETIC_POIS = 3
+CATEGORY_LABELS = {"gym": "Phòng gym", "cafe": "Quán cà phê", "park": "Công viên", "cinema": "Rạp phim"}
+OUTDOOR_CATEGORIES = {"park"}
+
+
+def load_districts(path=None):
+    """
+    Đọc cấu hình quận từ file JSON dạng
+        {"quan_1": {"lat_min": ..., "lat_max": ..., "lon_min": ..., "lon_max": ...,
+                    "weight": 2.0, "pois_per_category": 5}, ...}
+    weight (mặc định 1) là mật độ người dùng tương đối của quận; pois_per_category (tuỳ chọn) là số
+    POI tổng hợp thêm cho mỗi loại hoạt động. Không có path thì dùng DISTRICT_BOUNDS.
+    """
+    if path is None:
+        return {name: dict(bounds) for name, bounds in DISTRICT_BOUNDS.items()}
+    with open(path, "r", encoding="utf-8") as f:
+        districts = json.load(f)
+    for name, d in districts.items():
+        missing = {"lat_min", "lat_max", "lon_min", "lon_max"} - set(d)
+        if missing:
+            raise ValueError(f"Quận '{name}' thiếu {sorted(missing)}")
+        if d.get("weight", 1.0) < 0:
+            raise ValueError(f"Quận '{name}' có weight âm")
+    return districts
+
+
+def _seeded_uuids(rng, n):
+    """n UUID4 sinh từ rng (tái lập được). Trả về (danh sách chuỗi, khoá sắp xếp (hi, lo) uint64)."""
+    raw = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    # Chuỗi hex chữ thường có gạch nối ở vị trí cố định: thứ tự chuỗi trùng thứ tự byte big-endian
+    words = raw.view(">u8").astype(np.uint64)
+    return [str(uuid.UUID(bytes=row.tobytes())) for row in raw], (words[:, 0], words[:, 1])
+
+
+def _sample_distinct(rng, n_rows, k, high):
+    """Ma trận (n_rows, k): mỗi hàng gồm k số nguyên khác nhau trong [0, high)."""
+    if k == 0 or n_rows == 0:
+        return np.zeros((n_rows, k), dtype=np.int64)
+    rows = rng.integers(0, high, size=(n_rows, k))
+    ordered = np.sort(rows, axis=1)
+    # Hàng có phần tử trùng (hiếm khi high >> k) được sinh lại riêng
+    for r in np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1)):
+        rows[r] = rng.choice(high, size=k, replace=False)
+    return rows
+
+
+def _pair_scores(seed, a, b, low=0.3, high=1.0):
+    """Điểm của cặp (a, b), đối xứng (cặp match hai chiều có cùng điểm), làm tròn 2 chữ số."""
+    lo = np.minimum(a, b).astype(np.uint64)
+    hi = np.maximum(a, b).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        x = lo * np.uint64(0x9E3779B97F4A7C15) ^ hi ^ np.uint64(seed & 0xFFFFFFFFFFFFFFFF)
+        # Bước trộn của splitmix64
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    u = (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+    return np.rint((low + u * (high - low)) * 100) / 100
+
+
+def create_pois_vectorized(rng, districts, synthetic_per_category=DEFAULT_SYNTHETIC_POIS):
+    """
+    POI thật nằm trong các quận được cấu hình, cộng thêm POI tổng hợp: mỗi loại hoạt động
+    pois_per_category POI cho quận có khai báo, synthetic_per_category cho quận không có POI thật.
+    poi_id được sinh lại từ rng để dữ liệu tái lập được.
+    """
+    pois = [p for p in create_pois_real_data() if p["district"] in districts]
+    real_districts = {p["district"] for p in pois}
+    for name, bounds in districts.items():
+        count = bounds.get("pois_per_category", 0 if name in real_districts else synthetic_per_category)
+        for category in ACTIVITIES_BY_CATEGORY:
+            lat = rng.uniform(bounds["lat_min"], bounds["lat_max"], size=count).tolist()
+            lon = rng.uniform(bounds["lon_min"], bounds["lon_max"], size=count).tolist()
+            for k in range(count):
+                pois.append({
+                    "name": f"{CATEGORY_LABELS.get(category, category)} #{k + 1} - {name}",
+                    "category": category,
+                    "type": "outdoor" if category in OUTDOOR_CATEGORIES else "indoor",
+                    "district": name,
+                    "latitude": lat[k],
+                    "longitude": lon[k],
+                })
+    for poi, poi_id in zip(pois, _seeded_uuids(rng, len(pois))[0]):
+        poi["poi_id"] = poi_id
+    return pois
+
+
+def create_match_graph(rng, seed, num_users, matches_min=3, matches_max=7):
+    """
+    match_list của mọi người dùng dạng CSR (offsets, indices, scores), nửa đầu là nam như create_users.
+    Mỗi người có số match ngẫu nhiên trong [matches_min, matches_max] ở giới còn lại. Nữ nhận lại
+    trước các nam đã chọn mình (match hai chiều) rồi mới bổ sung nam ngẫu nhiên, nên phần lớn
+    quan hệ là hai chiều - gần với dữ liệu thật hơn chọn độc lập từng phía.
+    """
+    n_male = num_users // 2
+    n_female = num_users - n_male
+    counts = rng.integers(matches_min, matches_max + 1, size=num_users)
+    counts[:n_male] = np.minimum(counts[:n_male], n_female)
+    counts[n_male:] = np.minimum(counts[n_male:], n_male)
+    male_counts, female_counts = counts[:n_male], counts[n_male:]
+
+    # Nam: chọn các nữ khác nhau
+    k = int(male_counts.max(initial=0))
+    picks = _sample_distinct(rng, n_male, k, n_female)
+    male_dst = picks[np.arange(k) < male_counts[:, None]]  # theo hàng, giữ thứ tự từng người
+
+    # Nữ: nhận lại các cạnh tới (thứ tự ngẫu nhiên), tối đa bằng số match của mình
+    in_female = male_dst
+    in_male = np.repeat(np.arange(n_male), male_counts)
+    perm = rng.permutation(in_female.size)
+    order = perm[np.argsort(in_female[perm], kind="stable")]
+    in_female, in_male = in_female[order], in_male[order]
+    in_counts = np.bincount(in_female, minlength=n_female)
+    in_offsets = np.concatenate([[0], np.cumsum(in_counts)])
+    rank = np.arange(in_female.size) - np.repeat(in_offsets[:-1], in_counts)
+    back = rank < female_counts[in_female]
+    back_female, back_male = in_female[back], in_male[back]
+    need = female_counts - np.minimum(in_counts, female_counts)
+
+    # ... rồi bổ sung nam ngẫu nhiên chưa có trong danh sách
+    k = min(int(female_counts.max(initial=0)), n_male)
+    cand = _sample_distinct(rng, n_female, k, n_male)
+    cand_keys = np.arange(n_female)[:, None] * n_male + cand
+    fresh = ~np.isin(cand_keys, back_female * n_male + back_male)
+    pad = fresh & (np.cumsum(fresh, axis=1) <= need[:, None])
+    pad_female = np.broadcast_to(np.arange(n_female)[:, None], cand.shape)[pad]
+    pad_male = cand[pad]
+
+    female_src = np.concatenate([back_female, pad_female])
+    female_dst = np.concatenate([back_male, pad_male])
+    order = np.argsort(female_src, kind="stable")
+    indices = np.concatenate([male_dst + n_male, female_dst[order]])
+    src = np.concatenate([np.repeat(np.arange(n_male), male_counts), female_src[order] + n_male])
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return offsets, indices.astype(np.int32), _pair_scores(seed, src, indices)
+
+
+def _iso_strings(epochs):
+    """Chuỗi ISO (không múi giờ, epoch coi là UTC như to_epoch) cho mảng epoch, định dạng mỗi giá trị một lần."""
+    values, inverse = np.unique(epochs, return_inverse=True)
+    table = [datetime.fromtimestamp(int(v), tz=timezone.utc).replace(tzinfo=None).isoformat() for v in values]
+    return [table[i] for i in inverse.ravel()]
+
+
+class _DataVersion:
+    """sha1 giống DataStore.data_version, cập nhật dần theo từng bản ghi."""
+
+    def __init__(self):
+        self.hasher = hashlib.sha1()
+
+    def add(self, record):
+        self.hasher.update(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+    def end_collection(self):
+        self.hasher.update(b"\x00")
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+def generate_vectorized(num_users, out_dir, seed=42, chunk_size=100_000, districts=None,
+                        todos_min=1, todos_max=3, matches_min=3, matches_max=7, days=1,
+                        synthetic_pois=DEFAULT_SYNTHETIC_POIS, formats=FORMATS, start_date=None):
+    """
+    Sinh num_users người dùng cùng match_list và lịch trình theo từng chunk, ghi vào out_dir
+    (JSON Lines) và / hoặc out_dir/columnar (snapshot dạng cột). Lịch trình rải đều trên `days` ngày
+    kể từ start_date (mặc định hôm nay). Trả về dict thống kê.
+    """
+    import columnar_store
+
+    formats = tuple(formats)
+    unknown = set(formats) - set(FORMATS)
+    if unknown or not formats:
+        raise ValueError(f"formats phải là tập con khác rỗng của {FORMATS}, nhận được {formats}")
+    if not (0 <= todos_min <= todos_max and 0 <= matches_min <= matches_max and days >= 1):
+        raise ValueError("Khoảng todos / matches / days không hợp lệ")
+    districts = districts if districts is not None else load_districts()
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    write_jsonl = "jsonl" in formats
+    col_dir = os.path.join(out_dir, "columnar") if "columnar" in formats else None
+    version = _DataVersion()
+
+    def open_jsonl(name):
+        return open(os.path.join(out_dir, name), "w", encoding="utf-8") if write_jsonl else None
+
+    def dump(f, record):
+        version.add(record)
+        if f is not None:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+
+    # --- POI ---
+    pois = create_pois_vectorized(rng, districts, synthetic_pois)
+    f = open_jsonl("pois.jsonl")
+    for poi in pois:
+        dump(f, poi)
+    version.end_collection()
+    if f is not None:
+        f.close()
+    if col_dir is not None:
+        if os.path.exists(os.path.join(col_dir, columnar_store.META_FILE)):
+            os.remove(os.path.join(col_dir, columnar_store.META_FILE))
+        _, arrays = columnar_store.poi_columns(pois)
+        for name, array in arrays.items():
+            columnar_store.open_column(col_dir, name, array.dtype, array.size)[:] = array
+
+    # --- Người dùng: chọn quận theo weight, nhà ngẫu nhiên trong quận, match_list dạng CSR ---
+    names = list(districts)
+    bounds = np.array([[districts[d][key] for key in ("lat_min", "lat_max", "lon_min", "lon_max")] for d in names])
+    weights = np.array([districts[d].get("weight", 1.0) for d in names], dtype=np.float64)
+    district = rng.choice(len(names), size=num_users, p=weights / weights.sum())
+    home_lat = bounds[district, 0] + rng.random(num_users) * (bounds[district, 1] - bounds[district, 0])
+    home_lon = bounds[district, 2] + rng.random(num_users) * (bounds[district, 3] - bounds[district, 2])
+    del district
+    offsets, indices, scores = create_match_graph(rng, seed, num_users, matches_min, matches_max)
+    gender_table = ["male", "female"]
+    gender = (np.arange(num_users) >= num_users // 2).astype(np.int32)
+    # Id đệm số 0 cùng độ rộng: thứ tự chuỗi trùng thứ tự số, user_ids_sorted chỉ là arange
+    width = max(3, len(str(max(num_users - 1, 0))))
+    user_ids = np.char.add("USER_", np.char.zfill(np.arange(num_users).astype(str), width)).astype(f"<U{5 + width}")
+
+    if col_dir is not None:
+        user_columns = {
+            "user_ids": user_ids,
+            "user_ids_sorted": np.arange(num_users, dtype=np.int32),
+            "home_lat": home_lat,
+            "home_lon": home_lon,
+            "gender": gender,
+            "gender_table": np.array(gender_table),
+            "match_offsets": offsets,
+            "match_indices": indices,
+            "match_scores": scores,
+        }
+        for name, array in user_columns.items():
+            columnar_store.open_column(col_dir, name, array.dtype, array.size)[:] = array
+
+    f = open_jsonl("users.jsonl")
+    for lo in range(0, num_users, chunk_size):
+        hi = min(lo + chunk_size, num_users)
+        ids, lats, lons = user_ids[lo:hi].tolist(), home_lat[lo:hi].tolist(), home_lon[lo:hi].tolist()
+        match_ids = user_ids[indices[offsets[lo]:offsets[hi]]].tolist()
+        match_scores = scores[offsets[lo]:offsets[hi]].tolist()
+        for j in range(hi - lo):
+            a, b = offsets[lo + j] - offsets[lo], offsets[lo + j + 1] - offsets[lo]
+            dump(f, {
+                "user_id": ids[j],
+                "gender": gender_table[gender[lo + j]],
+                "home_location": {"latitude": lats[j], "longitude": lons[j]},
+                "match_list": [{"match_id": m, "score": sc} for m, sc in zip(match_ids[a:b], match_scores[a:b])],
+            })
+        print(f"   ... {hi}/{num_users} người dùng")
+    version.end_collection()
+    if f is not None:
+        f.close()
+    del home_lat, home_lon, indices, scores
+
+    # --- Lịch trình: mỗi chunk người dùng sinh một lượt, đã xếp theo người dùng ---
+    todo_counts = rng.integers(todos_min, todos_max + 1, size=num_users)
+    user_offsets = np.concatenate([[0], np.cumsum(todo_counts)]).astype(np.int64)
+    n_schedules = int(user_offsets[-1])
+    poi_category = np.array([p["category"] for p in pois])
+    categories = [c for c in ACTIVITIES_BY_CATEGORY if (poi_category == c).any()]
+    if n_schedules and not categories:
+        raise ValueError("Không có POI nào cho các loại hoạt động, không sinh được lịch trình")
+    description_table = [d for c in categories for d in ACTIVITIES_BY_CATEGORY[c]]
+    category_pois, category_descriptions, pos = [], [], 0
+    for c in categories:
+        category_pois.append(np.flatnonzero(poi_category == c))
+        category_descriptions.append(np.arange(pos, pos + len(ACTIVITIES_BY_CATEGORY[c])))
+        pos += len(ACTIVITIES_BY_CATEGORY[c])
+    poi_ids = [p["poi_id"] for p in pois]
+    poi_lat = np.array([p["latitude"] for p in pois], dtype=np.float64)
+    poi_lon = np.array([p["longitude"] for p in pois], dtype=np.float64)
+    start_date = start_date or date.today()
+    base_epoch = int(datetime(start_date.year, start_date.month, start_date.day, tzinfo=timezone.utc).timestamp())
+    start_hours, start_minutes = np.array(START_HOURS), np.array(START_MINUTES)
+    durations_s = (np.array(DURATIONS_H) * 3600).astype(np.int64)
+
+    if col_dir is not None:
+        col = {
+            name: columnar_store.open_column(col_dir, name, dtype, n_schedules)
+            for name, dtype in (
+                ("schedule_ids", "<U36"), ("sched_poi", np.int32), ("sched_description", np.int32),
+                ("sched_lat", np.float64), ("sched_lon", np.float64),
+                ("sched_start", np.int64), ("sched_end", np.int64),
+                ("sched_start_tz", np.int16), ("sched_end_tz", np.int16),
+            )
+        }
+        sort_hi = np.empty(n_schedules, dtype=np.uint64)
+        sort_lo = np.empty(n_schedules, dtype=np.uint64)
+
+    f = open_jsonl("daily_schedules.jsonl")
+    for lo in range(0, num_users, chunk_size):
+        hi = min(lo + chunk_size, num_users)
+        s_lo, s_hi = int(user_offsets[lo]), int(user_offsets[hi])
+        n = s_hi - s_lo
+        owner = np.repeat(np.arange(lo, hi), todo_counts[lo:hi])
+        category = rng.integers(0, len(categories), size=n)
+        poi = np.empty(n, dtype=np.int64)
+        description = np.empty(n, dtype=np.int64)
+        for c in range(len(categories)):
+            mask = category == c
+            m = int(mask.sum())
+            poi[mask] = category_pois[c][rng.integers(0, category_pois[c].size, size=m)]
+            description[mask] = category_descriptions[c][rng.integers(0, category_descriptions[c].size, size=m)]
+        start = (base_epoch + rng.integers(0, days, size=n) * 86400
+                 + start_hours[rng.integers(0, start_hours.size, size=n)] * 3600
+                 + start_minutes[rng.integers(0, start_minutes.size, size=n)] * 60)
+        end = start + durations_s[rng.integers(0, durations_s.size, size=n)]
+        schedule_ids, (id_hi, id_lo) = _seeded_uuids(rng, n)
+
+        owners, pois_chunk, descriptions = user_ids[owner].tolist(), poi.tolist(), description.tolist()
+        starts, ends = _iso_strings(start), _iso_strings(end)
+        for j in range(n):
+            p = pois_chunk[j]
+            dump(f, {
+                "schedule_id": schedule_ids[j],
+                "user_id": owners[j],
+                "description": description_table[descriptions[j]],
+                "start_time": starts[j],
+                "end_time": ends[j],
+                "poi_id": poi_ids[p],
+                "location": {"latitude": pois[p]["latitude"], "longitude": pois[p]["longitude"]},
+            })
+        if col_dir is not None:
+            col["schedule_ids"][s_lo:s_hi] = schedule_ids
+            col["sched_poi"][s_lo:s_hi] = poi
+            col["sched_description"][s_lo:s_hi] = description
+            col["sched_lat"][s_lo:s_hi] = poi_lat[poi]
+            col["sched_lon"][s_lo:s_hi] = poi_lon[poi]
+            col["sched_start"][s_lo:s_hi] = start
+            col["sched_end"][s_lo:s_hi] = end
+            col["sched_start_tz"][s_lo:s_hi] = columnar_store.NAIVE_OFFSET
+            col["sched_end_tz"][s_lo:s_hi] = columnar_store.NAIVE_OFFSET
+            sort_hi[s_lo:s_hi], sort_lo[s_lo:s_hi] = id_hi, id_lo
+        print(f"   ... {s_hi}/{n_schedules} lịch trình")
+    version.end_collection()
+    if f is not None:
+        f.close()
+
+    data_version = version.hexdigest()
+    if col_dir is not None:
+        for array in col.values():
+            array.flush()
+        schedule_columns = {
+            "sched_orig_to_grouped": np.arange(n_schedules, dtype=np.int64),
+            "sched_user_offsets": user_offsets,
+            "schedule_ids_sorted": np.lexsort((sort_lo, sort_hi)).astype(np.int64),
+            "sched_description_table": np.array(description_table),
+        }
+        for name, array in schedule_columns.items():
+            columnar_store.open_column(col_dir, name, array.dtype, array.size)[:] = array
+        columnar_store.write_meta(col_dir, data_version, len(pois), num_users, n_schedules)
+
+    return {
+        "n_pois": len(pois),
+        "n_users": num_users,
+        "n_matches": int(offsets[-1]),
+        "n_schedules": n_schedules,
+        "data_version": data_version,
+    }
+
+
 # --- HÀM CHÍNH ĐỂ THỰC THI (Cập nhật để gọi hàm mới) ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu giả lập (POIs, users, lịch trình).")
+    parser.add_argument("--mode", choices=("classic", "vectorized"), default="classic",
+                        help="classic: 300 người dùng, ghi *.json vào thư mục hiện tại; vectorized: NumPy, ghi dần theo chunk")
+    parser.add_argument("--users", type=int, default=1_000_000, help="[vectorized] Số người dùng (mặc định: %(default)s)")
+    parser.add_argument("--out-dir", default="generated_data", help="[vectorized] Thư mục output (mặc định: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42, help="[vectorized] Seed (mặc định: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="[vectorized] Số người dùng mỗi chunk (mặc định: %(default)s)")
+    parser.add_argument("--districts", help="[vectorized] File JSON cấu hình quận (ranh giới, weight, pois_per_category)")
+    parser.add_argument("--todos-min", type=int, default=1)
+    parser.add_argument("--todos-max", type=int, default=3)
+    parser.add_argument("--matches-min", type=int, default=3)
+    parser.add_argument("--matches-max", type=int, default=7)
+    parser.add_argument("--days", type=int, default=1, help="[vectorized] Số ngày rải lịch trình (mặc định: %(default)s)")
+    parser.add_argument("--start-date", type=date.fromisoformat, help="[vectorized] Ngày bắt đầu YYYY-MM-DD (mặc định: hôm nay)")
+    parser.add_argument("--synthetic-pois", type=int, default=DEFAULT_SYNTHETIC_POIS,
+                        help="[vectorized] Số POI tổng hợp mỗi loại cho quận không có POI thật (mặc định: %(default)s)")
+    parser.add_argument("--formats", default="jsonl,columnar", help="[vectorized] jsonl, columnar hoặc cả hai (mặc định: %(default)s)")
+    args = parser.parse_args()
+
+    if args.mode == "vectorized":
+        print(f"Sinh {args.users} người dùng (seed={args.seed}) vào '{args.out_dir}'...")
+        stats = generate_vectorized(
+            args.users, args.out_dir, seed=args.seed, chunk_size=args.chunk_size,
+            districts=load_districts(args.districts),
+            todos_min=args.todos_min, todos_max=args.todos_max,
+            matches_min=args.matches_min, matches_max=args.matches_max,
+            days=args.days, synthetic_pois=args.synthetic_pois,
+            formats=[f.strip() for f in args.formats.split(",") if f.strip()], start_date=args.start_date,
+        )
+        print(f"-> {stats['n_pois']} POI, {stats['n_users']} người dùng, {stats['n_matches']} match, "
+              f"{stats['n_schedules']} lịch trình (data_version {stats['data_version'][:12]}).")
+        if "columnar" in args.formats:
+            print(f"   Dùng: DATA_DIR={args.out_dir} hoặc COLUMNAR_SNAPSHOT={os.path.join(args.out_dir, 'columnar')}")
+        raise SystemExit(0)
+
     print("Bắt đầu Giai đoạn 0 của Kế hoạch Gió Lốc (Phiên bản Dữ liệu Thật)...")
 
     # Bước 1: Tạo POIs với dữ liệu thật
@@ -0,0 +1,46 @@
+"""
+Cấu hình gunicorn cho production (Render):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Biến môi trường: PORT, WEB_CONCURRENCY (số worker, > 1 thì API chỉ đọc - xem preload_app), GUNICORN_THREADS, GUNICORN_TIMEOUT,
+MEMORY_REPORT_INTERVAL (giây giữa các lần in RSS / tỉ lệ chia sẻ của worker, 0 = chỉ in khi khởi động).
+Nên dùng kèm COLUMNAR_SNAPSHOT để dữ liệu nằm trong các trang memory map dùng chung.
+"""
+import os
+import threading
+
+from memory_stats import format_memory, process_memory
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# Tải dữ liệu một lần trong master, các worker dùng chung qua copy-on-write
+preload_app = True
+# Mỗi worker có bản store riêng sau khi fork: thay đổi qua POST/PUT/DELETE /users, /schedules chỉ tới
+# worker xử lý yêu cầu đó, các worker khác (và store.revision trong khoá cache /suggest) lệch nhau.
+# Vì vậy khi có nhiều worker, api_server chạy ở chế độ chỉ đọc (các endpoint ghi trả về 501); cập nhật
+# dữ liệu gốc (JSON / Firestore / COLUMNAR_SNAPSHOT) rồi khởi động lại. Cần ghi qua API thì dùng
+# WEB_CONCURRENCY=1 (có thể tăng GUNICORN_THREADS, các thao tác ghi đã được khoá trong tiến trình).
+if workers > 1:
+    os.environ["API_READ_ONLY"] = "1"
+# Không tái tạo worker theo số request: worker mới vẫn dùng chung trang của master,
+# nhưng phần bộ nhớ riêng của worker cũ (cache, context) sẽ mất
+max_requests = 0
+
+MEMORY_REPORT_INTERVAL = float(os.getenv("MEMORY_REPORT_INTERVAL", "0"))
+
+
+def when_ready(server):
+    server.log.info("master %s", format_memory(process_memory()))
+
+
+def post_worker_init(worker):
+    worker.log.info("worker %s", format_memory(process_memory()))
+    if MEMORY_REPORT_INTERVAL > 0:
+        def _report():
+            while True:
+                threading.Event().wait(MEMORY_REPORT_INTERVAL)
+                worker.log.info("worker %s", format_memory(process_memory()))
+        threading.Thread(target=_report, daemon=True).start()
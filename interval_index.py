@@ -0,0 +1,102 @@
+import numpy as np
+
+from geo_distance import many_to_many
+
+# Số vị trí ứng viên được ghi nhớ điểm địa điểm tốt nhất trong một chỉ mục
+LOCATION_CACHE_SIZE = 4096
+
+
+class ScheduleIntervalIndex:
+    """
+    Chỉ mục khoảng thời gian trên các lịch trình đã parse sẵn (epoch), chia thành các nhóm liên tiếp
+    (nhóm g gồm các vị trí [offsets[g], offsets[g + 1]) - vd. lịch trình của từng match trong
+    MatchContext; không truyền offsets thì cả chỉ mục là một nhóm, như lịch trình của một người dùng).
+
+    Thời điểm bắt đầu được sắp xếp một lần; cùng với độ dài lớn nhất, truy vấn overlapping chỉ cần
+    hai lần searchsorted để lấy các lịch trình có thể chồng thời gian, nên lịch nhiều ngày không làm
+    chi phí tăng theo tổng số lịch trình.
+
+    Phần điểm địa điểm của các lịch trình không chồng thời gian chỉ còn phụ thuộc vị trí, nên
+    best_location_scores ghi nhớ điểm địa điểm tốt nhất của từng nhóm theo vị trí được hỏi.
+    Mỗi nhóm phải có ít nhất một lịch trình.
+    """
+
+    def __init__(self, starts, ends, lats, lons, offsets=None, radius_km=5):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        n = self.starts.size
+        self.offsets = np.asarray(offsets, dtype=np.int64) if offsets is not None else np.array([0, n], dtype=np.int64)
+        self.radius_km = radius_km
+        self.group_of = np.repeat(np.arange(self.offsets.size - 1), np.diff(self.offsets))
+
+        self.order = np.argsort(self.starts, kind="stable")
+        self.sorted_starts = self.starts[self.order]
+        self.sorted_ends = self.ends[self.order]
+        self.max_duration = int((self.ends - self.starts).max()) if n else 0
+
+        self._unique_locations = None
+        self._location_cache = {}
+
+    @classmethod
+    def from_arrays(cls, arrays, radius_km=5):
+        """Chỉ mục một nhóm từ ScheduleArrays (cùng thứ tự với schedules_of)."""
+        return cls(arrays.starts, arrays.ends, arrays.lats, arrays.lons, radius_km=radius_km)
+
+    @property
+    def n_groups(self):
+        return self.offsets.size - 1
+
+    def overlapping(self, start, end):
+        """
+        Vị trí (tăng dần, nên gom theo nhóm) của các lịch trình chồng thời gian dương với [start, end]:
+        s < end và e > start. Vì e ≤ s + max_duration nên chỉ cần xét s trong (start - max_duration, end).
+        """
+        lo = np.searchsorted(self.sorted_starts, start - self.max_duration, side="right")
+        hi = np.searchsorted(self.sorted_starts, end, side="left")
+        if hi <= lo:
+            return np.empty(0, dtype=np.int64)
+        hit = self.sorted_ends[lo:hi] > start
+        return np.sort(self.order[lo:hi][hit])
+
+    def best_location_scores(self, lats, lons):
+        """
+        Ma trận (n vị trí × số nhóm): max exp(-khoảng cách / radius_km) từ mỗi vị trí tới các lịch trình
+        của từng nhóm. Được ghi nhớ theo (lat, lon); chỉ tính cho các vị trí chưa gặp.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        out = np.empty((lats.size, self.n_groups), dtype=np.float64)
+        cache = self._location_cache
+        missing = {}
+        for i, key in enumerate(zip(lats.tolist(), lons.tolist())):
+            row = cache.get(key)
+            if row is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                out[i] = row
+        if missing:
+            keys = list(missing)
+            rows = self._compute_location_scores(np.array([k[0] for k in keys]), np.array([k[1] for k in keys]))
+            if len(cache) + len(keys) > LOCATION_CACHE_SIZE:
+                cache.clear()
+            for key, row in zip(keys, rows):
+                cache[key] = row
+                out[missing[key]] = row
+        return out
+
+    def _compute_location_scores(self, lats, lons):
+        if self._unique_locations is None:
+            # Nhiều lịch trình cùng một POI: chỉ giữ các toạ độ khác nhau trong từng nhóm
+            order = np.lexsort((self.lons, self.lats, self.group_of))
+            groups, u_lats, u_lons = self.group_of[order], self.lats[order], self.lons[order]
+            keep = np.ones(order.size, dtype=bool)
+            keep[1:] = (groups[1:] != groups[:-1]) | (u_lats[1:] != u_lats[:-1]) | (u_lons[1:] != u_lons[:-1])
+            group_starts = np.searchsorted(groups[keep], np.arange(self.n_groups))
+            self._unique_locations = (u_lats[keep], u_lons[keep], group_starts)
+        u_lats, u_lons, group_starts = self._unique_locations
+        if u_lats.size == 0:
+            return np.zeros((lats.size, self.n_groups), dtype=np.float64)
+        min_dist = np.minimum.reduceat(many_to_many(lats, lons, u_lats, u_lons), group_starts, axis=1)
+        return np.exp(-min_dist / self.radius_km)
@@ -0,0 +1,465 @@
+"""
+Công cụ tải (load test) cho api_server: khởi động server trên bộ dữ liệu đã sinh, bắn /suggest và
+/match theo vòng kín (số yêu cầu đồng thời cố định) hoặc vòng mở (tốc độ cố định), rồi báo cáo
+throughput, độ trễ p50/p95/p99, tỉ lệ lỗi và thời gian từng giai đoạn phía server (header Server-Timing).
+
+Nguồn yêu cầu:
+  - --replay FILE: JSON Lines, mỗi dòng {"method": "POST", "path": "/suggest", "json": {...}} hoặc
+    {"method": "GET", "path": "/match?min_match_score=0.8"}; dòng chỉ có {"user_id", "todo"} được
+    coi là body của /suggest. Danh sách được lặp vòng cho tới khi hết thời gian / số yêu cầu.
+  - mặc định: hỗn hợp tổng hợp từ dữ liệu (to-do thật của người dùng thật, một phần /match, một phần
+    lặp lại yêu cầu cũ để cache có việc làm). --save-requests ghi hỗn hợp này ra file để replay lại.
+
+Server: gunicorn (gunicorn.conf.py, wsgi:app) với --workers / --threads nếu đã cài, ngược lại là
+server của Flask (một tiến trình, đa luồng khi --threads > 1). --url dùng một server có sẵn.
+
+Cách dùng:
+    python load_test.py run --data-dir bench_data/users_10000 --concurrency 16 --duration 30
+    python load_test.py run --columnar generated_data/columnar --rate 200 --duration 60
+    python load_test.py run --url http://localhost:5000 --replay recorded_requests.jsonl
+    python load_test.py sweep --data-dir bench_data/users_10000 --workers 1,2,4 --threads 1,4 --concurrency 4,16,64
+"""
+import argparse
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Tăng throughput dưới mức này (tương đối) giữa hai mức đồng thời liên tiếp được coi là đã bão hoà
+SATURATION_GAIN = 0.05
+
+
+# --- 1. NGUỒN YÊU CẦU ---
+
+def load_replay(path):
+    """Đọc file yêu cầu đã ghi lại. Trả về danh sách (method, path, body dạng bytes hoặc None)."""
+    requests_ = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "path" not in record:
+                if not {"user_id", "todo"} <= set(record):
+                    raise ValueError(f"{path}:{line_no}: cần 'path' hoặc cặp 'user_id' / 'todo'")
+                record = {"method": "POST", "path": "/suggest", "json": record}
+            body = record.get("json")
+            requests_.append((
+                record.get("method", "POST" if body is not None else "GET"),
+                record["path"],
+                json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else None,
+            ))
+    if not requests_:
+        raise ValueError(f"File '{path}' không có yêu cầu nào")
+    return requests_
+
+
+def synthesize(store, n, seed=0, match_share=0.05, repeat_share=0.2):
+    """
+    Hỗn hợp n yêu cầu từ dữ liệu: /match với tham số ngẫu nhiên (match_share), /suggest lặp lại một
+    yêu cầu trước đó (repeat_share, như người dùng mở lại app) và /suggest cho to-do mới.
+    Trả về danh sách record dạng của file replay.
+    """
+    rng = random.Random(seed)
+    records, suggests = [], []
+    n_schedules = len(store.schedules)
+    for _ in range(n):
+        r = rng.random()
+        if r < match_share:
+            params = f"min_match_score={rng.choice((0.7, 0.8, 0.85, 0.9))}&max_distance_km={rng.choice((0.5, 1.0, 1.5))}"
+            records.append({"method": "GET", "path": f"/match?{params}&page={rng.randint(1, 3)}"})
+        elif suggests and r < match_share + repeat_share:
+            records.append(rng.choice(suggests))
+        else:
+            todo = store.schedules[rng.randrange(n_schedules)]
+            record = {"method": "POST", "path": "/suggest", "json": {"user_id": todo["user_id"], "todo": dict(todo)}}
+            suggests.append(record)
+            records.append(record)
+    return records
+
+
+def _encode(records):
+    return [
+        (r["method"], r["path"], json.dumps(r["json"], ensure_ascii=False).encode("utf-8") if "json" in r else None)
+        for r in records
+    ]
+
+
+def _load_store(data_dir=None, columnar=None):
+    if columnar:
+        from columnar_store import ColumnarDataStore
+        return ColumnarDataStore(columnar)
+    from activity_model_engine import load_data
+    return load_data(data_dir)
+
+
+# --- 2. KHỞI ĐỘNG SERVER ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """api_server chạy trong tiến trình con; log được ghi ra file tạm."""
+
+    def __init__(self, workers=1, threads=1, data_dir=None, columnar=None, response_cache=True,
+                 port=None, startup_timeout=600.0):
+        self.port = port or _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        env = dict(os.environ, PORT=str(self.port), WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+                   LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+        if data_dir:
+            env["DATA_DIR"] = os.path.abspath(data_dir)
+        if columnar:
+            env["COLUMNAR_SNAPSHOT"] = os.path.abspath(columnar)
+        if not response_cache:
+            env["SUGGEST_CACHE_MAX_MB"] = "0"
+
+        if importlib.util.find_spec("gunicorn") is not None:
+            cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"]
+            self.kind = f"gunicorn {workers}x{threads}"
+        else:
+            if workers > 1:
+                print(f"⚠️ Chưa cài gunicorn: chạy server của Flask với 1 tiến trình thay vì {workers} worker.")
+            cmd = [sys.executable, "-c",
+                   f"from wsgi import app; app.run(host='127.0.0.1', port={self.port}, threaded={threads > 1})"]
+            self.kind = f"flask 1x{threads if threads > 1 else 1}"
+        self.log = tempfile.NamedTemporaryFile(prefix="load_test_server_", suffix=".log", delete=False)
+        self.process = subprocess.Popen(cmd, cwd=REPO_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self._wait_ready(startup_timeout)
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server dừng khi khởi động (mã {self.process.returncode}), xem log '{self.log.name}'")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=2)
+                conn.request("GET", "/metrics")
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"Server không sẵn sàng sau {timeout:.0f}s, xem log '{self.log.name}'")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+# --- 3. BẮN TẢI ---
+
+class _Client:
+    """Một kết nối keep-alive (http.client), tự kết nối lại khi server đóng kết nối."""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.conn = None
+
+    def send(self, method, path, body):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                headers = {"Content-Type": "application/json"} if body is not None else {}
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                response.read()
+                if response.will_close:
+                    self.conn.close()
+                    self.conn = None
+                return response.status, response.getheader("Server-Timing")
+            except (OSError, http.client.HTTPException) as e:
+                self.conn.close()
+                self.conn = None
+                # Kết nối keep-alive cũ bị server đóng: thử lại một lần trên kết nối mới
+                stale = isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError))
+                if attempt or not stale:
+                    raise
+
+
+def _parse_server_timing(header):
+    timings = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                timings[name] = float(value)
+    return timings
+
+
+def drive(url, requests_, concurrency=8, rate=None, duration=30.0, max_requests=None, timeout=30.0):
+    """
+    Bắn yêu cầu (lặp vòng trên requests_) tới url.
+      - rate None: vòng kín, `concurrency` luồng mỗi luồng gửi yêu cầu tiếp theo ngay khi xong;
+      - rate R: vòng mở, yêu cầu thứ i được lên lịch ở thời điểm i / R; độ trễ tính từ thời điểm
+        lên lịch (gồm cả thời gian chờ khi server không theo kịp), `concurrency` là số yêu cầu
+        đang bay tối đa.
+    Trả về danh sách (endpoint, status, độ trễ giây, {giai đoạn: ms}) và thời gian chạy thực tế.
+    """
+    results = []
+    results_lock = threading.Lock()
+    counter = itertools.count()
+    started = time.perf_counter()
+    stop_at = started + duration
+
+    def worker():
+        client = _Client(url, timeout)
+        local = []
+        while True:
+            i = next(counter)
+            if max_requests is not None and i >= max_requests:
+                break
+            if rate:
+                scheduled = started + i / rate
+                if scheduled > stop_at:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+                if scheduled > stop_at:
+                    break
+            method, path, body = requests_[i % len(requests_)]
+            endpoint = path.split("?", 1)[0]
+            try:
+                status, timing_header = client.send(method, path, body)
+            except (OSError, http.client.HTTPException) as e:
+                status, timing_header = type(e).__name__, None
+            local.append((endpoint, status, time.perf_counter() - scheduled, _parse_server_timing(timing_header)))
+        with results_lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - started
+
+
+def _latency_summary(latencies_s):
+    ms = np.asarray(latencies_s, dtype=np.float64) * 1000
+    if ms.size == 0:
+        return {"n": 0}
+    return {
+        "n": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def summarize(results, elapsed):
+    """Throughput, độ trễ (tổng và theo endpoint), tỉ lệ lỗi và thời gian giai đoạn phía server."""
+    ok = lambda status: isinstance(status, int) and (200 <= status < 300 or status == 304)  # noqa: E731
+    by_endpoint, stage_ms, statuses = defaultdict(list), defaultdict(list), defaultdict(int)
+    errors = 0
+    for endpoint, status, latency, timings in results:
+        by_endpoint[endpoint].append(latency)
+        statuses[str(status)] += 1
+        errors += not ok(status)
+        for stage, value in timings.items():
+            stage_ms[stage].append(value)
+    return {
+        "requests": len(results),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed > 0 else 0.0,
+        "error_rate": errors / len(results) if results else 0.0,
+        "statuses": dict(statuses),
+        "latency": _latency_summary([r[2] for r in results]),
+        "endpoints": {endpoint: _latency_summary(lat) for endpoint, lat in sorted(by_endpoint.items())},
+        "server_stages": {
+            stage: {
+                "n": len(values),
+                "mean_ms": float(np.mean(values)),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+            }
+            for stage, values in stage_ms.items()
+        },
+    }
+
+
+def print_summary(summary):
+    lat = summary["latency"]
+    print(f"   {summary['requests']} yêu cầu trong {summary['elapsed_s']:.1f}s -> {summary['throughput_rps']:.1f} req/s, "
+          f"lỗi {summary['error_rate']:.2%} {summary['statuses']}")
+    if lat["n"]:
+        print(f"   độ trễ p50 {lat['p50_ms']:.1f} ms | p95 {lat['p95_ms']:.1f} ms | p99 {lat['p99_ms']:.1f} ms | max {lat['max_ms']:.1f} ms")
+    for endpoint, s in summary["endpoints"].items():
+        print(f"     {endpoint:<12} n={s['n']:<7} p50 {s['p50_ms']:8.1f} ms | p95 {s['p95_ms']:8.1f} ms | p99 {s['p99_ms']:8.1f} ms")
+    if summary["server_stages"]:
+        print("   giai đoạn phía server (Server-Timing):")
+        for stage, s in sorted(summary["server_stages"].items(), key=lambda kv: -kv[1]["mean_ms"]):
+            print(f"     {stage:<14} n={s['n']:<7} mean {s['mean_ms']:7.3f} ms | p50 {s['p50_ms']:7.3f} ms | p95 {s['p95_ms']:7.3f} ms")
+
+
+def run_load(url, requests_, concurrency, rate, duration, max_requests, warmup):
+    if warmup > 0:
+        drive(url, requests_, concurrency=concurrency, duration=warmup)
+    results, elapsed = drive(url, requests_, concurrency=concurrency, rate=rate, duration=duration, max_requests=max_requests)
+    return summarize(results, elapsed)
+
+
+# --- 4. QUÉT SỐ WORKER / THREAD ---
+
+def saturation_point(points):
+    """
+    Mức đồng thời mà từ đó tăng thêm không còn tăng throughput đáng kể (< SATURATION_GAIN).
+    points: danh sách (concurrency, summary) theo concurrency tăng dần.
+    """
+    for (c_prev, prev), (_, cur) in zip(points, points[1:]):
+        if cur["throughput_rps"] < prev["throughput_rps"] * (1 + SATURATION_GAIN):
+            return c_prev
+    return points[-1][0] if points else None
+
+
+def sweep(args, requests_):
+    report = []
+    for workers in _int_list(args.workers):
+        for threads in _int_list(args.threads):
+            with Server(workers, threads, args.data_dir, args.columnar, not args.no_response_cache) as server:
+                print(f"\n== {server.kind} ==")
+                points = []
+                for concurrency in _int_list(args.concurrency):
+                    summary = run_load(server.url, requests_, concurrency, None, args.duration, None, args.warmup)
+                    print(f"-> đồng thời {concurrency}:")
+                    print_summary(summary)
+                    points.append((concurrency, summary))
+                sat = saturation_point(points)
+                best = max(points, key=lambda p: p[1]["throughput_rps"])[1]
+                report.append({
+                    "workers": workers, "threads": threads, "server": server.kind,
+                    "saturation_concurrency": sat,
+                    "max_throughput_rps": best["throughput_rps"],
+                    "points": [{"concurrency": c, **s} for c, s in points],
+                })
+
+    print(f"\n{'server':<18} {'bão hoà ở':>10} {'max req/s':>10} {'p99 ms @bão hoà':>16}")
+    for entry in report:
+        at_sat = next((p for p in entry["points"] if p["concurrency"] == entry["saturation_concurrency"]), None)
+        p99 = at_sat["latency"].get("p99_ms", float("nan")) if at_sat else float("nan")
+        print(f"{entry['server']:<18} {entry['saturation_concurrency']:>10} {entry['max_throughput_rps']:>10.1f} {p99:>16.1f}")
+    candidates = [e for e in report if args.slo_ms is None or _p99_at_saturation(e) <= args.slo_ms]
+    if candidates:
+        best = max(candidates, key=lambda e: e["max_throughput_rps"])
+        print(f"\n✅ Cấu hình tốt nhất: {best['server']} (~{best['max_throughput_rps']:.0f} req/s, bão hoà ở {best['saturation_concurrency']} yêu cầu đồng thời).")
+    else:
+        print(f"\n❌ Không cấu hình nào giữ được p99 ≤ {args.slo_ms} ms tại điểm bão hoà.")
+    return report
+
+
+def _p99_at_saturation(entry):
+    for p in entry["points"]:
+        if p["concurrency"] == entry["saturation_concurrency"]:
+            return p["latency"].get("p99_ms", float("inf"))
+    return float("inf")
+
+
+def _int_list(value):
+    return [int(v) for v in str(value).split(",") if v.strip()]
+
+
+# --- 5. CHƯƠNG TRÌNH CHÍNH ---
+
+def _requests_from_args(args):
+    if args.replay:
+        return load_replay(args.replay)
+    store = _load_store(args.data_dir, args.columnar)
+    records = synthesize(store, args.pool, seed=args.seed, match_share=args.match_share, repeat_share=args.repeat_share)
+    if args.save_requests:
+        with open(args.save_requests, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"-> Đã ghi {len(records)} yêu cầu vào '{args.save_requests}'.")
+    return _encode(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test cho api_server (/suggest, /match).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--data-dir", default=os.getenv("DATA_DIR", "."), help="Thư mục dữ liệu JSON / JSONL (mặc định: DATA_DIR hoặc '.')")
+    common.add_argument("--columnar", help="Snapshot dạng cột (COLUMNAR_SNAPSHOT) thay cho --data-dir")
+    common.add_argument("--replay", help="File JSON Lines các yêu cầu đã ghi lại")
+    common.add_argument("--save-requests", help="Ghi hỗn hợp yêu cầu tổng hợp ra file (để replay lại)")
+    common.add_argument("--pool", type=int, default=5000, help="Số yêu cầu tổng hợp khác nhau (mặc định: %(default)s)")
+    common.add_argument("--match-share", type=float, default=0.05, help="Tỉ lệ yêu cầu /match (mặc định: %(default)s)")
+    common.add_argument("--repeat-share", type=float, default=0.2, help="Tỉ lệ /suggest lặp lại yêu cầu cũ (mặc định: %(default)s)")
+    common.add_argument("--seed", type=int, default=0)
+    common.add_argument("--duration", type=float, default=30.0, help="Thời gian đo mỗi lượt (giây, mặc định: %(default)s)")
+    common.add_argument("--warmup", type=float, default=3.0, help="Thời gian làm nóng trước khi đo (giây, mặc định: %(default)s)")
+    common.add_argument("--no-response-cache", action="store_true", help="Tắt cache response /suggest của server")
+    common.add_argument("--output", help="Ghi kết quả ra file JSON")
+
+    run_parser = sub.add_parser("run", parents=[common], help="Một lượt tải với cấu hình cố định")
+    run_parser.add_argument("--url", help="Dùng server có sẵn thay vì khởi động server mới")
+    run_parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+    run_parser.add_argument("--threads", type=int, default=int(os.getenv("GUNICORN_THREADS", "1")))
+    run_parser.add_argument("--concurrency", type=int, default=8, help="Số yêu cầu đồng thời (vòng kín) / đang bay tối đa (vòng mở)")
+    run_parser.add_argument("--rate", type=float, help="Tốc độ mục tiêu (req/s) - vòng mở; bỏ trống = vòng kín")
+    run_parser.add_argument("--requests", type=int, help="Dừng sau số yêu cầu này (thay vì theo --duration)")
+
+    sweep_parser = sub.add_parser("sweep", parents=[common], help="Quét số worker / thread / mức đồng thời tìm điểm bão hoà")
+    sweep_parser.add_argument("--workers", default="1,2,4", help="Danh sách số worker (mặc định: %(default)s)")
+    sweep_parser.add_argument("--threads", default="1,4", help="Danh sách số thread mỗi worker (mặc định: %(default)s)")
+    sweep_parser.add_argument("--concurrency", default="1,4,16,64", help="Danh sách mức đồng thời (mặc định: %(default)s)")
+    sweep_parser.add_argument("--slo-ms", type=float, help="Chỉ chọn cấu hình có p99 tại điểm bão hoà không vượt quá mức này")
+    args = parser.parse_args()
+
+    requests_ = _requests_from_args(args)
+    if args.command == "run":
+        if args.url:
+            summary = run_load(args.url, requests_, args.concurrency, args.rate, args.duration, args.requests, args.warmup)
+        else:
+            with Server(args.workers, args.threads, args.data_dir, args.columnar, not args.no_response_cache) as server:
+                print(f"-> Server {server.kind} tại {server.url}")
+                summary = run_load(server.url, requests_, args.concurrency, args.rate, args.duration, args.requests, args.warmup)
+        mode = f"{args.rate:g} req/s" if args.rate else f"{args.concurrency} đồng thời"
+        print(f"-> Kết quả ({mode}):")
+        print_summary(summary)
+        report = summary
+    else:
+        report = sweep(args, requests_)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"-> Đã ghi kết quả vào '{args.output}'.")
@@ -0,0 +1,356 @@
+"""
+Đồ thị match dạng CSR và bảng cơ hội gặp gỡ tính sẵn cho mọi cạnh của đồ thị.
+
+match_list của người dùng là list các dict; MatchGraph gom toàn bộ thành ba mảng:
+  - offsets (int64, n_nodes + 1): cạnh của nút i nằm ở [offsets[i], offsets[i + 1]);
+  - indices (int32): mã nút của match, theo đúng thứ tự trong match_list;
+  - scores (float32): match score.
+Nút là người dùng (theo thứ tự store.users) rồi tới các id chỉ xuất hiện trong match_list,
+giống bảng user_ids của snapshot dạng cột.
+
+Với mỗi cạnh A -> B, compute_opportunities tìm cặp (lịch trình của A, lịch trình của B) có
+điểm gặp gỡ tốt nhất 0.5 * time_overlap + 0.5 * exp(-khoảng cách / 5km) - cùng công thức với
+best_overlap_with_schedules của engine - trong một lượt vector hoá trên toàn bộ các cặp lịch trình
+(chia lô theo OPPORTUNITY_CHUNK_PAIRS để giới hạn bộ nhớ). Cặp chung nhau hai chiều (A <-> B) chỉ tính một lần.
+Chi phí là tổng số cặp lịch trình nA × nB trên các cạnh, nên đây là job theo lô chứ không chạy theo request.
+
+Đồ thị chỉ sống trong bộ nhớ, không được ghi ra đĩa: DataStore.match_graph dựng lười ở lần dùng đầu tiên
+(/match?user_id=...), còn wsgi.py dựng sẵn trong master trước khi fork (WARM_MATCH_GRAPH) để các worker dùng
+chung. Sau mỗi thay đổi qua API, refresh_users chỉ tính lại các hàng bị ảnh hưởng và thay bộ mảng bằng
+một phép gán (GraphArrays); mỗi lần khởi động lại đồ thị được dựng lại từ dữ liệu đang phục vụ.
+
+Chạy độc lập để đo thời gian dựng:
+    python match_graph.py [--columnar data_columnar] [--top 5]
+"""
+import argparse
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from geo_distance import pairwise
+
+# Số cặp lịch trình tối đa được xử lý trong một lô của compute_opportunities
+OPPORTUNITY_CHUNK_PAIRS = 1 << 20
+
+
+def _time_overlap(starts1, ends1, starts2, ends2):
+    """Như time_overlap của engine nhưng so từng cặp phần tử (mảng cùng độ dài)."""
+    overlap = np.minimum(ends1, ends2) - np.maximum(starts1, starts2)
+    longest = np.maximum(ends1 - starts1, ends2 - starts2)
+    mask = (overlap > 0) & (longest > 0)
+    scores = np.zeros(overlap.shape, dtype=np.float64)
+    np.divide(overlap, longest, out=scores, where=mask)
+    return scores
+
+
+def best_schedule_pairs(a_codes, b_codes, sched_offsets, arrays, radius_km=5, chunk_pairs=OPPORTUNITY_CHUNK_PAIRS):
+    """
+    Với mỗi cặp nút (a_codes[e], b_codes[e]), cặp lịch trình có điểm 0.5 * time + 0.5 * loc cao nhất.
+    Lịch trình của nút c là các vị trí [sched_offsets[c], sched_offsets[c + 1]) của arrays (ScheduleArrays).
+    Trả về (overlap, time_overlap, distance_km, idx_a, idx_b); idx là vị trí trong lịch trình của từng người
+    (cùng thứ tự với schedules_of), hoà thì lấy cặp đầu tiên theo (idx_a, idx_b). Cặp không có lịch trình
+    nào có overlap = 0, distance = inf và idx = -1.
+    """
+    a_codes = np.asarray(a_codes, dtype=np.int64)
+    b_codes = np.asarray(b_codes, dtype=np.int64)
+    counts = np.diff(sched_offsets)
+    n_a, n_b = counts[a_codes], counts[b_codes]
+    sizes = n_a * n_b
+
+    n = a_codes.size
+    overlap = np.zeros(n, dtype=np.float32)
+    time_o = np.zeros(n, dtype=np.float32)
+    distance = np.full(n, np.inf, dtype=np.float32)
+    idx_a = np.full(n, -1, dtype=np.int32)
+    idx_b = np.full(n, -1, dtype=np.int32)
+
+    valid = np.flatnonzero(sizes > 0)
+    cumulative = np.cumsum(sizes[valid])
+    lo = 0
+    while lo < valid.size:
+        done = cumulative[lo - 1] if lo else 0
+        # Ít nhất một cặp mỗi lô, kể cả khi riêng cặp đó vượt chunk_pairs
+        hi = max(lo + 1, int(np.searchsorted(cumulative, done + chunk_pairs, side="right")))
+        sel = valid[lo:hi]
+        seg_sizes = sizes[sel]
+        total = int(seg_sizes.sum())
+        seg_starts = np.cumsum(seg_sizes) - seg_sizes
+        seg = np.repeat(np.arange(sel.size), seg_sizes)
+        local = np.arange(total) - seg_starts[seg]
+        nb = n_b[sel][seg]
+        local_a, local_b = local // nb, local % nb
+        ia = sched_offsets[a_codes[sel]][seg] + local_a
+        ib = sched_offsets[b_codes[sel]][seg] + local_b
+
+        t = _time_overlap(arrays.starts[ia], arrays.ends[ia], arrays.starts[ib], arrays.ends[ib])
+        d = pairwise(arrays.lats[ia], arrays.lons[ia], arrays.lats[ib], arrays.lons[ib])
+        score = 0.5 * t + 0.5 * np.exp(-d / radius_km)
+
+        best = np.maximum.reduceat(score, seg_starts)
+        first = np.minimum.reduceat(np.where(score == best[seg], np.arange(total), total), seg_starts)
+        overlap[sel] = best
+        time_o[sel] = t[first]
+        distance[sel] = d[first]
+        idx_a[sel] = local_a[first]
+        idx_b[sel] = local_b[first]
+        lo = hi
+    return overlap, time_o, distance, idx_a, idx_b
+
+
+def _orient(sorter, src, dst):
+    """
+    Đặt mỗi cạnh về chiều (low, high) theo thứ tự id của hai nút (không theo mã nút, vốn phụ thuộc vào
+    thứ tự dựng), để cặp hoà điểm được chọn giống nhau khi dựng toàn bộ và khi refresh_users.
+    Trả về (forward, low, high) với forward = cạnh đã đúng chiều src -> dst.
+    """
+    rank = np.empty(sorter.size, dtype=np.int64)
+    rank[sorter] = np.arange(sorter.size)
+    forward = rank[src] <= rank[dst]
+    return forward, np.where(forward, src, dst), np.where(forward, dst, src)
+
+
+def _directed(forward, overlap, time_o, distance, idx_low, idx_high):
+    """Kết quả best_schedule_pairs theo chiều (low, high) -> các mảng opp_* theo chiều của cạnh."""
+    # Khoảng cách và time_overlap đối xứng; chỉ cần đổi vai hai chỉ số lịch trình theo chiều của cạnh
+    return {
+        "opp_overlap": overlap,
+        "opp_time": time_o,
+        "opp_distance": distance,
+        "opp_schedule": np.where(forward, idx_low, idx_high),
+        "opp_match_schedule": np.where(forward, idx_high, idx_low),
+    }
+
+
+# Toàn bộ mảng của đồ thị; refresh_users dựng một bộ mới rồi thay bằng một phép gán duy nhất, nên
+# người đọc lấy self._arrays một lần luôn thấy các mảng cùng một phiên bản
+GraphArrays = namedtuple("GraphArrays", [
+    "node_ids", "sorter", "offsets", "indices", "scores",
+    "opp_overlap", "opp_time", "opp_distance", "opp_schedule", "opp_match_schedule",
+])
+OPPORTUNITY_FIELDS = ("opp_overlap", "opp_time", "opp_distance", "opp_schedule", "opp_match_schedule")
+
+
+class MatchGraph:
+    """
+    Đồ thị match dạng CSR (xem docstring của module) cùng các mảng cơ hội gặp gỡ song song với cạnh:
+    opp_overlap / opp_time / opp_distance (float32) và opp_schedule / opp_match_schedule (int32,
+    vị trí trong schedules_of của người có cạnh và của match; -1 nếu một bên không có lịch trình).
+    """
+
+    def __init__(self, node_ids, offsets, indices, scores, sorter=None):
+        # Giữ nguyên mảng id được truyền vào (vd. cột memory map của snapshot) thay vì sao chép
+        node_ids = node_ids if isinstance(node_ids, np.ndarray) else np.array(node_ids, dtype=str)
+        self._arrays = GraphArrays(
+            node_ids=node_ids,
+            sorter=np.asarray(sorter) if sorter is not None else np.argsort(node_ids, kind="stable"),
+            offsets=np.asarray(offsets, dtype=np.int64),
+            indices=np.asarray(indices, dtype=np.int32),
+            scores=np.asarray(scores, dtype=np.float32),
+            **dict.fromkeys(OPPORTUNITY_FIELDS),
+        )
+
+    def __getattr__(self, name):
+        # graph.offsets, graph.opp_overlap, ...: mảng của phiên bản hiện tại
+        if name in GraphArrays._fields:
+            return getattr(self._arrays, name)
+        raise AttributeError(name)
+
+    @classmethod
+    def from_store(cls, store):
+        """Dựng đồ thị từ store.match_csr() rồi tính cơ hội gặp gỡ cho mọi cạnh."""
+        graph = cls(*store.match_csr())
+        graph.compute_opportunities(store)
+        return graph
+
+    @property
+    def n_nodes(self):
+        return self.node_ids.size
+
+    @property
+    def n_edges(self):
+        return self.indices.size
+
+    @property
+    def nbytes(self):
+        arrays = self._arrays
+        return sum(getattr(arrays, name).nbytes for name in ("offsets", "indices", "scores") + OPPORTUNITY_FIELDS
+                   if getattr(arrays, name) is not None)
+
+    @staticmethod
+    def _code_of(arrays, user_id):
+        pos = int(np.searchsorted(arrays.node_ids, user_id, sorter=arrays.sorter))
+        if pos < arrays.sorter.size:
+            code = int(arrays.sorter[pos])
+            if arrays.node_ids[code] == user_id:
+                return code
+        return None
+
+    def code_of(self, user_id):
+        """Mã nút của user_id (None nếu không có trong đồ thị)."""
+        return self._code_of(self._arrays, user_id)
+
+    @classmethod
+    def _edge_range(cls, arrays, user_id):
+        code = cls._code_of(arrays, user_id)
+        if code is None:
+            return 0, 0
+        return int(arrays.offsets[code]), int(arrays.offsets[code + 1])
+
+    def edge_range(self, user_id):
+        return self._edge_range(self._arrays, user_id)
+
+    def neighbours(self, user_id):
+        """(mã nút của các match, match score) của user_id, theo thứ tự match_list."""
+        arrays = self._arrays
+        lo, hi = self._edge_range(arrays, user_id)
+        return arrays.indices[lo:hi], arrays.scores[lo:hi]
+
+    def _edge_sources(self):
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int64), np.diff(self.offsets))
+
+    def compute_opportunities(self, store):
+        """Tính cơ hội gặp gỡ cho mọi cạnh; cặp hai chiều A <-> B chỉ được tính một lần."""
+        arrays = self._arrays
+        n_nodes = arrays.node_ids.size
+        sched_offsets, schedules = store.flat_schedule_arrays(arrays.node_ids)
+        src = np.repeat(np.arange(n_nodes, dtype=np.int64), np.diff(arrays.offsets))
+        dst = arrays.indices.astype(np.int64)
+        forward, low, high = _orient(arrays.sorter, src, dst)
+        pair_keys, inverse = np.unique(low * n_nodes + high, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        opportunities = best_schedule_pairs(pair_keys // n_nodes, pair_keys % n_nodes, sched_offsets, schedules)
+        self._arrays = arrays._replace(**_directed(forward, *(values[inverse] for values in opportunities)))
+
+    def refresh_users(self, store, user_ids):
+        """
+        Dựng lại các hàng (cạnh đi ra) của user_ids từ store và tính lại cơ hội gặp gỡ của các cạnh đó.
+        Như MatchScenarioIndex.refresh_users, tập user_ids do DataStore truyền vào đã gồm những người có
+        người bị thay đổi trong match_list, nên mọi cạnh tới người có lịch trình thay đổi cũng được tính lại.
+
+        Chỉ các hàng của user_ids được tính lại; các hàng khác được chép nguyên khối (các đoạn liên tiếp
+        giữa những hàng bị thay) sang bộ mảng mới, rồi bộ mảng mới thay bộ cũ bằng một phép gán.
+        """
+        arrays = self._arrays
+        node_ids = arrays.node_ids.tolist()
+        new_codes = {}
+
+        def code(user_id):
+            existing = self._code_of(arrays, user_id)
+            if existing is not None:
+                return existing
+            return new_codes.setdefault(user_id, len(node_ids) + len(new_codes))
+
+        rows = {}
+        for user_id in sorted(user_ids):
+            user = store.get_user(user_id)
+            matches = user["match_list"] if user is not None else []
+            rows[code(user_id)] = ([code(m["match_id"]) for m in matches], [m["score"] for m in matches])
+        if new_codes:
+            node_ids = np.array(node_ids + list(new_codes), dtype=str)
+            sorter = np.argsort(node_ids, kind="stable")
+        else:
+            node_ids, sorter = arrays.node_ids, arrays.sorter
+        n_nodes = node_ids.size
+
+        counts = np.zeros(n_nodes, dtype=np.int64)
+        counts[:arrays.offsets.size - 1] = np.diff(arrays.offsets)
+        row_codes = sorted(rows)
+        for c in row_codes:
+            counts[c] = len(rows[c][0])
+        offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        new_src = np.array([c for c in row_codes for _ in rows[c][0]], dtype=np.int64)
+        new_dst = np.array([d for c in row_codes for d in rows[c][0]], dtype=np.int64)
+        involved = np.unique(np.concatenate([new_src, new_dst]))
+        sched_offsets, schedules = store.flat_schedule_arrays(node_ids[involved].tolist())
+        forward, low, high = _orient(sorter, new_src, new_dst)
+        fresh = _directed(forward, *best_schedule_pairs(
+            np.searchsorted(involved, low), np.searchsorted(involved, high), sched_offsets, schedules
+        ))
+        fresh["indices"] = new_dst.astype(np.int32)
+        fresh["scores"] = np.array([s for c in row_codes for s in rows[c][1]], dtype=np.float32)
+
+        # Ghép: đoạn cạnh cũ giữa hai hàng bị thay + hàng mới; hàng của nút mới nằm sau mọi hàng cũ
+        old_offsets = arrays.offsets
+        old_end = old_offsets[-1]
+        kept, fresh_slices = [], []
+        prev, fresh_pos = 0, 0
+        for c in row_codes:
+            row_start = old_offsets[c] if c < old_offsets.size - 1 else old_end
+            kept.append(slice(prev, row_start))
+            fresh_slices.append(slice(fresh_pos, fresh_pos + len(rows[c][0])))
+            prev = old_offsets[c + 1] if c < old_offsets.size - 1 else old_end
+            fresh_pos += len(rows[c][0])
+        kept.append(slice(prev, old_end))
+
+        def splice(old, new):
+            pieces = []
+            for k, f in zip(kept, fresh_slices):
+                pieces.extend((old[k], new[f]))
+            pieces.append(old[kept[-1]])
+            return np.concatenate(pieces).astype(old.dtype, copy=False)
+
+        self._arrays = GraphArrays(
+            node_ids=node_ids, sorter=sorter, offsets=offsets,
+            **{name: splice(getattr(arrays, name), fresh[name]) for name in ("indices", "scores") + OPPORTUNITY_FIELDS},
+        )
+
+    def opportunities_of(self, user_id, store, limit=None):
+        """
+        Cơ hội gặp gỡ tính sẵn của user_id với từng match (có lịch trình ở cả hai phía), xếp theo
+        rank = match_score × overlap giảm dần (hoà thì giữ thứ tự match_list).
+        """
+        arrays = self._arrays
+        lo, hi = self._edge_range(arrays, user_id)
+        if hi == lo:
+            return []
+        edges = lo + np.flatnonzero(arrays.opp_schedule[lo:hi] >= 0)
+        ranks = arrays.scores[edges].astype(np.float64) * arrays.opp_overlap[edges]
+        order = np.argsort(-ranks, kind="stable")[:limit]
+        # Cạnh của một hàng theo đúng thứ tự match_list, nên trả về chính dict match (điểm gốc, không làm tròn float32)
+        match_list = store.get_user(user_id)["match_list"]
+        schedules = store.schedules_of(user_id)
+        results = []
+        for e, rank in zip(edges[order], ranks[order]):
+            match = match_list[e - lo]
+            match_id = match["match_id"]
+            results.append({
+                "match": match,
+                "todo": schedules[arrays.opp_schedule[e]],
+                "schedule_match": store.schedules_of(match_id)[arrays.opp_match_schedule[e]],
+                "overlap": float(arrays.opp_overlap[e]),
+                "time_overlap": float(arrays.opp_time[e]),
+                "distance_km": float(arrays.opp_distance[e]),
+                "rank_score": float(rank),
+            })
+        return results
+
+
+if __name__ == "__main__":
+    from activity_model_engine import load_data
+    from columnar_store import load_columnar
+
+    parser = argparse.ArgumentParser(description="Dựng đồ thị match CSR và tính cơ hội gặp gỡ cho mọi cạnh.")
+    parser.add_argument("--columnar", default=None, help="Đọc từ snapshot dạng cột thay vì file JSON")
+    parser.add_argument("--top", type=int, default=5, help="Số cạnh có cơ hội gặp gỡ tốt nhất được in ra")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    store = load_columnar(args.columnar) if args.columnar and os.path.isdir(args.columnar) else load_data()
+    print(f"-> Đã tải dữ liệu trong {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    graph = MatchGraph(*store.match_csr())
+    print(f"-> Đồ thị: {graph.n_nodes} nút, {graph.n_edges} cạnh ({time.perf_counter() - started:.2f}s)")
+    started = time.perf_counter()
+    graph.compute_opportunities(store)
+    print(f"-> Cơ hội gặp gỡ: {time.perf_counter() - started:.2f}s, {graph.nbytes / 2**20:.1f} MB")
+
+    ranks = graph.scores.astype(np.float64) * graph.opp_overlap
+    src = graph._edge_sources()
+    for e in np.argsort(-ranks, kind="stable")[:args.top]:
+        print(f"   {graph.node_ids[src[e]]} -> {graph.node_ids[graph.indices[e]]}: score={graph.scores[e]:.3f}, "
+              f"overlap={graph.opp_overlap[e]:.3f}, time={graph.opp_time[e]:.3f}, d={graph.opp_distance[e]:.2f}km")
@@ -0,0 +1,222 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from geo_distance import many_to_many
+from spatial_index import KM_PER_DEG_LAT_MIN, KM_PER_DEG_LON_EQUATOR
+
+# Khoảng cách / độ lệch giờ bắt đầu tối đa của một cặp được đưa vào chỉ mục.
+# Truy vấn /match chỉ có thể lọc chặt hơn, không thể nới rộng hơn các ngưỡng này.
+INDEX_MAX_DISTANCE_KM = 3.0
+INDEX_MAX_TIME_DIFF_S = 2 * 3600
+# Số dòng đã xoá tối thiểu trước khi refresh_users dọn lại các mảng
+COMPACT_MIN_DEAD = 1024
+
+
+class MatchScenarioIndex:
+    """
+    Chỉ mục các cặp gặp gỡ tiềm năng (lịch trình của A, lịch trình của một match B của A),
+    khoá theo (time bucket, ô lưới) của lịch trình A.
+
+    Khi xây dựng, lịch trình của A chỉ được so với lịch trình của chính các match của A (gom thành
+    một khối như MatchContext), trong một phép tính ma trận cho mỗi người dùng. Các cặp được sắp sẵn
+    theo rank = match_score × proximity (proximity = exp(-d / 5km), giống sim_loc), nên truy vấn
+    top-N chỉ là lọc mảng + phân trang. Khoá (giờ bắt đầu // 2h, ô lưới cạnh 3km) của lịch trình A
+    dùng cho các truy vấn theo thời điểm / vị trí.
+    """
+
+    def __init__(self, store, max_distance_km=INDEX_MAX_DISTANCE_KM, max_time_diff_s=INDEX_MAX_TIME_DIFF_S):
+        self.store = store
+        self.max_distance_km = max_distance_km
+        self.max_time_diff_s = max_time_diff_s
+        self.dlat = max_distance_km / KM_PER_DEG_LAT_MIN
+        self.dlon = max_distance_km / KM_PER_DEG_LON_EQUATOR
+        self._build()
+
+    def _key(self, start, lat, lon):
+        return (int(start // self.max_time_diff_s), math.floor(lat / self.dlat), math.floor(lon / self.dlon))
+
+    def _neighbour_keys(self, key):
+        t, i, j = key
+        # Cạnh ô lưới tính theo km/độ lớn nhất của kinh độ nên ±2 ô theo kinh độ là đủ an toàn
+        return [(t + dt, i + di, j + dj) for dt in (-1, 0, 1) for di in (-1, 0, 1) for dj in (-2, -1, 0, 1, 2)]
+
+    def _build(self):
+        pairs = []
+        for user_A in self.store.users:
+            pairs.extend(self._pairs_for_user(user_A))
+        self.pairs = pairs
+        self._reindex_rows()
+        columns = self._columns(pairs)
+        # Sắp xếp theo rank giảm dần; hoà thì giữ thứ tự duyệt (người dùng, lịch trình)
+        order = np.argsort(-columns["ranks"], kind="stable")
+        self.order = order
+        for name, values in columns.items():
+            setattr(self, name, values[order])
+
+    def _pairs_for_user(self, user_A):
+        """
+        Mọi cặp (lịch trình của A, lịch trình của một match của A) nằm trong ngưỡng của chỉ mục,
+        theo thứ tự (lịch trình của A, match trong match_list, lịch trình của match).
+        """
+        store = self.store
+        arrays_A = store.schedule_arrays_of(user_A["user_id"])
+        matches = {m["match_id"]: m for m in user_A["match_list"]}
+        if not matches or arrays_A.starts.size == 0:
+            return []
+        owners, blocks = [], []
+        for match_B in matches.values():
+            arrays_B = store.schedule_arrays_of(match_B["match_id"])
+            owners.extend((match_B, idx_B) for idx_B in range(arrays_B.starts.size))
+            blocks.append(arrays_B)
+        if not owners:
+            return []
+        starts_B, lats_B, lons_B = (np.concatenate([getattr(b, f) for b in blocks]) for f in ("starts", "lats", "lons"))
+
+        time_diffs = np.abs(arrays_A.starts[:, None] - starts_B[None, :])
+        distances = many_to_many(arrays_A.lats, arrays_A.lons, lats_B, lons_B)
+        hits = np.argwhere((time_diffs <= self.max_time_diff_s) & (distances <= self.max_distance_km))
+        keys_A = {}
+        pairs = []
+        for idx_A, col in hits.tolist():
+            key_A = keys_A.get(idx_A)
+            if key_A is None:
+                key_A = keys_A[idx_A] = self._key(arrays_A.starts[idx_A], arrays_A.lats[idx_A], arrays_A.lons[idx_A])
+            match_B, idx_B = owners[col]
+            pairs.append((user_A["user_id"], idx_A, match_B, match_B["match_id"], idx_B,
+                          float(distances[idx_A, col]), int(time_diffs[idx_A, col]), key_A))
+        return pairs
+
+    @staticmethod
+    def _columns(pairs):
+        scores = np.array([p[2]["score"] for p in pairs], dtype=np.float64)
+        distances = np.array([p[5] for p in pairs], dtype=np.float64)
+        return {
+            "scores": scores,
+            "distances": distances,
+            "ranks": scores * np.exp(-distances / 5),
+            "time_diffs": np.array([p[6] for p in pairs], dtype=np.int64),
+        }
+
+    def _register_rows(self, first_row):
+        for row in range(first_row, len(self.pairs)):
+            pair = self.pairs[row]
+            self._rows_by_user[pair[0]].append(row)
+            self.pairs_by_key[pair[7]].add(row)
+
+    def _reindex_rows(self):
+        self._rows_by_user = defaultdict(list)
+        self.pairs_by_key = defaultdict(set)
+        self._register_rows(0)
+        self._alive = np.ones(len(self.pairs), dtype=bool)
+        self._n_dead = 0
+
+    def refresh_users(self, user_ids):
+        """
+        Cập nhật tăng dần sau khi dữ liệu của user_ids thay đổi: tính lại các cặp có A thuộc user_ids.
+        Tập user_ids do DataStore truyền vào đã gồm những người có người bị thay đổi trong match_list,
+        nên mọi cặp có B bị thay đổi cũng được tính lại.
+
+        Chỉ chạm tới các cặp của user_ids: cặp cũ được đánh dấu đã xoá (vẫn nằm trong các mảng đã sắp
+        xếp, bị bỏ qua khi truy vấn), cặp mới được chèn vào đúng vị trí bằng searchsorted. Các dòng đã
+        xoá được dọn một lần khi chúng nhiều hơn số cặp còn sống.
+
+        Các mảng được thay lần lượt từng mảng nên không được gọi song song với query(): bên gọi phải chặn
+        các lần đọc trong lúc ghi (api_server dùng ReadWriteLock cho mọi thao tác thay đổi store).
+        """
+        user_ids = set(user_ids)
+        dead = [row for user_id in user_ids for row in self._rows_by_user.pop(user_id, ())]
+        for row in dead:
+            rows_of_key = self.pairs_by_key[self.pairs[row][7]]
+            rows_of_key.discard(row)
+            if not rows_of_key:
+                del self.pairs_by_key[self.pairs[row][7]]
+            self.pairs[row] = None
+        self._alive[dead] = False
+        self._n_dead += len(dead)
+
+        pairs = []
+        for user_id in user_ids:
+            user_A = self.store.get_user(user_id)
+            if user_A is not None:
+                pairs.extend(self._pairs_for_user(user_A))
+        if pairs:
+            self._insert(pairs)
+        if self._n_dead > max(COMPACT_MIN_DEAD, len(self)):
+            self._compact()
+
+    def _insert(self, pairs):
+        first_row = len(self.pairs)
+        self.pairs.extend(pairs)
+        self._register_rows(first_row)
+        self._alive = np.concatenate([self._alive, np.ones(len(pairs), dtype=bool)])
+
+        columns = self._columns(pairs)
+        order = np.argsort(-columns["ranks"], kind="stable")
+        # Sau mọi cặp có rank >= (hoà thì cặp mới đứng sau), như khi sắp xếp lại toàn bộ
+        at = np.searchsorted(-self.ranks, -columns["ranks"][order], side="right")
+        self.order = np.insert(self.order, at, first_row + order)
+        for name, values in columns.items():
+            setattr(self, name, np.insert(getattr(self, name), at, values[order]))
+
+    def _compact(self):
+        """Bỏ các dòng đã xoá khỏi các mảng đã sắp xếp và đánh số lại các dòng còn sống."""
+        keep = self._alive[self.order]
+        for name in ("order", "scores", "distances", "ranks", "time_diffs"):
+            setattr(self, name, getattr(self, name)[keep])
+        live_rows = np.flatnonzero(self._alive)
+        new_row = np.empty(len(self.pairs), dtype=np.int64)
+        new_row[live_rows] = np.arange(live_rows.size)
+        self.order = new_row[self.order]
+        self.pairs = [self.pairs[row] for row in live_rows.tolist()]
+        self._reindex_rows()
+
+    def __len__(self):
+        return int(self.order.size - self._n_dead)
+
+    def query(self, min_match_score=0.85, max_distance_km=1.5, page=1, page_size=10, start=None, location=None):
+        """
+        Trả về (kết quả của trang, tổng số kết quả) theo rank giảm dần.
+        start (epoch) / location (dict lat/lon) tuỳ chọn: chỉ lấy các cặp trong bucket lân cận.
+        """
+        if max_distance_km > self.max_distance_km:
+            raise ValueError(f"max_distance_km không được vượt quá {self.max_distance_km} km")
+        if page < 1 or page_size < 1:
+            raise ValueError("page và page_size phải >= 1")
+
+        mask = self._alive[self.order] & (self.scores >= min_match_score) & (self.distances <= max_distance_km)
+        if start is not None or location is not None:
+            near = np.zeros(len(self.pairs), dtype=bool)
+            near[list(self._rows_near(start, location))] = True
+            mask &= near[self.order]
+        positions = np.flatnonzero(mask)
+        page_positions = positions[(page - 1) * page_size: page * page_size]
+        return [self._scenario(pos) for pos in page_positions], int(positions.size)
+
+    def _rows_near(self, start, location):
+        if start is not None and location is not None:
+            key = self._key(start, location["latitude"], location["longitude"])
+            for neighbour in self._neighbour_keys(key):
+                yield from self.pairs_by_key.get(neighbour, ())
+            return
+        for (t, i, j), rows in self.pairs_by_key.items():
+            if start is not None and abs(t - int(start // self.max_time_diff_s)) > 1:
+                continue
+            if location is not None:
+                _, ci, cj = self._key(0, location["latitude"], location["longitude"])
+                if abs(i - ci) > 1 or abs(j - cj) > 2:
+                    continue
+            yield from rows
+
+    def _scenario(self, pos):
+        user_A_id, idx_A, match_B, user_B_id, idx_B, dist, time_diff, _ = self.pairs[self.order[pos]]
+        return {
+            "user_A": self.store.get_user(user_A_id),
+            "todo_A": self.store.schedules_of(user_A_id)[idx_A],
+            "match_B": match_B,
+            "schedule_B": self.store.schedules_of(user_B_id)[idx_B],
+            "distance_km": dist,
+            "time_diff_hours": time_diff / 3600,
+            "rank_score": float(self.ranks[pos]),
+        }
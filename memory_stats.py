@@ -0,0 +1,36 @@
+"""Thống kê bộ nhớ của tiến trình hiện tại (Linux, đọc /proc/self/smaps_rollup)."""
+import os
+
+
+def process_memory():
+    """
+    Trả về dict (đơn vị KB): rss, pss, shared (Shared_Clean + Shared_Dirty), private và
+    shared_fraction = shared / rss. Trả về None nếu hệ điều hành không có smaps_rollup.
+    """
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    fields = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 3 and parts[2] == "kB":
+            fields[parts[0].rstrip(":")] = int(parts[1])
+    rss = fields.get("Rss", 0)
+    shared = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+    return {
+        "pid": os.getpid(),
+        "rss_kb": rss,
+        "pss_kb": fields.get("Pss", 0),
+        "shared_kb": shared,
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared_fraction": shared / rss if rss else 0.0,
+    }
+
+
+def format_memory(stats):
+    if stats is None:
+        return "không đọc được /proc/self/smaps_rollup"
+    return (f"pid {stats['pid']}: RSS {stats['rss_kb'] / 1024:.1f} MB, PSS {stats['pss_kb'] / 1024:.1f} MB, "
+            f"chia sẻ {stats['shared_fraction']:.0%}")
@@ -0,0 +1,350 @@
+"""
+Đo đạc nhẹ cho pipeline gợi ý: bộ đếm, histogram thời gian theo giai đoạn, log có lấy mẫu và
+dump profile (cProfile) theo từng yêu cầu khi được bật.
+
+  - Counter / Histogram tự cài đặt (không cần prometheus_client), render ra định dạng text của
+    Prometheus qua REGISTRY.render() - api_server phục vụ tại /metrics.
+  - stage(name): đo một giai đoạn (match_context, candidates, bias_scoring, target_match, content),
+    ghi vào histogram activity_stage_seconds và vào thời gian của yêu cầu hiện tại (nếu có) để
+    api_server trả về header Server-Timing.
+  - get_logger(name): logger theo cấp độ (LOG_LEVEL), bản ghi dưới WARNING chỉ được giữ với xác
+    suất LOG_SAMPLE_RATE; truyền extra=UNSAMPLED để luôn ghi.
+  - PROFILE_DIR: nếu đặt, yêu cầu có header "X-Profile: 1" được chạy dưới cProfile và dump ra
+    PROFILE_DIR/<endpoint>-<thời gian>-<pid>.prof.
+
+Mỗi tiến trình (worker gunicorn) có số liệu riêng; Prometheus scrape từng worker hoặc cộng lại.
+"""
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+# Mốc (giây) của histogram thời gian
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# --- 1. COUNTER / HISTOGRAM ---
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def snapshot(self):
+        """(số quan sát tích luỹ theo từng mốc, sum, count)."""
+        with self._lock:
+            counts, total, n = list(self.counts), self.sum, self.count
+        cumulative, running = [], 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, n
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Chuỗi con theo giá trị nhãn (được ghi nhớ; nên giữ lại kết quả ở nơi gọi nhiều lần)."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} cần nhãn {self.labelnames}, nhận được {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def value(self, *labels):
+        child = self._children.get(labels)
+        return child.value if child is not None else 0
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, values), child.value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            cumulative, total, n = child.snapshot()
+            for bound, c in zip(self.buckets, cumulative):
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, values, [("le", _format_value(bound))]), c
+            yield f"{self.name}_bucket", _format_labels(self.labelnames, values, [("le", "+Inf")]), n
+            yield f"{self.name}_sum", _format_labels(self.labelnames, values), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, values), n
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._caches = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_cache(self, name, stats):
+        """
+        Cache có thống kê riêng (vd. ResponseCache.stats): stats() trả về dict có hits, misses và
+        tuỳ chọn evictions / entries / bytes; được đọc lại mỗi lần render.
+        """
+        self._caches[name] = stats
+
+    def cache_hit_ratios(self):
+        """{tên cache: tỉ lệ hit} cho mọi cache: cache đăng ký qua register_cache và CACHE_LOOKUPS."""
+        counts = {}
+        for (cache, result), child in list(CACHE_LOOKUPS._children.items()):
+            counts.setdefault(cache, {"hit": 0, "miss": 0})[result] = child.value
+        for cache, stats in self._caches.items():
+            s = stats()
+            counts[cache] = {"hit": s["hits"], "miss": s["misses"]}
+        return {
+            cache: c["hit"] / (c["hit"] + c["miss"]) if c["hit"] + c["miss"] else 0.0
+            for cache, c in counts.items()
+        }
+
+    def render(self):
+        """Toàn bộ số liệu ở định dạng text exposition của Prometheus (version 0.0.4)."""
+        cache_stats = {name: stats() for name, stats in self._caches.items()}
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+            if metric is CACHE_LOOKUPS:
+                for cache, stats in cache_stats.items():
+                    for result, key in (("hit", "hits"), ("miss", "misses")):
+                        lines.append(f"{metric.name}{_format_labels(metric.labelnames, (cache, result))} {stats[key]}")
+
+        extra = (
+            ("activity_cache_evictions_total", "counter", "Số entry bị đẩy ra khỏi cache", "evictions"),
+            ("activity_cache_entries", "gauge", "Số entry đang có trong cache", "entries"),
+            ("activity_cache_bytes", "gauge", "Dung lượng (byte) đang dùng của cache", "bytes"),
+        )
+        for name, kind, documentation, key in extra:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for cache, stats in cache_stats.items():
+                if key in stats:
+                    lines.append(f"{name}{_format_labels(('cache',), (cache,))} {_format_value(stats[key])}")
+
+        lines.append("# HELP activity_cache_hit_ratio Tỉ lệ hit / (hit + miss) từ lúc tiến trình khởi động")
+        lines.append("# TYPE activity_cache_hit_ratio gauge")
+        for cache, ratio in sorted(self.cache_hit_ratios().items()):
+            lines.append(f"activity_cache_hit_ratio{_format_labels(('cache',), (cache,))} {_format_value(ratio)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("activity_requests_total", "Số yêu cầu HTTP theo endpoint và mã trạng thái", ["endpoint", "status"])
+REQUEST_SECONDS = REGISTRY.histogram("activity_request_seconds", "Thời gian xử lý yêu cầu HTTP (giây)", ["endpoint"])
+STAGE_SECONDS = REGISTRY.histogram("activity_stage_seconds", "Thời gian từng giai đoạn của pipeline gợi ý (giây)", ["stage"])
+SUGGESTION_SOURCE = REGISTRY.counter("activity_suggestions_total", "Số response /suggest theo nguồn (cache, precomputed, model)", ["source"])
+CANDIDATES = REGISTRY.counter("activity_candidates_generated_total", "Số ứng viên nhiệm vụ được tạo")
+CANDIDATES_SCORED = REGISTRY.counter("activity_candidates_scored_total", "Số ứng viên được tính bias đầy đủ trong top_k_quests")
+CANDIDATES_PRUNED = REGISTRY.counter("activity_candidates_pruned_total", "Số ứng viên bị loại sớm nhờ cận trên trong top_k_quests")
+DISTANCE_CALLS = REGISTRY.counter("activity_distance_calls_total", "Số lần gọi hàm khoảng cách", ["kind"])
+DISTANCE_PAIRS = REGISTRY.counter("activity_distance_pairs_total", "Số cặp toạ độ được tính khoảng cách", ["kind"])
+OVERLAP_CALLS = REGISTRY.counter("activity_time_overlap_calls_total", "Số lần gọi hàm chồng chéo thời gian", ["kind"])
+OVERLAP_PAIRS = REGISTRY.counter("activity_time_overlap_pairs_total", "Số cặp khoảng thời gian được so sánh", ["kind"])
+CACHE_LOOKUPS = REGISTRY.counter("activity_cache_lookups_total", "Số lần tra cache theo kết quả (hit / miss)", ["cache", "result"])
+SHARD_ITEMS = REGISTRY.counter("activity_shard_items_total", "Số to-do được định tuyến tới từng shard (shard_server)", ["shard"])
+
+
+# --- 2. ĐO THỜI GIAN THEO GIAI ĐOẠN ---
+
+_local = threading.local()
+
+
+class _StageTimer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        STAGE_SECONDS.labels(self.name).observe(elapsed)
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def stage(name):
+    """with stage("candidates"): ... - đo thời gian của một giai đoạn."""
+    return _StageTimer(name)
+
+
+def begin_request():
+    """Bắt đầu gom thời gian các giai đoạn cho yêu cầu hiện tại (theo thread)."""
+    _local.timings = {}
+
+
+def end_request():
+    """Kết thúc yêu cầu hiện tại, trả về {giai đoạn: giây}."""
+    timings = getattr(_local, "timings", None) or {}
+    _local.timings = None
+    return timings
+
+
+def server_timing(timings):
+    """Giá trị header Server-Timing (mili giây) từ {giai đoạn: giây}."""
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items())
+
+
+def record_cache(cache, hit):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+# --- 3. LOG THEO CẤP ĐỘ, CÓ LẤY MẪU ---
+
+# extra=UNSAMPLED: bản ghi luôn được giữ dù dưới WARNING (vd. thông báo khởi động)
+UNSAMPLED = {"unsampled": True}
+
+
+class SamplingFilter(logging.Filter):
+    """Giữ mọi bản ghi từ WARNING trở lên; bản ghi thấp hơn được giữ với xác suất rate."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, "unsampled", False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+_configured = False
+
+
+def get_logger(name):
+    """Logger của ứng dụng: cấp độ theo LOG_LEVEL, bản ghi dưới WARNING lấy mẫu theo LOG_SAMPLE_RATE."""
+    global _configured
+    if not _configured:
+        _configured = True
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+        handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+        root = logging.getLogger("activity")
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+    return logging.getLogger(f"activity.{name}")
+
+
+# --- 4. PROFILE THEO YÊU CẦU (tuỳ chọn) ---
+
+def start_profile():
+    """Bắt đầu cProfile nếu PROFILE_DIR được đặt, ngược lại trả về None."""
+    if not PROFILE_DIR:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def dump_profile(profiler, label):
+    """Dừng profiler và ghi ra PROFILE_DIR (mở bằng `python -m pstats` hoặc snakeviz). Trả về đường dẫn."""
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_label = "".join(ch if ch.isalnum() else "_" for ch in label).strip("_") or "request"
+    path = os.path.join(PROFILE_DIR, f"{safe_label}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{time.perf_counter_ns() % 10**6}.prof")
+    profiler.dump_stats(path)
+    return path
@@ -1,36 +1,220 @@
+"""
+Nạp dữ liệu JSON local lên Firestore theo lô.
+
+  - File được đọc dần (JSON array hoặc JSON Lines), không nạp toàn bộ vào bộ nhớ.
+  - Mỗi batch có tối đa 500 thao tác ghi (giới hạn của Firestore), được commit bởi một pool
+    có số writer cố định; lỗi tạm thời được thử lại với backoff luỹ thừa.
+  - Mỗi document được ghi kèm vị trí của nó trong file (SOURCE_ORDER_FIELD) để firestore_loader tải lại
+    đúng thứ tự của file JSON.
+  - Tiến độ được lưu vào file checkpoint sau mỗi batch liên tiếp đã commit, nên chạy lại
+    sau khi bị ngắt sẽ tiếp tục từ chỗ dừng (ghi dùng merge=True nên ghi lặp lại là an toàn).
+
+Cách dùng:
+    python migrate_json_to_firestore.py --workers 8
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python migrate_json_to_firestore.py --fresh
+"""
+import argparse
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from firebase_client import init_firebase
+from firestore_loader import SOURCE_ORDER_FIELD
+
+# Giới hạn số thao tác ghi trong một batch của Firestore
+BATCH_LIMIT = 500
+DEFAULT_CHECKPOINT = "migrate_checkpoint.json"
+
+# (collection, trường id, file nguồn)
+SOURCES = [
+    ("pois", "poi_id", "pois.json"),
+    ("users", "user_id", "users.json"),
+    ("daily_schedules", "schedule_id", "daily_schedules.json"),
+]
+
+
+# --- 1. ĐỌC FILE THEO LUỒNG ---
+
+def iter_json_records(path, read_size=1 << 20):
+    """
+    Duyệt từng object trong file JSON array ([{...}, {...}]) hoặc JSON Lines
+    mà không nạp cả file vào bộ nhớ.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+        in_array = None
+        while True:
+            # Bỏ khoảng trắng và dấu phân cách giữa các phần tử
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if in_array is None and pos < len(buf):
+                in_array = buf[pos] == "["
+                if in_array:
+                    pos += 1
+                continue
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    if buf[pos:].strip():
+                        raise
+                    return
+                chunk = f.read(read_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            # Object có thể bị cắt đúng ở ranh giới chunk mà vẫn parse được (vd. số) - chỉ nhận khi chắc chắn
+            if end == len(buf) and not eof:
+                chunk = f.read(read_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield record
+            pos = end
+
+
+def iter_batches(records, size=BATCH_LIMIT):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- 2. CHECKPOINT ---
 
-# --- 1. Kết nối Firebase ---
-cred = credentials.Certificate("serviceAccountKey.json")  # 🔑 file key tải về
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+def _load_checkpoint(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
 
-def upsert(col, id_field, items):
+
+def _save_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+# --- 3. GHI LÊN FIRESTORE ---
+
+def _transient_errors():
+    from google.api_core import exceptions
+    return (
+        exceptions.Aborted, exceptions.DeadlineExceeded, exceptions.InternalServerError,
+        exceptions.ResourceExhausted, exceptions.ServiceUnavailable, ConnectionError,
+    )
+
+
+def commit_batch(db, col, id_field, items, first_index=0, max_retries=6, base_delay=0.5):
+    """
+    Commit một batch (≤ 500 document), thử lại lỗi tạm thời với backoff luỹ thừa + jitter.
+    first_index: vị trí trong file của item đầu tiên, ghi vào SOURCE_ORDER_FIELD.
+    """
     batch = db.batch()
-    for it in items:
+    for offset, it in enumerate(items):
         doc_id = it.get(id_field) or it.get("id")
         if not doc_id:
             raise ValueError(f"Missing {id_field} in item: {it}")
         ref = db.collection(col).document(doc_id)
-        batch.set(ref, it, merge=True)  # merge=True để update nếu có sẵn
-    batch.commit()
-    print(f"✅ Imported {len(items)} docs into '{col}'")
+        batch.set(ref, {**it, SOURCE_ORDER_FIELD: first_index + offset}, merge=True)  # merge=True để update nếu có sẵn
+
+    transient = _transient_errors()
+    for attempt in range(max_retries + 1):
+        try:
+            batch.commit()
+            return len(items)
+        except transient as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (0.5 + random.random())
+            print(f"\n⚠️ Commit vào '{col}' lỗi ({e.__class__.__name__}), thử lại sau {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def upsert(db, col, id_field, path, workers=8, checkpoint=None, checkpoint_path=DEFAULT_CHECKPOINT):
+    """
+    Nạp một file vào collection col. Các batch được commit đồng thời nhưng checkpoint chỉ tiến tới
+    batch liên tiếp cuối cùng đã commit xong, nên khi chạy lại không bỏ sót batch nào.
+    """
+    checkpoint = checkpoint if checkpoint is not None else {}
+    state = checkpoint.setdefault(col, {"file": path, "batch_size": BATCH_LIMIT, "done_batches": 0})
+    if state["file"] != path or state["batch_size"] != BATCH_LIMIT:
+        state.update(file=path, batch_size=BATCH_LIMIT, done_batches=0)
+    skip = state["done_batches"]
+    if skip:
+        print(f"-> '{col}': tiếp tục từ checkpoint, bỏ qua {skip} batch đã nạp.")
+
+    written = 0
+    finished = set()
+    started = last_report = time.perf_counter()
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def _drain(return_when):
+            nonlocal written, last_report
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                written += future.result()
+                finished.add(in_flight.pop(future))
+            # Đẩy checkpoint tới batch liên tiếp cuối cùng đã commit
+            advanced = False
+            while state["done_batches"] in finished:
+                finished.discard(state["done_batches"])
+                state["done_batches"] += 1
+                advanced = True
+            if advanced:
+                _save_checkpoint(checkpoint_path, checkpoint)
+            now = time.perf_counter()
+            if now - last_report >= 1.0:
+                last_report = now
+                print(f"\r   '{col}': {written} docs | {written / (now - started):.0f} docs/s", end="", flush=True)
+
+        for batch_no, items in enumerate(iter_batches(iter_json_records(path), BATCH_LIMIT)):
+            if batch_no < skip:
+                continue
+            # Giới hạn số batch đang chờ để bộ nhớ không tăng theo kích thước file
+            if len(in_flight) >= 2 * workers:
+                _drain(FIRST_COMPLETED)
+            in_flight[pool.submit(commit_batch, db, col, id_field, items, batch_no * BATCH_LIMIT)] = batch_no
+        while in_flight:
+            _drain(FIRST_COMPLETED)
+
+    elapsed = time.perf_counter() - started
+    rate = written / elapsed if elapsed > 0 else 0.0
+    print(f"\r✅ Imported {written} docs into '{col}' in {elapsed:.1f}s ({rate:.0f} docs/s)")
+    return written
 
-# --- 2. Đọc dữ liệu từ file JSON ---
-with open("pois.json","r",encoding="utf-8") as f:
-    pois = json.load(f)
 
-with open("users.json","r",encoding="utf-8") as f:
-    users = json.load(f)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nạp pois / users / daily_schedules từ JSON lên Firestore.")
+    parser.add_argument("--data-dir", default=".", help="Thư mục chứa các file JSON (mặc định: thư mục hiện tại)")
+    parser.add_argument("--workers", type=int, default=8, help="Số batch được commit đồng thời (mặc định: %(default)s)")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="File checkpoint (mặc định: %(default)s)")
+    parser.add_argument("--fresh", action="store_true", help="Bỏ qua checkpoint và nạp lại từ đầu")
+    args = parser.parse_args()
 
-with open("daily_schedules.json","r",encoding="utf-8") as f:
-    schedules = json.load(f)
+    # --- 1. Kết nối Firebase ---
+    db = init_firebase()
+    checkpoint = {} if args.fresh else _load_checkpoint(args.checkpoint)
 
-# --- 3. Upload lên Firestore ---
-upsert("pois", "poi_id", pois)
-upsert("users", "user_id", users)
-upsert("daily_schedules", "schedule_id", schedules)
+    # --- 2. Upload lên Firestore ---
+    total, started = 0, time.perf_counter()
+    for col, id_field, filename in SOURCES:
+        path = os.path.join(args.data_dir, filename)
+        if not os.path.exists(path):
+            # Cho phép dữ liệu dạng JSON Lines cùng tên
+            path = os.path.splitext(path)[0] + ".jsonl"
+        total += upsert(db, col, id_field, path, workers=args.workers, checkpoint=checkpoint, checkpoint_path=args.checkpoint)
 
-print("🎉 Done! All data migrated to Firestore.")
+    elapsed = time.perf_counter() - started
+    print(f"🎉 Done! All data migrated to Firestore: {total} docs in {elapsed:.1f}s ({total / elapsed:.0f} docs/s).")
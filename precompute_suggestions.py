@@ -0,0 +1,225 @@
+"""
+Job ngoại tuyến: tính sẵn gợi ý cho MỌI lịch trình trong dữ liệu (ứng viên + chấm điểm + nội dung)
+bằng một process pool, ghi ra file JSON Lines đánh khoá theo schedule_id.
+
+Định dạng file:
+  - dòng đầu: {"data_version": ..., "format": 1}
+  - mỗi dòng tiếp theo: {"schedule_id": ..., "user_id": ..., "todo": {...}, "suggestions": [...]}
+
+File được ghi nối tiếp sau mỗi chunk nên có thể chạy lại sau khi bị ngắt: các schedule_id đã có
+trong file (cùng data_version) sẽ được bỏ qua. api_server đọc file này khi khởi động và chỉ dùng
+khi data_version khớp và to-do trong yêu cầu trùng với lịch trình đã lưu.
+
+Cách dùng:
+    python precompute_suggestions.py --workers 8 --chunk-size 64
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+
+from activity_model_engine import build_match_context, load_data
+from content_generator import ContentGenerator
+from suggestion_pipeline import build_suggestions, todo_key
+
+DEFAULT_OUTPUT = "precomputed_suggestions.jsonl"
+# 2: nội dung được sinh với RNG theo todo_key (xem suggestion_pipeline.content_rng)
+FORMAT_VERSION = 2
+
+# Dữ liệu dùng chung trong mỗi worker (kế thừa từ tiến trình cha khi fork, hoặc tải lại khi spawn)
+_store = None
+_content_gen = None
+
+
+# --- 1. ĐỌC KẾT QUẢ TÍNH SẴN (dùng bởi api_server) ---
+
+class PrecomputedSuggestions:
+    """Kết quả tính sẵn đã nạp vào bộ nhớ: schedule_id -> record, kèm chỉ mục user_id -> schedule_ids."""
+
+    def __init__(self, records=None):
+        self.records = records or {}
+        self.schedule_ids_by_user = defaultdict(set)
+        for schedule_id, record in self.records.items():
+            self.schedule_ids_by_user[record["user_id"]].add(schedule_id)
+
+    def __len__(self):
+        return len(self.records)
+
+    def lookup(self, user_id, todo):
+        """Trả về danh sách gợi ý tính sẵn nếu to-do trùng với lịch trình đã lưu, ngược lại None."""
+        record = self.records.get(todo.get("schedule_id"))
+        if record is None or record["user_id"] != user_id or record["todo"] != todo_key(todo):
+            return None
+        return record["suggestions"]
+
+    def invalidate_users(self, user_ids):
+        """Bỏ các gợi ý tính sẵn của những người dùng bị ảnh hưởng bởi một thay đổi dữ liệu."""
+        for user_id in user_ids:
+            for schedule_id in self.schedule_ids_by_user.pop(user_id, ()):
+                self.records.pop(schedule_id, None)
+
+
+def load_precomputed(path, store):
+    """
+    Đọc file kết quả tính sẵn thành PrecomputedSuggestions.
+    Trả về đối tượng rỗng nếu file không tồn tại hoặc data_version không còn khớp với store.
+    """
+    if not os.path.exists(path):
+        return PrecomputedSuggestions()
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except json.JSONDecodeError:
+            print(f"⚠️ Bỏ qua '{path}': header không hợp lệ.")
+            return PrecomputedSuggestions()
+        if header.get("format") != FORMAT_VERSION or header.get("data_version") != store.data_version:
+            print(f"⚠️ Bỏ qua '{path}': data_version không khớp với dữ liệu hiện tại.")
+            return PrecomputedSuggestions()
+        records = {}
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # Dòng cuối bị ghi dở khi job bị ngắt
+            records[record["schedule_id"]] = record
+    print(f"-> Đã nạp {len(records)} gợi ý tính sẵn từ '{path}'.")
+    return PrecomputedSuggestions(records)
+
+
+# --- 2. WORKER ---
+
+def _init_worker():
+    global _store, _content_gen
+    if _store is None:
+        _store = load_data()
+    if _content_gen is None:
+        _content_gen = ContentGenerator()
+
+
+def _process_chunk(schedule_ids):
+    """Tính gợi ý cho một chunk lịch trình. Trả về (pid, records, thời gian xử lý)."""
+    started = time.perf_counter()
+    records = []
+    contexts = {}
+    for schedule_id in schedule_ids:
+        todo = _store.get_schedule(schedule_id)
+        user_id = todo["user_id"]
+        user_profile = _store.get_user(user_id)
+        suggestions = None
+        if user_profile:
+            # Lịch trình được chia chunk theo người dùng nên MatchContext thường được dùng lại
+            if user_id not in contexts:
+                contexts[user_id] = build_match_context(user_profile, _store)
+            suggestions, _ = build_suggestions(user_profile, todo, _store, _content_gen, context=contexts[user_id])
+        records.append({
+            "schedule_id": schedule_id,
+            "user_id": user_id,
+            "todo": todo_key(todo),
+            "suggestions": suggestions,
+        })
+    return os.getpid(), records, time.perf_counter() - started
+
+
+# --- 3. CHECKPOINT ---
+
+def _read_checkpoint(path, data_version):
+    """
+    Đọc các schedule_id đã xử lý trong file hiện có. Dòng cuối bị ghi dở sẽ bị cắt bỏ.
+    Trả về None nếu file chưa có hoặc thuộc về data_version khác (cần chạy lại từ đầu).
+    """
+    if not os.path.exists(path):
+        return None
+    done = set()
+    good_offset = 0
+    with open(path, "rb") as f:
+        header_line = f.readline()
+        try:
+            header = json.loads(header_line)
+        except json.JSONDecodeError:
+            return None
+        if header.get("format") != FORMAT_VERSION or header.get("data_version") != data_version:
+            return None
+        good_offset = f.tell()
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["schedule_id"])
+            except (json.JSONDecodeError, KeyError):
+                break
+            good_offset += len(line)
+    with open(path, "r+b") as f:
+        f.truncate(good_offset)
+    return done
+
+
+# --- 4. CHƯƠNG TRÌNH CHÍNH ---
+
+def run(output=DEFAULT_OUTPUT, workers=None, chunk_size=64, fresh=False):
+    global _store, _content_gen
+    _store = load_data()
+    _content_gen = ContentGenerator()
+    data_version = _store.data_version
+
+    done = None if fresh else _read_checkpoint(output, data_version)
+    if done is None:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"data_version": data_version, "format": FORMAT_VERSION}) + "\n")
+        done = set()
+    elif done:
+        print(f"-> Tiếp tục từ checkpoint: đã có {len(done)} lịch trình.")
+
+    # Sắp xếp theo người dùng để các lịch trình cùng người dùng rơi vào cùng chunk
+    pending = [
+        s["schedule_id"]
+        for s in sorted(_store.schedules, key=lambda s: s["user_id"])
+        if s["schedule_id"] not in done
+    ]
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    total = len(_store.schedules)
+    print(f"-> Cần xử lý {len(pending)}/{total} lịch trình trong {len(chunks)} chunk với {workers or os.cpu_count()} worker.")
+
+    worker_stats = defaultdict(lambda: {"chunks": 0, "schedules": 0, "busy_s": 0.0})
+    processed = 0
+    started = last_report = time.perf_counter()
+    with open(output, "a", encoding="utf-8") as f, multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        for pid, records, elapsed in pool.imap_unordered(_process_chunk, chunks):
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+
+            stats = worker_stats[pid]
+            stats["chunks"] += 1
+            stats["schedules"] += len(records)
+            stats["busy_s"] += elapsed
+            processed += len(records)
+
+            now = time.perf_counter()
+            if now - last_report < 1.0 and processed < len(pending):
+                continue
+            last_report = now
+            rate = processed / (now - started)
+            eta = (len(pending) - processed) / rate if rate > 0 else 0.0
+            print(f"\r   {len(done) + processed}/{total} lịch trình | {rate:.1f} lịch trình/s | ETA {eta:.0f}s", end="", flush=True)
+
+    wall = time.perf_counter() - started
+    print(f"\n-> Hoàn thành {processed} lịch trình trong {wall:.1f}s.")
+    for pid, stats in sorted(worker_stats.items()):
+        throughput = stats["schedules"] / stats["busy_s"] if stats["busy_s"] > 0 else 0.0
+        print(f"   worker {pid}: {stats['chunks']} chunk, {stats['schedules']} lịch trình, "
+              f"bận {stats['busy_s']:.1f}s, {throughput:.1f} lịch trình/s")
+    return worker_stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tính sẵn gợi ý cho mọi lịch trình.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="File JSON Lines đầu ra (mặc định: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình worker (mặc định: số CPU)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Số lịch trình mỗi chunk (mặc định: %(default)s)")
+    parser.add_argument("--fresh", action="store_true", help="Bỏ qua checkpoint và tính lại từ đầu")
+    args = parser.parse_args()
+
+    print("Bắt đầu tính sẵn gợi ý cho toàn bộ lịch trình...")
+    run(output=args.output, workers=args.workers, chunk_size=args.chunk_size, fresh=args.fresh)
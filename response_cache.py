@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Một response đã được serialize: body (bytes) và ETag (không kèm dấu nháy) tính từ nội dung
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "expires_at"])
+
+
+class ResponseCache:
+    """
+    Cache LRU + TTL cho body của response, giới hạn theo tổng số byte.
+    Khoá do nơi gọi quyết định (vd. (user_id, hash to-do, store.revision) cho /suggest):
+    khi revision tăng, các entry cũ không còn được tra tới và tự bị đẩy ra theo LRU / TTL.
+    An toàn khi dùng từ nhiều thread.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_s=300.0):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body):
+        """Lưu body (bytes) và trả về CachedResponse kèm ETag. Body lớn hơn cả cache thì không lưu."""
+        entry = CachedResponse(body, hashlib.sha1(body).hexdigest(), time.monotonic() + self.ttl_s)
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def _drop(self, key):
+        self._bytes -= len(self._entries.pop(key).body)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,57 +1,54 @@
+import argparse
+import gc
 import json
+import multiprocessing
+import os
+import sys
+import time
 from datetime import datetime
-from geopy.distance import geodesic
+
+import numpy as np
 
 # Import các hàm từ file engine của chúng ta
 from activity_model_engine import (
     load_data,
+    build_match_context,
     generate_quest_candidates,
-    score_quest
+    rank_with_state,
+    rerank_without_matches,
+    best_overlap_with_schedules
 )
+from data_store import to_epoch
 # Import module tạo nội dung mới
 from content_generator import ContentGenerator
 
-def find_optimal_scenario(users, schedules, pois, min_match_score=0.85, max_distance_km=1.5):
-    """Tự động tìm kiếm trong bộ dữ liệu để tìm một kịch bản tối ưu."""
-    for user_A in users:
-        schedules_A = [s for s in schedules if s["user_id"] == user_A["user_id"]]
-        if not schedules_A: continue
-        for todo_A in schedules_A:
-            if not user_A["match_list"]: continue
-            top_match = max(user_A["match_list"], key=lambda x: x["score"], default=None)
-            if top_match and top_match["score"] >= min_match_score:
-                match_B_id = top_match["match_id"]
-                schedules_B = [s for s in schedules if s["user_id"] == match_B_id]
-                if not schedules_B: continue
-                for schedule_B in schedules_B:
-                    dist = geodesic((todo_A["location"]["latitude"], todo_A["location"]["longitude"]), (schedule_B["location"]["latitude"], schedule_B["location"]["longitude"])).kilometers
-                    if dist <= max_distance_km:
-                        time_diff = abs(datetime.fromisoformat(todo_A["start_time"]) - datetime.fromisoformat(schedule_B["start_time"]))
-                        if time_diff.total_seconds() / 3600 <= 2:
-                            return user_A, todo_A, top_match, schedule_B
-    return None, None, None, None
-
-def find_target_match_for_quest(quest, user_A, all_schedules, all_users):
+def find_optimal_scenario(store, min_match_score=0.85, max_distance_km=1.5):
+    """
+    Tự động tìm kiếm trong bộ dữ liệu để tìm một kịch bản tối ưu.
+    Trả lời từ chỉ mục cặp gặp gỡ (store.match_index): lấy cặp có match_score × proximity cao nhất.
+    """
+    scenarios, _ = store.match_index.query(min_match_score=min_match_score, max_distance_km=max_distance_km, page_size=1)
+    if not scenarios:
+        return None, None, None, None
+    best = scenarios[0]
+    return best["user_A"], best["todo_A"], best["match_B"], best["schedule_B"]
+
+def find_target_match_for_quest(quest, user_A, store):
     """
     Phân tích một quest để tìm ra cặp đôi mục tiêu chính (người đóng góp nhiều nhất vào điểm bias).
     """
     best_match_id = None
     max_contribution = 0
+    quest_start, quest_end = to_epoch(quest["start_time"]), to_epoch(quest["end_time"])
     
     for match in user_A["match_list"]:
         match_id = match["match_id"]
         match_score = match["score"]
-        match_schedules_today = [s for s in all_schedules if s["user_id"] == match_id]
-        if match_schedules_today:
-            best_overlap = 0
-            for schedule in match_schedules_today:
-                # Tính lại overlap
-                from activity_model_engine import calculate_time_overlap, calculate_location_score
-                time_o = calculate_time_overlap(quest["start_time"], quest["end_time"], schedule["start_time"], schedule["end_time"])
-                loc_o = calculate_location_score(quest["location"], schedule["location"])
-                overlap = 0.5 * time_o + 0.5 * loc_o
-                if overlap > best_overlap:
-                    best_overlap = overlap
+        arrays = store.schedule_arrays_of(match_id)
+        if arrays.starts.size:
+            best_overlap = best_overlap_with_schedules(
+                quest_start, quest_end, quest["location"], arrays, store.schedule_intervals_of(match_id)
+            )
             
             contribution = match_score * best_overlap
             if contribution > max_contribution:
@@ -60,24 +57,292 @@ def find_target_match_for_quest(quest, user_A, all_schedules, all_users):
                 
     return {"match_id": best_match_id} if best_match_id else None
 
+# --- MÔ PHỎNG TOÀN THÀNH PHỐ ---
+# Chạy tạo ứng viên + chấm điểm + fallback cho mọi người dùng và mọi to-do bằng process pool.
+# Dữ liệu được tải một lần trong tiến trình cha và dùng chung (copy-on-write khi fork, hoặc các trang
+# memory map của snapshot dạng cột với COLUMNAR_SNAPSHOT); mỗi chunk chỉ là một khoảng chỉ số người dùng
+# và worker trả về thống kê gộp của chunk, nên chi phí truyền giữa các tiến trình không đáng kể.
+#
+#     python run_scenarios.py simulate --workers 8 --chunk-size 256 [--limit 100000] [--output sim.json]
+
+SIMULATION_STAGES = ("match_context", "candidates", "scoring", "fallback")
+# Đơn vị thông lượng của từng giai đoạn
+SIMULATION_STAGE_UNITS = {"match_context": "users", "candidates": "todos", "scoring": "candidates", "fallback": "todos"}
+# bias_match là tổng đóng góp của mọi match nên có thể vượt 1; giá trị ≥ cạnh cuối rơi vào bin cuối
+BIAS_BIN_EDGES = np.append(np.linspace(0.0, 5.0, 51), np.inf)
+
+# Dữ liệu dùng chung trong mỗi worker (kế thừa từ tiến trình cha khi fork, hoặc tải lại khi spawn)
+_sim_store = None
+
+
+class SimulationStats:
+    """Thống kê gộp của một lần mô phỏng; các worker trả về SimulationStats của chunk để tiến trình cha cộng dồn."""
+
+    COUNTERS = (
+        "users", "users_without_todos", "todos", "todos_without_candidates", "candidates", "zero_bias_candidates",
+        "buffer_candidates", "top_buffer", "fallback_applicable", "fallback_changed", "fallback_to_base",
+    )
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.bias_hist = np.zeros(BIAS_BIN_EDGES.size - 1, dtype=np.int64)
+        self.top_bias_hist = np.zeros(BIAS_BIN_EDGES.size - 1, dtype=np.int64)
+        self.bias_sum = 0.0
+        self.top_bias_sum = 0.0
+        self.stage_seconds = dict.fromkeys(SIMULATION_STAGES, 0.0)
+        self.stage_items = dict.fromkeys(SIMULATION_STAGES, 0)
+
+    def merge(self, other):
+        for name in self.COUNTERS:
+            self.counts[name] += other.counts[name]
+        self.bias_hist += other.bias_hist
+        self.top_bias_hist += other.top_bias_hist
+        self.bias_sum += other.bias_sum
+        self.top_bias_sum += other.top_bias_sum
+        for stage in SIMULATION_STAGES:
+            self.stage_seconds[stage] += other.stage_seconds[stage]
+            self.stage_items[stage] += other.stage_items[stage]
+
+    def add_bias(self, values, top_bias):
+        values = np.asarray(values, dtype=np.float64)
+        self.bias_hist += np.histogram(values, BIAS_BIN_EDGES)[0]
+        self.bias_sum += float(values.sum())
+        self.counts["zero_bias_candidates"] += int(np.count_nonzero(values == 0))
+        self.top_bias_hist[np.searchsorted(BIAS_BIN_EDGES, top_bias, side="right") - 1] += 1
+        self.top_bias_sum += top_bias
+
+    @staticmethod
+    def _quantiles(hist, qs=(0.5, 0.9, 0.99)):
+        """Phân vị xấp xỉ (cạnh trên của bin chứa phân vị, inf nếu rơi vào bin cuối) từ histogram."""
+        total = hist.sum()
+        if total == 0:
+            return {q: None for q in qs}
+        cumulative = np.cumsum(hist)
+        upper = BIAS_BIN_EDGES[1:]
+        return {q: float(upper[np.searchsorted(cumulative, q * total)]) for q in qs}
+
+    def summary(self, wall_s=None):
+        c = self.counts
+        todos_ranked = c["todos"] - c["todos_without_candidates"]
+        result = {
+            "counts": dict(c),
+            "bias_match": {
+                "mean": self.bias_sum / c["candidates"] if c["candidates"] else None,
+                "quantiles": self._quantiles(self.bias_hist),
+                "zero_share": c["zero_bias_candidates"] / c["candidates"] if c["candidates"] else None,
+                "histogram": {"edges": BIAS_BIN_EDGES[:-1].tolist(), "counts": self.bias_hist.tolist()},
+            },
+            "top_bias_match": {
+                "mean": self.top_bias_sum / todos_ranked if todos_ranked else None,
+                "quantiles": self._quantiles(self.top_bias_hist),
+                "histogram": {"edges": BIAS_BIN_EDGES[:-1].tolist(), "counts": self.top_bias_hist.tolist()},
+            },
+            "buffer_share": c["buffer_candidates"] / c["candidates"] if c["candidates"] else None,
+            "top_buffer_share": c["top_buffer"] / todos_ranked if todos_ranked else None,
+            "fallback": {
+                "applicable": c["fallback_applicable"],
+                "changed_top_share": c["fallback_changed"] / c["fallback_applicable"] if c["fallback_applicable"] else None,
+                "to_base_share": c["fallback_to_base"] / c["fallback_applicable"] if c["fallback_applicable"] else None,
+            },
+            "stages": {
+                stage: {
+                    "busy_s": self.stage_seconds[stage],
+                    "items": self.stage_items[stage],
+                    "unit": SIMULATION_STAGE_UNITS[stage],
+                    "per_worker_s": self.stage_items[stage] / self.stage_seconds[stage] if self.stage_seconds[stage] > 0 else None,
+                }
+                for stage in SIMULATION_STAGES
+            },
+        }
+        if wall_s is not None:
+            result["wall_s"] = wall_s
+            result["todos_per_s"] = c["todos"] / wall_s if wall_s > 0 else None
+        return result
+
+
+def simulate_user(user, store, stats, poi_cache=None):
+    """
+    Mô phỏng mọi to-do của một người dùng: tạo ứng viên, chấm điểm toàn bộ (để có phân phối
+    bias_match của mọi ứng viên), rồi giả lập cặp đôi mục tiêu của gợi ý top-1 rút lui và xếp hạng lại.
+    """
+    stats.counts["users"] += 1
+    todos = store.schedules_of(user["user_id"])
+    if not todos:
+        stats.counts["users_without_todos"] += 1
+        return
+    started = time.perf_counter()
+    context = build_match_context(user, store)
+    stats.stage_seconds["match_context"] += time.perf_counter() - started
+    stats.stage_items["match_context"] += 1
+
+    for todo in todos:
+        stats.counts["todos"] += 1
+        started = time.perf_counter()
+        candidates = generate_quest_candidates(todo, user, store, context=context, poi_cache=poi_cache)
+        scored_at = time.perf_counter()
+        stats.stage_seconds["candidates"] += scored_at - started
+        stats.stage_items["candidates"] += 1
+        if not candidates:
+            stats.counts["todos_without_candidates"] += 1
+            continue
+
+        ranked, state = rank_with_state(todo, user, store, context=context, poi_cache=poi_cache, candidates=candidates)
+        stats.stage_seconds["scoring"] += time.perf_counter() - scored_at
+        stats.stage_items["scoring"] += len(candidates)
+
+        top = ranked[0]
+        stats.counts["candidates"] += len(candidates)
+        stats.counts["buffer_candidates"] += sum(1 for c in candidates if c.get("type") == "buffer_activity")
+        stats.counts["top_buffer"] += top.get("type") == "buffer_activity"
+        stats.add_bias([c["scores_breakdown"]["bias_match"] for c in candidates], top["scores_breakdown"]["bias_match"])
+
+        # Fallback: cặp đôi mục tiêu của gợi ý top-1 không thể tham gia
+        if top["associatedMatch"] is None:
+            continue
+        started = time.perf_counter()
+        fallback, _ = rerank_without_matches(state, [top["associatedMatch"]["match_id"]], todo, store, poi_cache)
+        stats.stage_seconds["fallback"] += time.perf_counter() - started
+        stats.stage_items["fallback"] += 1
+        stats.counts["fallback_applicable"] += 1
+        if fallback and fallback[0]["candidate_id"] != top["candidate_id"]:
+            stats.counts["fallback_changed"] += 1
+        if fallback and fallback[0]["candidate_id"] == "CANDIDATE_BASE":
+            stats.counts["fallback_to_base"] += 1
+
+
+def _init_simulation_worker(data_dir):
+    global _sim_store
+    if _sim_store is None:
+        _sim_store = load_data(data_dir)
+
+
+def _simulate_chunk(bounds):
+    """Mô phỏng người dùng có chỉ số trong [lo, hi). Trả về (số người dùng, SimulationStats của chunk)."""
+    lo, hi = bounds
+    stats = SimulationStats()
+    # poi_cache chỉ sống trong một chunk để bộ nhớ của worker không tăng theo toàn bộ dữ liệu
+    poi_cache = {}
+    for i in range(lo, hi):
+        simulate_user(_sim_store.users[i], _sim_store, stats, poi_cache)
+    return hi - lo, stats
+
+
+def simulate(data_dir=None, workers=None, chunk_size=256, limit=None, output=None):
+    global _sim_store
+    started = time.perf_counter()
+    _sim_store = load_data(data_dir)
+    n_users = len(_sim_store.users) if limit is None else min(limit, len(_sim_store.users))
+    print(f"-> Đã tải dữ liệu trong {time.perf_counter() - started:.1f}s; mô phỏng {n_users} người dùng.")
+
+    chunks = [(lo, min(lo + chunk_size, n_users)) for lo in range(0, n_users, chunk_size)]
+    workers = workers or os.cpu_count()
+    print(f"-> {len(chunks)} chunk × {chunk_size} người dùng với {workers} worker.")
+
+    # Như wsgi.py: đóng băng các object đã tải để GC của worker không làm bẩn các trang dùng chung
+    gc.collect()
+    gc.freeze()
+    stats = SimulationStats()
+    processed = 0
+    started = last_report = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=_init_simulation_worker, initargs=(data_dir,)) as pool:
+        for n, chunk_stats in pool.imap_unordered(_simulate_chunk, chunks):
+            stats.merge(chunk_stats)
+            processed += n
+            now = time.perf_counter()
+            if now - last_report < 1.0 and processed < n_users:
+                continue
+            last_report = now
+            rate = processed / (now - started)
+            eta = (n_users - processed) / rate if rate > 0 else 0.0
+            print(f"\r   {processed}/{n_users} người dùng | {stats.counts['todos']} to-do | "
+                  f"{rate:.0f} người dùng/s | ETA {eta:.0f}s", end="", flush=True)
+    wall = time.perf_counter() - started
+    gc.unfreeze()
+
+    summary = stats.summary(wall)
+    print(f"\n-> Hoàn thành {stats.counts['todos']} to-do của {processed} người dùng trong {wall:.1f}s "
+          f"({summary['todos_per_s'] or 0:.0f} to-do/s).")
+    _print_simulation_summary(summary)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"-> Đã ghi thống kê vào {output}")
+    return summary
+
+
+def _print_simulation_summary(summary):
+    def pct(value):
+        return "-" if value is None else f"{value * 100:.1f}%"
+
+    def num(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    c = summary["counts"]
+    print(f"\n--- Ứng viên ---")
+    print(f"   {c['candidates']} ứng viên cho {c['todos']} to-do ({c['todos_without_candidates']} to-do không có ứng viên, "
+          f"{c['users_without_todos']} người dùng không có to-do)")
+    print(f"   Hoạt động đệm: {pct(summary['buffer_share'])} ứng viên, {pct(summary['top_buffer_share'])} gợi ý top-1")
+
+    for key, title in (("bias_match", "bias_match (mọi ứng viên)"), ("top_bias_match", "bias_match (gợi ý top-1)")):
+        bias = summary[key]
+        q = bias["quantiles"]
+        print(f"\n--- {title} ---")
+        print(f"   trung bình {num(bias['mean'])} | bằng 0: {pct(bias.get('zero_share'))} | p50 ≤ {num(q[0.5])} | p90 ≤ {num(q[0.9])} | p99 ≤ {num(q[0.99])}")
+        counts = np.array(bias["histogram"]["counts"])
+        edges = bias["histogram"]["edges"]
+        total = counts.sum()
+        # In gộp theo bin 0.5 cho gọn; chi tiết (bin 0.1) nằm trong file --output
+        for lo in range(0, len(counts), 5):
+            share = counts[lo:lo + 5].sum() / total if total else 0.0
+            if share > 0:
+                label = f"[{edges[lo]:.2f}, {edges[lo + 5]:.2f})" if lo + 5 < len(edges) else f"≥ {edges[lo]:.2f}"
+                print(f"   {label:>14} {share * 100:5.1f}% {'#' * int(round(share * 50))}")
+
+    fallback = summary["fallback"]
+    print(f"\n--- Fallback (cặp đôi mục tiêu của top-1 rút lui) ---")
+    print(f"   {fallback['applicable']} to-do có cặp đôi mục tiêu | đổi gợi ý top-1: {pct(fallback['changed_top_share'])} | "
+          f"quay về kế hoạch gốc: {pct(fallback['to_base_share'])}")
+
+    print(f"\n--- Thông lượng theo giai đoạn (trên mỗi giây-worker) ---")
+    for stage, info in summary["stages"].items():
+        rate = "-" if info["per_worker_s"] is None else f"{info['per_worker_s']:.0f}"
+        print(f"   {stage:<14} {info['items']:>10} {info['unit']:<10} bận {info['busy_s']:8.1f}s  {rate:>8} {info['unit']}/s")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy các kịch bản kiểm tra mô hình.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("demo", help="Kịch bản tối ưu và fallback cho một cặp đôi (mặc định)")
+    sim_parser = subparsers.add_parser("simulate", help="Mô phỏng toàn bộ người dùng bằng process pool")
+    sim_parser.add_argument("--data-dir", default=None, help="Thư mục dữ liệu JSON (mặc định: DATA_DIR hoặc thư mục hiện tại)")
+    sim_parser.add_argument("--workers", type=int, default=None, help="Số tiến trình worker (mặc định: số CPU)")
+    sim_parser.add_argument("--chunk-size", type=int, default=256, help="Số người dùng mỗi chunk (mặc định: %(default)s)")
+    sim_parser.add_argument("--limit", type=int, default=None, help="Chỉ mô phỏng N người dùng đầu tiên")
+    sim_parser.add_argument("--output", default=None, help="Ghi thống kê (JSON) vào file này")
+    args = parser.parse_args()
+
+    if args.command == "simulate":
+        print("Bắt đầu mô phỏng toàn thành phố...")
+        simulate(data_dir=args.data_dir, workers=args.workers, chunk_size=args.chunk_size, limit=args.limit, output=args.output)
+        sys.exit(0)
+
     print("Bắt đầu Giai đoạn 2 & 2.5 của Kế hoạch Gió Lốc: Kiểm tra và Tạo Nội dung...")
     
-    all_pois, all_users, all_schedules = load_data()
+    store = load_data()
     content_gen = ContentGenerator() # Khởi tạo Content Generator
     print("-> Đã tải thành công dữ liệu và khởi tạo Content Generator.")
 
     print("\n--- [Kịch bản 1: Tình huống Tối ưu] ---")
     print("Đang tìm kiếm một cặp đôi hoàn hảo trong bộ dữ liệu...")
 
-    user_A, todo_A, match_B, schedule_B = find_optimal_scenario(all_users, all_schedules, all_pois)
+    user_A, todo_A, match_B, schedule_B = find_optimal_scenario(store)
 
     if not user_A:
         print("Không tìm thấy kịch bản tối ưu trong lần chạy này.")
     else:
         # ... (Phần print thông tin kịch bản giữ nguyên) ...
-        poi_A_name = next((p["name"] for p in all_pois if p["poi_id"] == todo_A["poi_id"]), "Không rõ")
-        poi_B_name = next((p["name"] for p in all_pois if p["poi_id"] == schedule_B["poi_id"]), "Không rõ")
+        poi_A_name = (store.get_poi(todo_A["poi_id"]) or {}).get("name", "Không rõ")
+        poi_B_name = (store.get_poi(schedule_B["poi_id"]) or {}).get("name", "Không rõ")
         print("\n*** Đã tìm thấy kịch bản phù hợp! ***")
         print(f"Người dùng A: {user_A['user_id']}")
         print(f"  -> Kế hoạch: '{todo_A['description']}' lúc {datetime.fromisoformat(todo_A['start_time']).strftime('%H:%M')} tại '{poi_A_name}'")
@@ -85,26 +350,15 @@ if __name__ == "__main__":
         print(f"  -> Kế hoạch: '{schedule_B['description']}' lúc {datetime.fromisoformat(schedule_B['start_time']).strftime('%H:%M')} tại '{poi_B_name}'")
 
         print("\n-> Chạy mô hình gợi ý cho Người dùng A...")
-        candidates = generate_quest_candidates(todo_A, all_pois, user_A, all_schedules, all_users)
-        
-        scored_candidates = []
-        for cand in candidates:
-            final_score, breakdown = score_quest(cand, todo_A, user_A, all_schedules, all_users)
-            cand['final_score'] = final_score
-            cand['scores_breakdown'] = breakdown
-            scored_candidates.append(cand)
-            
-        sorted_candidates = sorted(scored_candidates, key=lambda x: x['final_score'], reverse=True)
+        # Giữ lại RankingState để kịch bản 2 xếp hạng lại nhanh khi match B rút lui
+        sorted_candidates, ranking_state = rank_with_state(todo_A, user_A, store)
 
         print("\n--- KẾT QUẢ GỢI Ý (ĐÃ CHUYỂN THÀNH NỘI DUNG) ---")
+        # Cặp đôi mục tiêu ('associatedMatch') đã được gắn khi chấm điểm
         top_suggestion = sorted_candidates[0]
-        
-        # Tìm cặp đôi mục tiêu để tạo hint tốt nhất
-        target_match = find_target_match_for_quest(top_suggestion, user_A, all_schedules, all_users)
-        top_suggestion['associatedMatch'] = target_match
 
         # Tạo nội dung
-        generated_content = content_gen.generate_quest_content(top_suggestion, all_pois, all_schedules, all_users)
+        generated_content = content_gen.generate_quest_content(top_suggestion, store)
 
         print("\n=======================================================")
         print(f"  Tiêu đề: {generated_content['title']}")
@@ -121,37 +375,24 @@ if __name__ == "__main__":
         print("\n\n--- [Kịch bản 2: Tình huống Dự phòng (Fallback)] ---")
         print(f"Giả lập tình huống Cặp đôi tiềm năng ({match_B['match_id']}) không thể tham gia...")
 
-        # 1. Giả lập bằng cách tạm thời loại bỏ lịch trình của match_B
-        schedules_without_match_B = [s for s in all_schedules if s["user_id"] != match_B['match_id']]
-
-        # 2. Chạy lại mô hình gợi ý cho An với dữ liệu mới
-        print("\n-> Chạy lại mô hình gợi ý cho Người dùng A...")
-        
-        candidates_fallback = generate_quest_candidates(todo_A, all_pois, user_A, schedules_without_match_B, all_users)
-        
-        scored_candidates_fallback = []
-        for cand in candidates_fallback:
-            final_score, breakdown = score_quest(cand, todo_A, user_A, schedules_without_match_B, all_users)
-            cand['final_score'] = final_score
-            cand['scores_breakdown'] = breakdown
-            scored_candidates_fallback.append(cand)
+        # 1. Xếp hạng lại từ kết quả kịch bản 1: bỏ đóng góp của match_B thay vì chạy lại toàn bộ
+        print("\n-> Xếp hạng lại gợi ý cho Người dùng A (delta)...")
+        started = time.perf_counter()
+        sorted_candidates_fallback, _ = rerank_without_matches(ranking_state, [match_B['match_id']], todo_A, store)
+        delta_s = time.perf_counter() - started
 
-        sorted_candidates_fallback = sorted(scored_candidates_fallback, key=lambda x: x['final_score'], reverse=True)
+        print(f"-> Đã xếp hạng lại trong {delta_s * 1000:.1f} ms (test_rerank.py kiểm tra khớp với chạy lại toàn bộ).")
+        store_without_match_B = store.without_users([match_B['match_id']])
 
         print("\n--- KẾT QUẢ GỢI Ý MỚI (SAU KHI FALLBACK, ĐÃ CHUYỂN THÀNH NỘI DUNG) ---")
         if sorted_candidates_fallback:
+            # Cặp đôi mục tiêu mới (nếu có) đã được gắn khi chấm điểm lại
             top_fallback_suggestion = sorted_candidates_fallback[0]
-            
-            # Tìm cặp đôi mục tiêu mới (nếu có)
-            new_target_match = find_target_match_for_quest(top_fallback_suggestion, user_A, schedules_without_match_B, all_users)
-            top_fallback_suggestion['associatedMatch'] = new_target_match
 
             # Tạo nội dung cập nhật, truyền vào is_update=True
             fallback_content = content_gen.generate_quest_content(
                 top_fallback_suggestion, 
-                all_pois, 
-                schedules_without_match_B, 
-                all_users, 
+                store_without_match_B,
                 is_update=True # <-- ĐÂY LÀ THAM SỐ QUAN TRỌNG
             )
 
@@ -0,0 +1,380 @@
+"""
+Chế độ engine phân mảnh theo địa lý: mỗi shard (xem shard_store.py) được một tiến trình worker riêng
+sở hữu, giữ dữ liệu riêng của shard cùng các cache theo người dùng (MatchContext, chỉ mục khoảng thời gian).
+Lớp API ở đây chỉ mở bản tóm tắt dùng chung (nhà của người dùng) và định tuyến từng (người dùng, to-do)
+tới shard sở hữu vị trí của to-do, hoặc shard nhà của người dùng nếu người dùng không thuộc dữ liệu riêng
+của shard đó (ShardMap.route), nên các shard chạy song song trên các lõi khác nhau.
+
+    python shard_store.py --out shards
+    SHARD_DIR=shards python shard_server.py
+    SHARD_DIR=shards gunicorn -c gunicorn.conf.py shard_server:app
+
+Endpoint: /suggest và /suggest/batch (cùng định dạng với api_server), /shards (thống kê từng shard), /metrics.
+Chế độ này chỉ đọc: thay đổi dữ liệu bằng cách cập nhật dữ liệu gốc rồi dựng lại shard.
+Shard không trả lời trong SHARD_TIMEOUT_S giây (mặc định 30) được coi là không phản hồi (503).
+"""
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing.connection import AuthenticationError, Client, Listener, answer_challenge, deliver_challenge
+
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+
+import metrics
+from content_generator import ContentGenerator
+from memory_stats import process_memory
+from response_cache import ResponseCache
+from shard_store import ShardMap, home_location, load_shard, load_summary, read_manifest
+from suggestion_pipeline import build_suggestions, todo_fingerprint
+
+log = metrics.get_logger("shard_server")
+
+# Thời gian chờ tối đa câu trả lời của một tiến trình shard (giây); quá hạn thì coi như shard không phản hồi (503)
+SHARD_TIMEOUT_S = float(os.getenv("SHARD_TIMEOUT_S", "30"))
+
+
+# --- 1. TIẾN TRÌNH SHARD ---
+
+def _suggest_items(store, content_gen, items):
+    """
+    Chạy lõi mô hình cho các item (index, user_id, todo) của shard. Trả về [(index, status, body)],
+    body là danh sách gợi ý hoặc thông báo lỗi. Các item cùng người dùng dùng chung MatchContext
+    (được ghi nhớ trong store.match_context_cache giữa các yêu cầu).
+    """
+    results = []
+    poi_cache = {}
+    for index, user_id, todo in items:
+        if not store.is_local(user_id):
+            # Lớp định tuyến chỉ gửi người dùng thuộc dữ liệu riêng của shard
+            results.append((index, 421, f"Người dùng {user_id} không thuộc shard {store.name}"))
+            continue
+        user_profile = store.get_user(user_id)
+        try:
+            suggestions, _ = build_suggestions(user_profile, todo, store, content_gen, poi_cache=poi_cache)
+        except Exception as e:
+            log.exception("shard %s: lỗi trong quá trình xử lý của mô hình cho %s: %s", store.name, user_id, e)
+            results.append((index, 500, str(e)))
+            continue
+        results.append((index, 200, suggestions))
+    return results
+
+
+def _shard_stats(store):
+    return {
+        "users": len(store.users),
+        "schedules": len(store.schedules),
+        "remote_users": len(store.remote_ids),
+        "match_contexts": len(store.match_context_cache),
+        "memory": process_memory(),
+    }
+
+
+def _serve_connection(conn, store, content_gen, compute_lock):
+    """Trả lời các yêu cầu trên một kết nối cho tới khi phía gọi đóng (hoặc chết)."""
+    with conn:
+        while True:
+            try:
+                kind, payload = conn.recv()
+            except (EOFError, OSError):
+                return
+            # Tính toán tuần tự trong tiến trình shard (các cache theo người dùng không an toàn luồng);
+            # khoá chỉ nằm trong tiến trình này nên phía gọi bị kill không thể giữ nó
+            with compute_lock:
+                if kind == "suggest":
+                    result = _suggest_items(store, content_gen, payload)
+                else:
+                    result = _shard_stats(store)
+            try:
+                conn.send(result)
+            except OSError:
+                return
+
+
+def _shard_main(shard_dir, name, address, authkey, ready_conn):
+    store = load_shard(shard_dir, name)
+    content_gen = ContentGenerator()
+    compute_lock = threading.Lock()
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    ready_conn.send(_shard_stats(store))
+    ready_conn.close()
+    while True:
+        try:
+            conn = listener.accept()
+        except (EOFError, OSError, AuthenticationError) as e:
+            # EOFError: phía gọi đã bỏ kết nối giữa bước bắt tay (vd. quá SHARD_TIMEOUT_S)
+            log.warning("shard %s: bỏ qua kết nối lỗi: %s", name, e)
+            continue
+        threading.Thread(target=_serve_connection, args=(conn, store, content_gen, compute_lock),
+                         name=f"shard-{name}-conn", daemon=True).start()
+
+
+class ShardUnavailable(Exception):
+    """Không gửi / nhận được yêu cầu tới tiến trình shard."""
+
+
+class _Deadline:
+    """Bọc một Connection để mỗi lần recv_bytes chờ tối đa timeout_s (dùng cho bước bắt tay xác thực)."""
+
+    def __init__(self, conn, timeout_s):
+        self._conn = conn
+        self._timeout_s = timeout_s
+
+    def send_bytes(self, buf):
+        self._conn.send_bytes(buf)
+
+    def recv_bytes(self, maxlength=None):
+        if not self._conn.poll(self._timeout_s):
+            raise TimeoutError(f"không có câu trả lời sau {self._timeout_s:g}s")
+        return self._conn.recv_bytes(maxlength)
+
+
+class ShardWorker:
+    """
+    Tiến trình sở hữu một shard, lắng nghe trên một Unix socket. Mỗi luồng của mỗi tiến trình gọi
+    (worker gunicorn, luồng fan-out) có kết nối riêng, tạo lười ở lần call() đầu tiên: không có pipe
+    hay khoá dùng chung giữa các tiến trình gọi, nên một worker bị kill giữa chừng chỉ làm đứt kết nối
+    của chính nó.
+    """
+
+    def __init__(self, shard_dir, name, socket_dir):
+        self.name = name
+        self.address = os.path.join(socket_dir, f"{name}.sock")
+        self._authkey = os.urandom(16)
+        self._ready, child_conn = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=_shard_main,
+                                               args=(shard_dir, name, self.address, self._authkey, child_conn),
+                                               name=f"shard-{name}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self._local = threading.local()
+        self.info = None
+
+    def wait_ready(self):
+        self.info = self._ready.recv()
+        self._ready.close()
+        return self.info
+
+    def _connection(self, timeout_s):
+        # Kết nối được khoá theo pid: sau fork, tiến trình con không dùng lại kết nối của tiến trình cha
+        pid, conn = getattr(self._local, "conn", (None, None))
+        if pid != os.getpid():
+            # Như Client(..., authkey=...) nhưng bước bắt tay cũng có thời hạn: tiến trình shard bị treo
+            # hoàn toàn không trả lời challenge
+            conn = Client(self.address, family="AF_UNIX")
+            try:
+                answer_challenge(_Deadline(conn, timeout_s), self._authkey)
+                deliver_challenge(_Deadline(conn, timeout_s), self._authkey)
+            except BaseException:
+                conn.close()
+                raise
+            self._local.conn = (os.getpid(), conn)
+        return conn
+
+    def call(self, kind, payload=None, timeout_s=None):
+        """
+        Gửi yêu cầu qua kết nối của luồng hiện tại và chờ tối đa timeout_s giây (mặc định SHARD_TIMEOUT_S).
+        Kết nối lỗi hoặc quá hạn bị bỏ để lần sau tạo lại: câu trả lời đến muộn không bị đọc nhầm
+        thành câu trả lời của yêu cầu sau.
+        """
+        timeout_s = SHARD_TIMEOUT_S if timeout_s is None else timeout_s
+        try:
+            conn = self._connection(timeout_s)
+            conn.send((kind, payload))
+            if not conn.poll(timeout_s):
+                raise TimeoutError(f"không có câu trả lời sau {timeout_s:g}s")
+            return conn.recv()
+        except (EOFError, OSError, AuthenticationError) as e:
+            _, conn = getattr(self._local, "conn", (None, None))
+            self._local.conn = (None, None)
+            if conn is not None:
+                conn.close()
+            raise ShardUnavailable(f"Shard {self.name} không phản hồi: {e}") from e
+
+
+def start_shards(shard_dir):
+    """Khởi động một tiến trình cho mỗi shard (song song) và chờ tất cả tải xong dữ liệu."""
+    manifest = read_manifest(shard_dir)
+    shard_map = ShardMap(manifest["bounds"], halo_km=manifest["halo_km"])
+    socket_dir = tempfile.mkdtemp(prefix="shards-")
+    workers = {name: ShardWorker(shard_dir, name, socket_dir) for name in shard_map.names}
+    for worker in workers.values():
+        info = worker.wait_ready()
+        log.info("shard %s: %d người dùng, %d lịch trình", worker.name, info["users"], info["schedules"],
+                 extra=metrics.UNSAMPLED)
+    return manifest, shard_map, workers
+
+
+# --- 2. LỚP ĐỊNH TUYẾN ---
+
+app = Flask(__name__)
+
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+manifest, shard_map, shards = start_shards(SHARD_DIR)
+summary = load_summary(SHARD_DIR, manifest)
+SHARD_ITEMS = {name: metrics.SHARD_ITEMS.labels(name) for name in shard_map.names}
+
+# Cache response của /suggest ở lớp định tuyến; dữ liệu của shard không đổi nên khoá theo data_version
+suggest_cache = ResponseCache(
+    max_bytes=int(float(os.getenv("SUGGEST_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    ttl_s=float(os.getenv("SUGGEST_CACHE_TTL_S", "300")),
+)
+metrics.REGISTRY.register_cache("suggest_response", suggest_cache.stats)
+# Gửi song song tới các shard của một lô
+_fanout = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard-fanout")
+
+
+@app.before_request
+def _start_instrumentation():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def _finish_instrumentation(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - g.started)
+    metrics.REQUESTS.labels(endpoint, str(response.status_code)).inc()
+    return response
+
+
+def _route(user_id, todo):
+    """
+    Shard trả lời (user_id, todo) theo ShardMap.route, None nếu không có người dùng
+    (KeyError / TypeError / ValueError nếu user_id không phải chuỗi hoặc to-do không có toạ độ hợp lệ).
+    """
+    if not isinstance(user_id, str):
+        raise TypeError(f"user_id phải là chuỗi, nhận được {type(user_id).__name__}")
+    location = todo["location"]
+    lat, lon = float(location["latitude"]), float(location["longitude"])
+    home = home_location(summary, user_id)
+    return shard_map.route(lat, lon, *home) if home is not None else None
+
+
+def _cached_response(entry):
+    if request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, mimetype="application/json")
+    response.set_etag(entry.etag)
+    return response
+
+
+@app.route('/suggest', methods=['POST'])
+def suggest_activity():
+    """Như /suggest của api_server, nhưng được trả lời bởi shard do _route chọn."""
+    try:
+        input_data = request.get_json()
+        user_id = input_data['user_id']
+        original_todo = input_data['todo']
+        shard = _route(user_id, original_todo)
+    except (TypeError, KeyError, ValueError) as e:
+        log.info("/suggest: dữ liệu đầu vào không hợp lệ - %s", e)
+        return jsonify({"error": "Dữ liệu đầu vào không hợp lệ. Cần có 'user_id' và 'todo' (kèm 'location')."}), 400
+    if shard is None:
+        return jsonify({"error": f"Không tìm thấy người dùng với ID: {user_id}"}), 404
+
+    cache_key = (user_id, todo_fingerprint(original_todo), manifest["data_version"])
+    entry = suggest_cache.get(cache_key)
+    if entry is not None:
+        metrics.SUGGESTION_SOURCE.labels("cache").inc()
+        return _cached_response(entry)
+
+    SHARD_ITEMS[shard].inc()
+    try:
+        [(_, status, body)] = shards[shard].call("suggest", [(0, user_id, original_todo)])
+    except ShardUnavailable as e:
+        log.error("/suggest %s: %s", user_id, e)
+        return jsonify({"error": str(e)}), 503
+    if status != 200:
+        return jsonify({"error": body}), status
+    metrics.SUGGESTION_SOURCE.labels("model").inc()
+    entry = suggest_cache.put(cache_key, jsonify(body).get_data())
+    return _cached_response(entry)
+
+
+@app.route('/suggest/batch', methods=['POST'])
+def suggest_batch():
+    """
+    Như /suggest/batch của api_server: các item được chia theo shard, mỗi shard nhận một lô và các shard
+    chạy song song; kết quả (NDJSON, kèm "index") được stream theo thứ tự shard nào xong trước.
+    """
+    input_data = request.get_json(silent=True)
+    items = input_data.get("items") if isinstance(input_data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": "Dữ liệu đầu vào không hợp lệ. Cần có 'items' là danh sách các {user_id, todo}."}), 400
+
+    invalid, unknown = [], []
+    by_shard = defaultdict(list)
+    for index, item in enumerate(items):
+        try:
+            shard = _route(item['user_id'], item['todo'])
+        except (TypeError, KeyError, ValueError):
+            invalid.append(index)
+            continue
+        if shard is None:
+            unknown.append((index, item['user_id']))
+        else:
+            by_shard[shard].append((index, item['user_id'], item['todo']))
+    for name, shard_items in by_shard.items():
+        SHARD_ITEMS[name].inc(len(shard_items))
+    log.info("/suggest/batch với %d item trên %d shard", len(items), len(by_shard))
+
+    def _line(payload):
+        return json.dumps(payload, ensure_ascii=False) + "\n"
+
+    def generate():
+        for index in invalid:
+            yield _line({"index": index, "status": 400, "error": "Item không hợp lệ. Cần có 'user_id' và 'todo' (kèm 'location')."})
+        for index, user_id in unknown:
+            yield _line({"index": index, "status": 404, "error": f"Không tìm thấy người dùng với ID: {user_id}"})
+        futures = {_fanout.submit(shards[name].call, "suggest", shard_items): shard_items
+                   for name, shard_items in by_shard.items()}
+        for future in as_completed(futures):
+            user_of = {index: user_id for index, user_id, _ in futures[future]}
+            try:
+                results = future.result()
+            except ShardUnavailable as e:
+                log.error("/suggest/batch: %s", e)
+                results = [(index, 503, str(e)) for index in user_of]
+            for index, status, body in results:
+                if status == 200:
+                    yield _line({"index": index, "status": 200, "user_id": user_of[index], "suggestions": body})
+                else:
+                    yield _line({"index": index, "status": status, "error": body})
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def _stats_of(worker):
+    try:
+        return worker.call("stats")
+    except ShardUnavailable as e:
+        return {"error": str(e)}
+
+
+@app.route('/shards', methods=['GET'])
+def shard_report():
+    """Vùng, halo và thống kê (người dùng, lịch trình, MatchContext đã ghi nhớ, bộ nhớ) của từng shard."""
+    return jsonify({
+        "data_version": manifest["data_version"],
+        "halo_km": manifest["halo_km"],
+        "shards": {
+            name: {"bounds": shard_map.bounds[name], **_stats_of(worker)}
+            for name, worker in shards.items()
+        },
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_report():
+    """Số liệu của lớp định tuyến (yêu cầu, số item theo shard, cache) ở định dạng Prometheus."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+if __name__ == '__main__':
+    port = int(os.getenv("PORT", "5000"))
+    app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,264 @@
+"""
+Phân mảnh dữ liệu theo địa lý cho chế độ engine nhiều shard (xem shard_server.py).
+
+Mỗi shard là một vùng chữ nhật (mặc định các quận trong DISTRICT_BOUNDS). Thư mục <out> gồm:
+  - summary/: bản tóm tắt dùng chung (snapshot dạng cột, mở bằng memory map nên các tiến trình trên cùng
+    máy dùng chung page cache): toàn bộ POI, nhà và match_list (CSR) của mọi người dùng, KHÔNG có lịch trình.
+    Lớp định tuyến dùng nó để biết nhà của người dùng; shard dùng nó cho POI (ứng viên thay thế quanh nhà
+    người dùng và hoạt động đệm quanh lịch trình của match có thể nằm ngoài vùng của shard).
+  - <shard>/users.json, daily_schedules.json: dữ liệu riêng của shard ở dạng dict - những người dùng có nhà
+    nằm trong vùng mở rộng thêm halo_km (nhà ngoài mọi vùng thì thuộc vùng gần nhất), cùng toàn bộ lịch
+    trình của họ.
+  - <shard>/remote/: lịch trình (dạng cột) của các match ở ngoài vùng + halo của những người dùng trong
+    shard - phần duy nhất của các shard khác mà shard cần để chấm điểm bias_match.
+
+Yêu cầu của (người dùng, to-do) được trả lời bởi shard sở hữu vị trí to-do nếu người dùng thuộc dữ liệu
+riêng của shard đó (nhà trong vùng + halo), ngược lại bởi shard sở hữu nhà của người dùng (ShardMap.route).
+Nhờ vậy shard luôn có đủ dữ liệu và kết quả giống hệt DataStore đầy đủ; halo_km quyết định bao nhiêu
+to-do gần biên được trả lời ngay tại shard của to-do.
+
+Dựng dữ liệu các shard một lần (đọc qua load_data, nên COLUMNAR_SNAPSHOT / DATA_DIR vẫn dùng được):
+    python shard_store.py --out shards [--bounds districts.json] [--halo-km 1.0]
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from activity_model_engine import _read_records, load_data
+from columnar_store import export_columnar, load_columnar
+from data_store import DataStore
+from geo_distance import pairwise
+from generate_data import load_districts
+
+SHARD_MANIFEST = "shards.json"
+SUMMARY_DIR = "summary"
+REMOTE_DIR = "remote"
+FORMAT_VERSION = 2
+DEFAULT_HALO_KM = 1.0
+
+
+class ShardMap:
+    """Các vùng chữ nhật {tên: {lat_min, lat_max, lon_min, lon_max}} và độ rộng halo (km)."""
+
+    def __init__(self, bounds, halo_km=DEFAULT_HALO_KM):
+        self.bounds = {name: {k: b[k] for k in ("lat_min", "lat_max", "lon_min", "lon_max")} for name, b in bounds.items()}
+        if not self.bounds:
+            raise ValueError("Cần ít nhất một vùng để phân mảnh")
+        self.names = list(self.bounds)
+        self.halo_km = halo_km
+        self._limits = {k: np.array([b[k] for b in self.bounds.values()]) for k in ("lat_min", "lat_max", "lon_min", "lon_max")}
+
+    def distances(self, lats, lons):
+        """Ma trận (số vùng × n điểm): khoảng cách (km) từ mỗi điểm tới mỗi vùng, 0 nếu nằm trong vùng."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        out = np.empty((len(self.names), lats.size), dtype=np.float64)
+        lim = self._limits
+        for s in range(len(self.names)):
+            # Điểm gần nhất của hình chữ nhật là toạ độ bị kẹp vào biên
+            out[s] = pairwise(lats, lons, np.clip(lats, lim["lat_min"][s], lim["lat_max"][s]),
+                              np.clip(lons, lim["lon_min"][s], lim["lon_max"][s]))
+        return out
+
+    def owners(self, lats, lons):
+        """Chỉ số vùng sở hữu từng điểm: vùng chứa điểm, ngoài mọi vùng thì vùng gần nhất (hoà lấy vùng đầu)."""
+        return np.argmin(self.distances(lats, lons), axis=0)
+
+    def shard_of(self, lat, lon):
+        return self.names[int(self.owners([lat], [lon])[0])]
+
+    def members(self, lats, lons):
+        """
+        Ma trận bool (số vùng × n điểm): người dùng có nhà tại điểm thuộc dữ liệu riêng của vùng -
+        nhà cách vùng không quá halo_km, hoặc vùng sở hữu nhà.
+        """
+        distances = self.distances(lats, lons)
+        members = distances <= self.halo_km
+        members[np.argmin(distances, axis=0), np.arange(distances.shape[1])] = True
+        return members
+
+    def route(self, lat, lon, home_lat, home_lon):
+        """
+        Shard trả lời to-do tại (lat, lon) của người dùng có nhà tại (home_lat, home_lon): shard sở hữu
+        to-do nếu người dùng thuộc dữ liệu riêng của nó, ngược lại shard sở hữu nhà của người dùng.
+        """
+        owner = int(self.owners([lat], [lon])[0])
+        if self.members([home_lat], [home_lon])[owner, 0]:
+            return self.names[owner]
+        return self.shard_of(home_lat, home_lon)
+
+
+def partition(store, shard_map):
+    """Trả về {tên shard: tập user_id có dữ liệu riêng trong shard} (xem docstring của module)."""
+    local = {name: set() for name in shard_map.names}
+    users = store.users
+    if not users:
+        return local
+    members = shard_map.members([u["home_location"]["latitude"] for u in users],
+                                [u["home_location"]["longitude"] for u in users])
+    for s, name in enumerate(shard_map.names):
+        local[name].update(users[i]["user_id"] for i in np.flatnonzero(members[s]))
+    return local
+
+
+def remote_matches(users, local_ids):
+    """Các match (theo thứ tự gặp) của users không thuộc dữ liệu riêng local_ids của shard."""
+    remote = {}
+    for u in users:
+        for m in u["match_list"]:
+            if m["match_id"] not in local_ids:
+                remote.setdefault(m["match_id"], None)
+    return list(remote)
+
+
+def write_shards(store, out_dir, shard_map):
+    """
+    Ghi bản tóm tắt dùng chung, dữ liệu riêng và lịch trình của match ở xa của từng shard, rồi shards.json
+    (ghi sau cùng, nên thư mục bị ngắt giữa chừng sẽ không được mở). Trả về manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, SHARD_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    summary_meta = export_columnar(DataStore(store.pois, store.users, []), os.path.join(out_dir, SUMMARY_DIR))
+
+    shards = {}
+    for name, user_ids in partition(store, shard_map).items():
+        shard_dir = os.path.join(out_dir, name)
+        os.makedirs(shard_dir, exist_ok=True)
+        # Giữ thứ tự gốc để schedules_of của shard trùng với DataStore đầy đủ
+        users = [u for u in store.users if u["user_id"] in user_ids]
+        schedules = [s for s in store.schedules if s["user_id"] in user_ids]
+        for file_name, records in (("users.json", users), ("daily_schedules.json", schedules)):
+            with open(os.path.join(shard_dir, file_name), "w", encoding="utf-8") as f:
+                json.dump(records, f, ensure_ascii=False)
+        remote_ids = set(remote_matches(users, user_ids))
+        remote_schedules = [s for s in store.schedules if s["user_id"] in remote_ids]
+        remote_meta = export_columnar(DataStore([], [], remote_schedules), os.path.join(shard_dir, REMOTE_DIR))
+        shards[name] = {
+            "users": len(users),
+            "schedules": len(schedules),
+            "remote_users": len(remote_ids),
+            "remote_schedules": len(remote_schedules),
+            "remote_version": remote_meta["data_version"],
+        }
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "data_version": store.data_version,
+        "summary_version": summary_meta["data_version"],
+        "halo_km": shard_map.halo_km,
+        "bounds": shard_map.bounds,
+        "shards": shards,
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def read_manifest(out_dir):
+    with open(os.path.join(out_dir, SHARD_MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Thư mục shard '{out_dir}' có định dạng không hỗ trợ: {manifest.get('format')}")
+    return manifest
+
+
+def _load_part(path, version):
+    part = load_columnar(path)
+    if part.data_version != version:
+        raise ValueError(f"'{path}' không khớp với shards.json (dữ liệu được dựng lại giữa chừng?)")
+    return part
+
+
+def load_summary(out_dir, manifest=None):
+    """Bản tóm tắt dùng chung (POI, nhà và match_list của mọi người dùng) của out_dir."""
+    manifest = manifest or read_manifest(out_dir)
+    return _load_part(os.path.join(out_dir, SUMMARY_DIR), manifest["summary_version"])
+
+
+def home_location(summary, user_id):
+    """(lat, lon) nhà của user_id đọc thẳng từ các cột của bản tóm tắt (không dựng dict), None nếu không có."""
+    code = summary.users_by_id.code_of(user_id)
+    if code is None:
+        return None
+    return float(summary.cols["home_lat"][code]), float(summary.cols["home_lon"][code])
+
+
+class ShardStore(DataStore):
+    """
+    DataStore của một shard: người dùng / lịch trình riêng của shard ở dạng dict, lịch trình của các match
+    ở xa từ remote (ColumnarDataStore chỉ gồm lịch trình), POI từ bản tóm tắt dùng chung. Lịch trình của
+    người dùng khác (không thuộc shard, không là match của người dùng trong shard) không có ở đây:
+    schedules_of / schedule_arrays_of của họ báo LookupError thay vì âm thầm trả về rỗng. Chỉ đọc.
+    """
+
+    def __init__(self, name, summary, remote, users, schedules, data_version):
+        self.name = name
+        self.summary = summary
+        self.remote = remote
+        super().__init__(summary.pois, users, schedules)
+        self._data_version = data_version
+        self.remote_ids = frozenset(remote_matches(self.users, self.users_by_id))
+
+    def _build_poi_indexes(self):
+        # POI được nhân bản đầy đủ trong bản tóm tắt: dùng chung các chỉ mục của nó
+        self.pois_by_id = self.summary.pois_by_id
+        self.pois_by_category = self.summary.pois_by_category
+        self.poi_index = self.summary.poi_index
+
+    def is_local(self, user_id):
+        return user_id in self.users_by_id
+
+    def _schedule_source(self, user_id):
+        if self.is_local(user_id):
+            return None
+        if user_id in self.remote_ids:
+            return self.remote
+        raise LookupError(f"Shard '{self.name}' không có lịch trình của {user_id} (không thuộc shard và không là match ở xa)")
+
+    def get_schedule(self, schedule_id):
+        schedule = self.schedules_by_id.get(schedule_id)
+        return schedule if schedule is not None else self.remote.get_schedule(schedule_id)
+
+    def schedules_of(self, user_id):
+        source = self._schedule_source(user_id)
+        return super().schedules_of(user_id) if source is None else source.schedules_of(user_id)
+
+    def schedule_arrays_of(self, user_id):
+        source = self._schedule_source(user_id)
+        return super().schedule_arrays_of(user_id) if source is None else source.schedule_arrays_of(user_id)
+
+    def _before_mutation(self):
+        raise ValueError(f"Shard '{self.name}' chỉ đọc; hãy cập nhật dữ liệu gốc rồi dựng lại shard")
+
+
+def load_shard(out_dir, name, manifest=None):
+    """Mở shard name trong out_dir (dữ liệu riêng + lịch trình của match ở xa + bản tóm tắt dùng chung)."""
+    manifest = manifest or read_manifest(out_dir)
+    if name not in manifest["shards"]:
+        raise ValueError(f"Không có shard '{name}' trong {out_dir} (có: {sorted(manifest['shards'])})")
+    shard_dir = os.path.join(out_dir, name)
+    remote = _load_part(os.path.join(shard_dir, REMOTE_DIR), manifest["shards"][name]["remote_version"])
+    return ShardStore(name, load_summary(out_dir, manifest), remote, _read_records(shard_dir, "users"),
+                      _read_records(shard_dir, "daily_schedules"), manifest["data_version"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Phân mảnh dữ liệu theo vùng địa lý cho shard_server.py.")
+    parser.add_argument("--out", default="shards", help="Thư mục đầu ra (mặc định: %(default)s)")
+    parser.add_argument("--bounds", default=None, help="File JSON các vùng như generate_data --districts (mặc định: DISTRICT_BOUNDS)")
+    parser.add_argument("--halo-km", type=float, default=DEFAULT_HALO_KM, help="Độ rộng vùng halo (mặc định: %(default)s km)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    store = load_data()
+    shard_map = ShardMap(load_districts(args.bounds), halo_km=args.halo_km)
+    manifest = write_shards(store, args.out, shard_map)
+    print(f"-> Đã dựng {len(manifest['shards'])} shard trong {args.out} ({time.perf_counter() - started:.1f}s):")
+    for name, info in manifest["shards"].items():
+        print(f"   {name}: {info['users']}/{len(store.users)} người dùng, {info['schedules']}/{len(store.schedules)} lịch trình; "
+              f"match ở xa: {info['remote_users']} người dùng, {info['remote_schedules']} lịch trình")
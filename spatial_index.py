@@ -0,0 +1,83 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from geo_distance import one_to_many
+
+# Số km tối thiểu trên một độ vĩ (tại xích đạo, WGS84) - dùng để mở rộng hộp bao an toàn
+KM_PER_DEG_LAT_MIN = 110.574
+KM_PER_DEG_LON_EQUATOR = 111.320
+
+
+class PoiGridIndex:
+    """
+    Chỉ mục không gian dạng lưới lat/lon đều, phân vùng theo category.
+    Mỗi ô lưới giữ mảng chỉ số POI; truy vấn bán kính chỉ duyệt các ô giao với
+    hộp bao của hình tròn truy vấn, nên chi phí phụ thuộc mật độ cục bộ chứ không
+    phụ thuộc tổng số POI.
+    """
+
+    def __init__(self, pois, cell_km=0.5):
+        self.pois = pois
+        self.cell_km = cell_km
+        self.dlat = cell_km / KM_PER_DEG_LAT_MIN
+        self.dlon = cell_km / KM_PER_DEG_LON_EQUATOR
+        self.lats = np.array([p["latitude"] for p in pois], dtype=np.float64)
+        self.lons = np.array([p["longitude"] for p in pois], dtype=np.float64)
+
+        cells = defaultdict(lambda: defaultdict(list))
+        ci = np.floor(self.lats / self.dlat).astype(np.int64)
+        cj = np.floor(self.lons / self.dlon).astype(np.int64)
+        for idx, p in enumerate(pois):
+            cells[p["category"]][(int(ci[idx]), int(cj[idx]))].append(idx)
+        self.cells = {
+            cat: {cell: np.array(ids, dtype=np.int64) for cell, ids in by_cell.items()}
+            for cat, by_cell in cells.items()
+        }
+
+    def cell_of(self, lat, lon):
+        """Ô lưới chứa toạ độ (lat, lon) - dùng để gom các truy vấn gần nhau."""
+        return math.floor(lat / self.dlat), math.floor(lon / self.dlon)
+
+    def _candidate_indices(self, lat, lon, radius_km, categories):
+        # Hộp bao bảo thủ: dùng số km/độ nhỏ nhất để không bỏ sót POI ở rìa
+        span_lat = radius_km / KM_PER_DEG_LAT_MIN
+        max_abs_lat = min(abs(lat) + span_lat, 89.9)
+        span_lon = radius_km / (KM_PER_DEG_LON_EQUATOR * math.cos(math.radians(max_abs_lat)))
+        i0, i1 = math.floor((lat - span_lat) / self.dlat), math.floor((lat + span_lat) / self.dlat)
+        j0, j1 = math.floor((lon - span_lon) / self.dlon), math.floor((lon + span_lon) / self.dlon)
+
+        found = []
+        for cat in categories:
+            by_cell = self.cells.get(cat)
+            if not by_cell:
+                continue
+            # Khi hộp bao chứa nhiều ô hơn số ô đang có dữ liệu thì duyệt các ô có dữ liệu
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > len(by_cell):
+                found.extend(ids for (i, j), ids in by_cell.items() if i0 <= i <= i1 and j0 <= j <= j1)
+            else:
+                for i in range(i0, i1 + 1):
+                    for j in range(j0, j1 + 1):
+                        ids = by_cell.get((i, j))
+                        if ids is not None:
+                            found.append(ids)
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(found))
+
+    def within(self, point, radius_km, categories=None):
+        """
+        Trả về danh sách (poi, distance_km) của các POI trong bán kính radius_km quanh point
+        (dict có latitude/longitude), lọc theo categories (None = mọi category).
+        Kết quả giữ đúng thứ tự của danh sách POI gốc.
+        """
+        if categories is None:
+            categories = self.cells.keys()
+        lat, lon = point["latitude"], point["longitude"]
+        idx = self._candidate_indices(lat, lon, radius_km, categories)
+        if idx.size == 0:
+            return []
+        distances = one_to_many(lat, lon, self.lats[idx], self.lons[idx])
+        mask = distances <= radius_km
+        return [(self.pois[i], float(d)) for i, d in zip(idx[mask], distances[mask])]
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import random
+
+import metrics
+from activity_model_engine import (
+    cached_match_context,
+    generate_quest_candidates,
+    top_k_quests
+)
+
+
+# Các trường của to-do mà lõi mô hình dùng: kết quả tính sẵn chỉ được dùng khi các trường này trùng với
+# lịch trình đã lưu, và RNG nội dung chỉ phụ thuộc vào chúng (mô tả của to-do không ảnh hưởng kết quả)
+TODO_MATCH_FIELDS = ("schedule_id", "start_time", "end_time", "poi_id", "location")
+
+
+def todo_key(todo):
+    return {field: todo.get(field) for field in TODO_MATCH_FIELDS}
+
+
+def todo_fingerprint(todo):
+    """Hash chuẩn hoá (sha1, không phụ thuộc thứ tự khoá) của một to-do."""
+    canonical = json.dumps(todo, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def content_rng(user_id, todo):
+    """
+    RNG tất định cho phần nội dung của một cặp (người dùng, to-do): cùng đầu vào luôn cho cùng
+    tiêu đề / mô tả / gợi ý, nên kết quả từ cache, từ file tính sẵn và tính mới giống hệt nhau.
+    Chỉ băm các trường TODO_MATCH_FIELDS, giống điều kiện dùng kết quả tính sẵn: hai to-do chỉ khác
+    nhau ở mô tả (hoặc trường thừa) nhận cùng nội dung dù đi đường nào.
+    """
+    return random.Random(f"{user_id}:{todo_fingerprint(todo_key(todo))}")
+
+
+def build_suggestions(user_profile, original_todo, store, content_gen, k=3, context=None, poi_cache=None):
+    """
+    Chạy toàn bộ lõi mô hình cho một to-do: tạo ứng viên, lấy top-k và tạo nội dung hiển thị.
+    context / poi_cache cho phép dùng lại kết quả tra cứu giữa nhiều to-do của cùng người dùng.
+    Trả về (response_data, rank_stats).
+    """
+    rng = content_rng(user_profile["user_id"], original_todo)
+    if context is None:
+        with metrics.stage("match_context"):
+            context = cached_match_context(user_profile, store)
+
+    # Tạo ứng viên
+    with metrics.stage("candidates"):
+        candidates = generate_quest_candidates(original_todo, user_profile, store, context=context, poi_cache=poi_cache)
+
+    # Chấm điểm và lấy top-k gợi ý (branch-and-bound, kèm cặp đôi mục tiêu của từng ứng viên);
+    # top_k_quests tự đo hai giai đoạn bias_scoring và target_match
+    top_suggestions, rank_stats = top_k_quests(candidates, original_todo, user_profile, store, k=k, context=context)
+
+    # Tạo nội dung (một lượt cho cả top-k, dùng chung RNG tất định) và định dạng output
+    # Cặp đôi mục tiêu ('associatedMatch') đã được gắn khi chấm điểm
+    with metrics.stage("content"):
+        contents = content_gen.generate_batch(top_suggestions, store, rng=rng)
+    response_data = [
+        {
+            "quest_details": quest_struct, # Giữ lại dữ liệu gốc để debug hoặc dùng ở client
+            "display_content": content     # Dữ liệu sạch để hiển thị
+        }
+        for quest_struct, content in zip(top_suggestions, contents)
+    ]
+    return response_data, rank_stats
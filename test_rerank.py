@@ -0,0 +1,105 @@
+"""
+Kiểm tra rerank_without_matches (xếp hạng lại bằng delta) cho cùng kết quả với việc chạy lại toàn bộ
+generate_quest_candidates + rank_candidates trên store.without_users(các match bị loại).
+
+    python -m pytest -q test_rerank.py
+"""
+import os
+import random
+
+import pytest
+
+from activity_model_engine import (
+    generate_quest_candidates,
+    load_data,
+    rank_candidates,
+    rank_with_state,
+    rerank_without_matches,
+)
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+# Số người dùng được lấy mẫu (cố định seed để kết quả lặp lại được)
+N_USERS = 40
+TODOS_PER_USER = 2
+
+
+@pytest.fixture(scope="module")
+def store():
+    return load_data(DATA_DIR)
+
+
+def _sample_cases(store):
+    rng = random.Random(20240601)
+    users = [u for u in store.users if u["match_list"] and store.schedules_of(u["user_id"])]
+    cases = []
+    for user in rng.sample(users, min(N_USERS, len(users))):
+        todos = store.schedules_of(user["user_id"])
+        for todo in rng.sample(todos, min(TODOS_PER_USER, len(todos))):
+            cases.append((user, todo))
+    return cases
+
+
+def _removed_subsets(user, state, rng):
+    """Các tập match bị loại: mục tiêu, một match khác, nhiều match (có / không có mục tiêu), tất cả."""
+    match_ids = [m["match_id"] for m in user["match_list"]]
+    target = state.target_match_id
+    others = [m for m in match_ids if m != target]
+    subsets = [match_ids]
+    if target is not None:
+        subsets.append([target])
+    if others:
+        subsets.append([rng.choice(others)])
+    if len(others) >= 2:
+        subsets.append(rng.sample(others, 2))
+        if target is not None:
+            subsets.append([target] + rng.sample(others, 2))
+    subsets.append(["USER_KHONG_TON_TAI"])
+    return subsets
+
+
+def _summary(ranked):
+    return [(c["candidate_id"], c["final_score"], c["scores_breakdown"], c["associatedMatch"]) for c in ranked]
+
+
+def _full_rerun(store, user, todo, removed):
+    store_without = store.without_users(removed)
+    candidates = generate_quest_candidates(todo, user, store_without)
+    return rank_candidates(candidates, todo, user, store_without)
+
+
+def test_rerank_matches_full_rerun(store):
+    rng = random.Random(7)
+    cases = _sample_cases(store)
+    assert cases
+    checked = 0
+    for user, todo in cases:
+        _, state = rank_with_state(todo, user, store)
+        if state is None:
+            continue
+        for removed in _removed_subsets(user, state, rng):
+            delta, _ = rerank_without_matches(state, removed, todo, store)
+            full = _full_rerun(store, user, todo, removed)
+            assert _summary(delta) == _summary(full), (user["user_id"], todo["schedule_id"], removed)
+            checked += 1
+    assert checked >= len(cases)
+
+
+def test_rerank_is_chainable(store):
+    """Loại lần lượt từng match (dùng new_state của lần trước) phải khớp với loại cả nhóm một lần."""
+    for user, todo in _sample_cases(store)[:10]:
+        _, state = rank_with_state(todo, user, store)
+        if state is None:
+            continue
+        removed = []
+        for match in user["match_list"][:3]:
+            removed.append(match["match_id"])
+            delta, state = rerank_without_matches(state, [match["match_id"]], todo, store)
+            assert _summary(delta) == _summary(_full_rerun(store, user, todo, removed)), (user["user_id"], removed)
+
+
+def test_rerank_does_not_modify_previous_ranking(store):
+    user, todo = _sample_cases(store)[0]
+    ranked, state = rank_with_state(todo, user, store)
+    before = _summary(ranked)
+    rerank_without_matches(state, [m["match_id"] for m in user["match_list"]], todo, store)
+    assert _summary(ranked) == before
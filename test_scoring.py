@@ -0,0 +1,129 @@
+"""
+Kiểm tra các đường chấm điểm nhanh cho cùng kết quả với đường tham chiếu trên mọi to-do của dữ liệu đi kèm:
+  - score_candidates (vector hoá) với score_quest + find_target_match_for_quest (vô hướng);
+  - top_k_quests (branch-and-bound) với rank_candidates(...)[:k], kể cả khi hoà / gần hoà điểm;
+  - hai nhánh của _match_contributions (ma trận đầy đủ / chỉ mục khoảng thời gian) trên cùng context.
+
+    python -m pytest -q test_scoring.py
+"""
+import os
+import random
+
+import numpy as np
+import pytest
+
+import activity_model_engine
+from activity_model_engine import (
+    _candidate_arrays,
+    _match_contributions,
+    build_match_context,
+    generate_quest_candidates,
+    load_data,
+    rank_candidates,
+    score_candidates,
+    score_quest,
+    top_k_quests,
+)
+from run_scenarios import find_target_match_for_quest
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope="module")
+def store():
+    return load_data(DATA_DIR)
+
+
+def _todo_cases(store):
+    """(người dùng, to-do, ứng viên) cho mọi to-do có người dùng và có ứng viên."""
+    cases = []
+    for todo in store.schedules:
+        user = store.get_user(todo["user_id"])
+        if user is None:
+            continue
+        candidates = generate_quest_candidates(todo, user, store)
+        if candidates:
+            cases.append((user, todo, candidates))
+    return cases
+
+
+@pytest.fixture(scope="module")
+def cases(store):
+    cases = _todo_cases(store)
+    assert cases
+    return cases
+
+
+def test_score_candidates_matches_scalar_path(store, cases):
+    for user, todo, candidates in cases:
+        scored = score_candidates(candidates, todo, user, store)
+        for cand, final_score, breakdown, target in zip(candidates, scored.scores, scored.breakdowns, scored.target_matches):
+            expected_score, expected_breakdown = score_quest(cand, todo, user, store)
+            assert float(final_score) == pytest.approx(expected_score, rel=1e-12, abs=1e-12), (todo["schedule_id"], cand["candidate_id"])
+            for key, value in expected_breakdown.items():
+                assert breakdown[key] == pytest.approx(value, rel=1e-12, abs=1e-12), (todo["schedule_id"], cand["candidate_id"], key)
+            assert target == find_target_match_for_quest(cand, user, store), (todo["schedule_id"], cand["candidate_id"])
+
+
+def _summary(ranked):
+    return [(c["candidate_id"], c["final_score"], c["scores_breakdown"], c["associatedMatch"]) for c in ranked]
+
+
+def _assert_top_k_matches(store, user, todo, candidates, k, chunk_size=16):
+    expected = rank_candidates([dict(c) for c in candidates], todo, user, store)[:k]
+    top, stats = top_k_quests([dict(c) for c in candidates], todo, user, store, k=k, chunk_size=chunk_size)
+    assert _summary(top) == _summary(expected), (todo["schedule_id"], k, chunk_size)
+    assert stats["scored"] + stats["pruned"] == stats["total"] == len(candidates)
+
+
+def test_top_k_matches_full_ranking(store, cases):
+    for user, todo, candidates in cases:
+        for k in (1, 3):
+            _assert_top_k_matches(store, user, todo, candidates, k)
+    # Lô nhỏ: cắt tỉa được quyết định sau từng ứng viên
+    for user, todo, candidates in cases[::10]:
+        _assert_top_k_matches(store, user, todo, candidates, 3, chunk_size=1)
+        _assert_top_k_matches(store, user, todo, candidates, len(candidates), chunk_size=2)
+
+
+def test_top_k_with_buffer_candidates(store, cases):
+    with_buffers = [c for c in cases if any(q["type"] == "buffer_activity" for q in c[2])]
+    assert with_buffers
+    for user, todo, candidates in with_buffers:
+        # Chỉ còn hoạt động đệm + to-do gốc: hoạt động đệm luôn phải cạnh tranh vào top-k
+        subset = [candidates[0]] + [q for q in candidates if q["type"] == "buffer_activity"]
+        for k in (1, 2, 5):
+            _assert_top_k_matches(store, user, todo, subset, k, chunk_size=1)
+
+
+def test_top_k_ties_and_near_ties(store, cases):
+    rng = random.Random(11)
+    for user, todo, candidates in rng.sample(cases, 60):
+        tied = []
+        for i, cand in enumerate(candidates):
+            # Bản sao y hệt (hoà tuyệt đối: ứng viên đứng trước thắng) và bản lệch ~1mm (gần hoà)
+            tied.append(dict(cand, candidate_id=f"{cand['candidate_id']}_A{i}"))
+            tied.append(dict(cand, candidate_id=f"{cand['candidate_id']}_B{i}"))
+            loc = cand["location"]
+            tied.append(dict(cand, candidate_id=f"{cand['candidate_id']}_C{i}",
+                             location={"latitude": loc["latitude"] + 1e-8, "longitude": loc["longitude"] - 1e-8}))
+        rng.shuffle(tied)
+        for k in (1, 3, 4):
+            _assert_top_k_matches(store, user, todo, tied, k, chunk_size=rng.choice((1, 3, 16)))
+
+
+def test_match_contributions_interval_path_matches_dense(store, cases, monkeypatch):
+    # Dữ liệu đi kèm chỉ có vài chục lịch trình mỗi context nên mặc định luôn đi nhánh ma trận đầy đủ;
+    # đặt ngưỡng âm để ép nhánh chỉ mục khoảng thời gian rồi so từng bit với nhánh đầy đủ
+    for user, todo, candidates in cases:
+        context = build_match_context(user, store)
+        starts, ends, lats, lons, _ = _candidate_arrays(candidates)
+        assert context.starts.size <= activity_model_engine.DENSE_CONTRIBUTIONS_MAX_SCHEDULES
+        dense = _match_contributions(starts, ends, lats, lons, context)
+        with monkeypatch.context() as m:
+            m.setattr(activity_model_engine, "DENSE_CONTRIBUTIONS_MAX_SCHEDULES", -1)
+            via_intervals = _match_contributions(starts, ends, lats, lons, context)
+            top, _ = top_k_quests([dict(c) for c in candidates], todo, user, store, k=3, context=context)
+        assert np.array_equal(dense, via_intervals), todo["schedule_id"]
+        expected, _ = top_k_quests([dict(c) for c in candidates], todo, user, store, k=3, context=context)
+        assert _summary(top) == _summary(expected), todo["schedule_id"]
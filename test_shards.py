@@ -0,0 +1,51 @@
+"""
+Kiểm tra chế độ nhiều shard cho cùng gợi ý với DataStore đầy đủ: dựng shard từ dữ liệu đi kèm (có và không
+có halo), định tuyến mọi to-do bằng ShardMap.route như shard_server rồi so build_suggestions trên shard
+được chọn với build_suggestions trên toàn bộ dữ liệu.
+
+    python -m pytest -q test_shards.py
+"""
+import os
+
+import pytest
+
+from activity_model_engine import load_data
+from content_generator import ContentGenerator
+from generate_data import load_districts
+from shard_store import ShardMap, home_location, load_shard, load_summary, write_shards
+from suggestion_pipeline import build_suggestions
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope="module")
+def store():
+    return load_data(DATA_DIR)
+
+
+@pytest.fixture(scope="module")
+def content_gen():
+    return ContentGenerator(os.path.join(DATA_DIR, "templates.json"))
+
+
+@pytest.mark.parametrize("halo_km", [0.0, 1.0])
+def test_shards_match_full_store(store, content_gen, tmp_path, halo_km):
+    shard_map = ShardMap(load_districts(), halo_km=halo_km)
+    manifest = write_shards(store, str(tmp_path), shard_map)
+    summary = load_summary(str(tmp_path), manifest)
+    shards = {name: load_shard(str(tmp_path), name, manifest) for name in shard_map.names}
+
+    checked = 0
+    for todo in store.schedules:
+        user = store.get_user(todo["user_id"])
+        if user is None:
+            continue
+        location = todo["location"]
+        name = shard_map.route(location["latitude"], location["longitude"], *home_location(summary, user["user_id"]))
+        shard = shards[name]
+        assert shard.is_local(user["user_id"]), (todo["schedule_id"], name)
+        expected, _ = build_suggestions(user, todo, store, content_gen)
+        actual, _ = build_suggestions(shard.get_user(user["user_id"]), todo, shard, content_gen)
+        assert actual == expected, (todo["schedule_id"], name)
+        checked += 1
+    assert checked == len(store.schedules)
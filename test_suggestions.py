@@ -0,0 +1,54 @@
+"""
+Kiểm tra /suggest trả về cùng gợi ý (kể cả nội dung hiển thị) dù lấy từ file tính sẵn, từ cache response
+hay tính mới, kể cả khi to-do gửi lên chỉ khác lịch trình đã lưu ở mô tả.
+
+    python -m pytest -q test_suggestions.py
+"""
+import pytest
+
+import api_server
+import precompute_suggestions
+from content_generator import ContentGenerator
+from precompute_suggestions import PrecomputedSuggestions
+from response_cache import ResponseCache
+
+N_TODOS = 20
+
+
+@pytest.fixture(scope="module")
+def precomputed():
+    """Kết quả tính sẵn cho N_TODOS lịch trình đầu tiên, tính bằng đúng hàm của precompute_suggestions."""
+    precompute_suggestions._store = api_server.store
+    precompute_suggestions._content_gen = ContentGenerator()
+    schedule_ids = [s["schedule_id"] for s in api_server.store.schedules[:N_TODOS]]
+    _, records, _ = precompute_suggestions._process_chunk(schedule_ids)
+    return PrecomputedSuggestions({r["schedule_id"]: r for r in records if r["suggestions"] is not None})
+
+
+def _suggest(client, todo):
+    response = client.post("/suggest", json={"user_id": todo["user_id"], "todo": todo})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+@pytest.mark.parametrize("description", [None, "Một mô tả khác hẳn"], ids=["same_description", "other_description"])
+def test_precomputed_cached_and_fresh_agree(monkeypatch, precomputed, description):
+    assert len(precomputed)
+    client = api_server.app.test_client()
+    for schedule_id in precomputed.records:
+        todo = dict(api_server.store.get_schedule(schedule_id))
+        if description is not None:
+            todo["description"] = description
+
+        monkeypatch.setattr(api_server, "suggest_cache", ResponseCache())
+        monkeypatch.setattr(api_server, "precomputed", precomputed)
+        from_precomputed = _suggest(client, todo)
+
+        cache = ResponseCache()
+        monkeypatch.setattr(api_server, "suggest_cache", cache)
+        monkeypatch.setattr(api_server, "precomputed", PrecomputedSuggestions())
+        fresh = _suggest(client, todo)
+        cached = _suggest(client, todo)
+        assert cache.stats()["hits"] == 1
+
+        assert from_precomputed == fresh == cached, schedule_id
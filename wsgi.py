@@ -0,0 +1,27 @@
+"""
+Entry point production cho gunicorn (xem gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Với preload_app, module này được import MỘT LẦN trong master: dữ liệu được tải, các chỉ mục lười
+được dựng sẵn, rồi mọi object hiện có được gc.freeze() trước khi fork. Các worker đọc chung các trang
+bộ nhớ đó (copy-on-write) mà không làm bẩn chúng bằng các lần quét của GC.
+"""
+import gc
+import os
+
+# Tắt GC trong lúc tải để không có lần quét nào chạm vào dữ liệu vừa tạo; bật lại sau khi freeze
+gc.disable()
+
+from api_server import app, store  # noqa: E402
+
+if os.getenv("WARM_MATCH_INDEX", "1") == "1":
+    # Dựng sẵn chỉ mục cho /match trong master thay vì ở từng worker
+    store.match_index
+if os.getenv("WARM_MATCH_GRAPH", "1") == "1":
+    # Đồ thị match CSR và bảng cơ hội gặp gỡ cho /match?user_id=...
+    store.match_graph
+
+gc.collect()
+gc.freeze()
+gc.enable()